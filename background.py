@@ -0,0 +1,58 @@
+import threading
+
+# ==========================================
+# ⏱️ TAREAS PERIÓDICAS EN SEGUNDO PLANO
+# ==========================================
+# Hilos daemon por worker para trabajos de mantenimiento (flush de buffers,
+# refrescos, archivado). Se arrancan en el startup de FastAPI y se detienen
+# en el shutdown, donde corren una última vez para no perder datos.
+
+class PeriodicTask:
+    def __init__(self, name, interval, fn, run_on_stop=True):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.run_on_stop = run_on_stop
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run_once(self):
+        try:
+            self.fn()
+        except Exception as e:
+            print(f"❌ Tarea '{self.name}' falló: {e}")
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._run_once()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+            print(f"⏱️ Tarea '{self.name}' cada {self.interval}s")
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=self.interval + 5)
+            self._thread = None
+            if self.run_on_stop:
+                self._run_once()
+
+
+_tasks = []
+
+def register_task(name, interval, fn, run_on_stop=True):
+    task = PeriodicTask(name, interval, fn, run_on_stop)
+    _tasks.append(task)
+    return task
+
+def start_background_tasks():
+    for task in _tasks:
+        task.start()
+
+def stop_background_tasks():
+    for task in reversed(_tasks):
+        task.stop()
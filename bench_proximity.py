@@ -0,0 +1,146 @@
+"""Micro-benchmark del motor de proximidad (proximity.py).
+
+Uso:
+    python bench_proximity.py [usuarios]
+
+Siembra N usuarios en vivo (por defecto 100.000: la mitad concentrada en
+Santiago, el resto repartido por América) y mide consultas por radio y
+k-vecinos, sobre el índice de un worker (ProximityIndex) y sobre la tabla en
+memoria compartida (SharedLiveTable, la que usa producción). Objetivo: pocos
+milisegundos por consulta con 100k usuarios. No toca la base.
+
+Antes de medir compara ambos índices contra un recorrido a fuerza bruta sobre
+una tabla casi vacía (radio que cubre el globo, k-vecinos con menos usuarios
+que k): las filas libres no deben aparecer como skaters.
+"""
+import os
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+
+import numpy as np
+
+from proximity import ProximityIndex, chord_to_m, chord_sq, unit_vector
+from shared_positions import SharedLiveTable
+
+SANTIAGO = (-33.4429, -70.6341)
+QUERIES = 200
+
+
+def seed(index, n):
+    rng = np.random.default_rng(7)
+    half = n // 2
+    lats = np.concatenate([SANTIAGO[0] + rng.normal(0, 0.15, half), rng.uniform(-55, 60, n - half)])
+    lons = np.concatenate([SANTIAGO[1] + rng.normal(0, 0.15, half), rng.uniform(-120, -35, n - half)])
+    now = time.time()
+    start = time.perf_counter()
+    for user_id, lat, lon, age in zip(range(1, n + 1), lats.tolist(), lons.tolist(),
+                                      rng.uniform(0, 600, n).tolist()):
+        index.upsert(user_id, lat, lon, now - age, visible=True)
+    per_upsert_us = (time.perf_counter() - start) / n * 1e6
+    return per_upsert_us
+
+
+def timed(fn):
+    samples = []
+    for _ in range(QUERIES):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1], len(result[0])
+
+
+def check_sparse(label, index):
+    """Pocos usuarios (uno vencido) en un índice vacío: within/nearest deben
+    devolver lo mismo que un recorrido a fuerza bruta."""
+    now = time.time()
+    users = {7: (-33.44, -70.63, now), 8: (-33.45, -70.64, now), 9: (40.71, -74.0, now),
+             10: (35.68, 139.69, now), 11: (-33.46, -70.65, now - 900)}
+    for user_id, (lat, lon, last_seen) in users.items():
+        index.upsert(user_id, lat, lon, last_seen, visible=True)
+    cutoff = now - 300
+    lat, lon = SANTIAGO
+
+    def brute(radius_m=None, k=None, exclude_id=None, since=cutoff):
+        center = unit_vector(lat, lon)
+        found = []
+        for user_id, (u_lat, u_lon, last_seen) in users.items():
+            if last_seen < since or user_id == exclude_id:
+                continue
+            dist = float(chord_to_m(chord_sq(center, *(np.array([c]) for c in unit_vector(u_lat, u_lon))))[0])
+            if radius_m is None or dist <= radius_m:
+                found.append((dist, user_id))
+        return [user_id for _, user_id in sorted(found)[:k]]
+
+    cases = [
+        ("radio 20.000 km", index.within(lat, lon, 20_000_000, cutoff), brute(20_000_000)),
+        ("radio 20.000 km sin 7", index.within(lat, lon, 20_000_000, cutoff, exclude_id=7), brute(20_000_000, exclude_id=7)),
+        ("radio 20.000 km sin cutoff", index.within(lat, lon, 20_000_000), brute(20_000_000, since=0.0)),
+        ("radio 5 km", index.within(lat, lon, 5_000, cutoff), brute(5_000)),
+        ("k=20 vecinos", index.nearest(lat, lon, 20, cutoff), brute(k=20)),
+        ("k=20 vecinos sin cutoff", index.nearest(lat, lon, 20), brute(k=20, since=0.0)),
+        ("k=2 vecinos", index.nearest(lat, lon, 2, cutoff), brute(k=2)),
+        ("k=20 vecinos en 5 km", index.nearest(lat, lon, 20, cutoff, radius_m=5_000), brute(5_000, k=20)),
+    ]
+    for name, result, expected in cases:
+        got = result[0].tolist()
+        assert got == expected, f"{label}, {name}: {got} != {expected}"
+    index.remove_older_than(cutoff)
+    assert len(index) == 4, f"{label}: len {len(index)} != 4"
+    print(f"✅ {label}: consultas sobre tabla casi vacía iguales a fuerza bruta")
+
+
+def run_cases(label, index, n):
+    per_upsert_us = seed(index, n)
+    cutoff = time.time() - 300
+    lat, lon = SANTIAGO
+    print(f"🧮 {label}: {n} usuarios en vivo, upsert: {per_upsert_us:.2f} µs/latido\n")
+
+    cases = [
+        ("radio 2 km", lambda: index.within(lat, lon, 2_000, cutoff, exclude_id=1)),
+        ("radio 20 km", lambda: index.within(lat, lon, 20_000, cutoff, exclude_id=1)),
+        ("radio 12.000 km", lambda: index.within(lat, lon, 12_000_000, cutoff, exclude_id=1)),
+        ("k=20 vecinos", lambda: index.nearest(lat, lon, 20, cutoff, exclude_id=1)),
+        ("k=20 vecinos en 5 km", lambda: index.nearest(lat, lon, 20, cutoff, exclude_id=1, radius_m=5_000)),
+    ]
+    print(f"{'consulta':<24}{'p50 ms':>9}{'p95 ms':>9}{'filas':>9}")
+    for name, fn in cases:
+        p50, p95, rows = timed(fn)
+        print(f"{name:<24}{p50:>9.3f}{p95:>9.3f}{rows:>9}")
+
+    start = time.perf_counter()
+    removed = index.remove_older_than(cutoff)
+    print(f"\nexpirar {len(removed)} inactivos: {(time.perf_counter() - start) * 1000:.2f} ms\n")
+
+
+@contextmanager
+def bench_table(suffix):
+    """Segmento propio del benchmark: no se mezcla con el de un servidor corriendo."""
+    name = f"skate_live_bench_{os.getpid()}_{suffix}"
+    table = SharedLiveTable(reuse_after=300, name=name, lock_path=f"/tmp/{name}.lock")
+    try:
+        yield table
+    finally:
+        table.close()
+        resource_tracker.register(table._shm._name, "shared_memory")   # _attach lo desregistró
+        table._shm.unlink()
+        os.remove(f"/tmp/{name}.lock")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    check_sparse("índice local", ProximityIndex())
+    with bench_table("sparse") as table:
+        check_sparse("tabla compartida", table)
+    print()
+
+    run_cases("índice local", ProximityIndex(), n)
+    with bench_table("load") as table:
+        run_cases("tabla compartida", table, n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""Regresión de planes: corre EXPLAIN sobre las queries calientes de los endpoints
+contra un Postgres local sembrado y falla si alguna cae en Seq Scan.
+
+Uso (con la base local de init_local_db / DATABASE_URL):
+    python check_query_plans.py
+
+Los datos de prueba se insertan dentro de una transacción que se revierte al final,
+así que la base queda igual. Con `enable_seqscan = off` el planner solo elige un
+Seq Scan cuando NO hay índice utilizable, que es justo lo que queremos detectar.
+El SQL se importa de los módulos de los endpoints (constantes *_SQL y los
+armadores de las queries dinámicas; las de main.py y del radar están en
+queries.py): si agregas una query nueva, súmala a HOT_QUERIES. Ninguno de esos
+imports levanta la app ni la tabla compartida del radar.
+"""
+import json
+import re
+import sys
+from datetime import datetime, timedelta
+
+import queries
+from database import get_db
+from migrations import run_migrations
+from feed_ranking import REFRESH_HOT_SCORES_SQL, HOT_WINDOW_DAYS
+from gps_buffer import FLUSH_GPS_SQL
+from like_counters import FLUSH_LIKES_SQL, RECONCILE_LIKES_SQL, like_count_drift_sql
+from map_endpoints import CLUSTERS_SQL, SPOTS_TILE_SQL, CLUSTER_GRID
+from posts_endpoints import (recent_feed_sql, hot_feed_sql, nearby_feed_sql, VIEWER_LOCATION_SQL,
+                             LIKED_POST_IDS_SQL, TOGGLE_LIKE_SQL, BUMP_COMMENTS_COUNT_SQL,
+                             POST_COMMENTS_SQL, IS_ADMIN_SQL, POST_OWNER_SQL, DELETE_POST_LIKES_SQL,
+                             DELETE_POST_COMMENTS_SQL, DELETE_POST_SQL, POST_COMMENT_OWNER_SQL,
+                             DELETE_POST_COMMENT_SQL, NEARBY_RADIUS_M, NEARBY_WINDOW_DAYS)
+from unread_counters import UNREAD_TOTAL_SQL
+
+SEED_SQL = """
+    INSERT INTO usuarios (nickname, visible, ubicacion_actual, ultima_conexion, mejor_puntaje)
+    SELECT 'plan_' || g, true,
+           ST_SetSRID(ST_MakePoint(-70.6 + random(), -33.4 + random()), 4326),
+           NOW() - random() * INTERVAL '10 minutes',
+           (random() * 1000)::int
+    FROM generate_series(1, 5000) g;
+
+    INSERT INTO spots (nombre, tipo, coordenadas)
+    SELECT 'spot_' || g, 'street', ST_SetSRID(ST_MakePoint(-70.6 + random(), -33.4 + random()), 4326)
+    FROM generate_series(1, 3000) g;
+
+    INSERT INTO mensajes (id_remitente, id_destinatario, texto, leido, fecha_envio)
+    SELECT u1, u2, 'hola', random() < 0.8, NOW() - random() * INTERVAL '90 days'
+    FROM (
+        SELECT (SELECT MIN(id_usuario) FROM usuarios WHERE nickname LIKE 'plan\\_%') + (random() * 200)::int AS u1,
+               (SELECT MIN(id_usuario) FROM usuarios WHERE nickname LIKE 'plan\\_%') + (random() * 200)::int AS u2
+        FROM generate_series(1, 50000)
+    ) pares;
+
+    INSERT INTO conversaciones (usuario_a, usuario_b, id_ultimo_mensaje, ultimo_texto, fecha_ultimo_mensaje)
+    SELECT LEAST(id_remitente, id_destinatario), GREATEST(id_remitente, id_destinatario),
+           MAX(id_mensaje), 'hola', MAX(fecha_envio)
+    FROM mensajes
+    GROUP BY 1, 2
+    ON CONFLICT DO NOTHING;
+
+    INSERT INTO contadores_no_leidos (id_usuario, total)
+    SELECT id_usuario, (random() * 20)::int FROM usuarios WHERE nickname LIKE 'plan\\_%'
+    ON CONFLICT DO NOTHING;
+
+    INSERT INTO comentarios (id_spot, id_usuario, texto)
+    SELECT s.id_spot, u.id_usuario, 'buen spot'
+    FROM (SELECT id_spot FROM spots ORDER BY id_spot DESC LIMIT 3000) s
+    CROSS JOIN LATERAL (SELECT id_usuario FROM usuarios ORDER BY id_usuario DESC LIMIT 5) u;
+
+    INSERT INTO posts (id_usuario, texto, fecha_creacion)
+    SELECT id_usuario, 'post', NOW() - random() * INTERVAL '180 days'
+    FROM usuarios, generate_series(1, 2) WHERE nickname LIKE 'plan\\_%';
+
+    INSERT INTO post_comments (id_post, id_usuario, texto)
+    SELECT id_post, id_usuario, 'comentario' FROM posts, generate_series(1, 2);
+
+    INSERT INTO game_sessions (id_usuario, session_token, fecha_inicio, fecha_expiracion)
+    SELECT id_usuario, md5(random()::text || g), NOW() - g * INTERVAL '1 hour', NOW()
+    FROM usuarios, generate_series(1, 4) g WHERE nickname LIKE 'plan\\_%';
+
+    INSERT INTO transacciones_puntos (id_usuario, cantidad, tipo_transaccion, fecha_creacion)
+    SELECT id_usuario, 10, 'game_score', NOW() - g * INTERVAL '1 hour'
+    FROM usuarios, generate_series(1, 4) g WHERE nickname LIKE 'plan\\_%';
+
+    INSERT INTO duelos (challenger_id, opponent_id, estado)
+    SELECT id_usuario, id_usuario + 1, CASE WHEN random() < 0.1 THEN 'pendiente' ELSE 'finalizado' END
+    FROM usuarios WHERE nickname LIKE 'plan\\_%';
+
+    ANALYZE;
+"""
+
+# (endpoint, tablas que NO pueden caer en Seq Scan, sql, params(muestra) -> argumentos)
+# El SQL es el mismo que ejecutan los endpoints (importado de cada módulo); los
+# argumentos salen de los ids sembrados (ver sample_params).
+# Tablas vacías = solo se valida que el SQL siga vigente: recorren la tabla a propósito.
+HOT_QUERIES = [
+    # --- chat ---
+    ("POST /api/messages (resumen)", {"conversaciones"}, queries.CONVERSATION_SUMMARY_UPSERT_SQL,
+     lambda p: (p["u1"], p["u2"], p["msg"], "hola", p["now"], queries.MESSAGE_PREVIEW_CHARS)),
+    ("POST /api/messages (badge)", {"contadores_no_leidos"}, queries.UNREAD_INCREMENT_SQL,
+     lambda p: (p["u2"],)),
+    ("GET /api/messages/conversation (resumen)", {"conversaciones"}, queries.FIRST_MESSAGE_SQL,
+     lambda p: {"u1": p["u1"], "u2": p["u2"]}),
+    ("GET /api/messages/conversation", {"mensajes"}, queries.conversation_history_sql(False, False),
+     lambda p: {"u1": p["u1"], "u2": p["u2"], "desde": p["hot"], "limit": 51}),
+    ("GET /api/messages/conversation?before_id=", {"mensajes"}, queries.conversation_history_sql(False, True),
+     lambda p: {"u1": p["u1"], "u2": p["u2"], "desde": p["hot"], "cursor": p["msg"], "limit": 51}),
+    ("GET /api/messages/conversation?after_id=", {"mensajes"}, queries.conversation_history_sql(True, True),
+     lambda p: {"u1": p["u1"], "u2": p["u2"], "desde": p["hot"], "cursor": p["msg"], "limit": 51}),
+    ("GET /api/messages/conversation (cursor reciente)", {"mensajes"}, queries.CURSOR_IN_WINDOW_SQL,
+     lambda p: (p["msg"], p["hot"])),
+    ("GET /api/messages/conversation (participantes)", {"usuarios"}, queries.PARTICIPANTS_SQL,
+     lambda p: (p["u1"], p["u2"])),
+    ("POST /api/messages/conversation (resumen)", {"conversaciones"}, queries.FIRST_MESSAGE_ASYNC_SQL,
+     lambda p: (p["u1"], p["u2"])),
+    ("POST /api/messages/conversation", {"mensajes"}, queries.conversation_history_async_sql(False, True, 50),
+     lambda p: (p["u1"], p["u2"], p["hot"], p["msg"])),
+    ("POST /api/messages/conversation (after_id)", {"mensajes"}, queries.conversation_history_async_sql(True, True, 50),
+     lambda p: (p["u1"], p["u2"], p["hot"], p["msg"])),
+    ("POST /api/messages/conversation (cursor reciente)", {"mensajes"}, queries.CURSOR_IN_WINDOW_ASYNC_SQL,
+     lambda p: (p["msg"], p["hot"])),
+    ("POST /api/messages/conversation (participantes)", {"usuarios"}, queries.PARTICIPANTS_ASYNC_SQL,
+     lambda p: (p["u1"], p["u2"])),
+    ("GET /api/messages/unread", {"conversaciones"}, queries.UNREAD_BY_SENDER_SQL,
+     lambda p: (p["u1"], p["u1"])),
+    ("GET /api/messages/unread/count", {"contadores_no_leidos"}, UNREAD_TOTAL_SQL.format(p="%s"),
+     lambda p: (p["u1"],)),
+    ("POST /api/messages/mark_read (lock)", {"conversaciones"}, queries.MARK_READ_LOCK_SQL,
+     lambda p: {"lector": p["u1"], "remitente": p["u2"]}),
+    ("POST /api/messages/mark_read", {"mensajes"}, queries.MARK_READ_SQL,
+     lambda p: {"lector": p["u1"], "remitente": p["u2"], "desde": p["hot"]}),
+    ("POST /api/messages/mark_read (resumen)", {"conversaciones"}, queries.MARK_READ_SUMMARY_SQL,
+     lambda p: {"lector": p["u1"], "remitente": p["u2"], "n": 1}),
+    ("POST /api/messages/mark_read (badge)", {"contadores_no_leidos"}, queries.UNREAD_DECREMENT_SQL,
+     lambda p: (1, p["u1"])),
+    ("GET /api/messages/conversations/{user_id}", {"conversaciones"}, queries.USER_CONVERSATIONS_SQL,
+     lambda p: (p["u1"], p["u1"])),
+
+    # --- usuarios y radar ---
+    ("GET /api/debug/admins", set(), queries.DEBUG_ADMINS_SQL, lambda p: None),
+    ("POST /api/users/status", {"usuarios"}, queries.SET_VISIBLE_SQL, lambda p: (True, p["u1"])),
+    ("POST /api/login/", {"usuarios"}, queries.LOGIN_SQL, lambda p: (p["nick"], "x")),
+    ("PUT /api/users/{id_usuario}/profile", {"usuarios"}, queries.UPDATE_PROFILE_SQL,
+     lambda p: ("", 0, "", "", "Regular", "", p["u1"])),
+    ("GET /api/users/", set(), queries.USERS_LIST_SQL, lambda p: (p["u1"],)),
+    ("GET /api/users/{id_usuario}/stats", {"usuarios"}, queries.USER_STATS_SQL, lambda p: (p["u1"],)),
+    ("GET /api/radar (perfiles)", {"usuarios"}, queries.PROFILES_SQL, lambda p: ([p["u1"], p["u2"]],)),
+    ("precarga del radar", set(), queries.WARM_LIVE_SQL, lambda p: (300,)),   # LIVE_TTL por defecto
+    ("flush de latidos GPS", {"usuarios"}, FLUSH_GPS_SQL,
+     lambda p: ([p["u1"], p["u2"]], [-33.4, -33.5], [-70.6, -70.7], [1.0, 2.0])),
+
+    # --- spots y mapa ---
+    ("GET /api/spots", {"comentarios"}, queries.spots_sql(),
+     lambda p: (queries.DEFAULT_COMMENT_AVATAR, queries.SPOT_COMMENTS_PREVIEW)),
+    ("GET /api/spots?bbox=", {"spots", "comentarios"}, queries.spots_sql(bbox=True),
+     lambda p: (queries.DEFAULT_COMMENT_AVATAR, queries.SPOT_COMMENTS_PREVIEW, -70.7, -33.5, -70.5, -33.3, 200)),
+    ("GET /api/spots?near=", {"spots", "comentarios"}, queries.spots_sql(near=True),
+     lambda p: (-70.6, -33.4, queries.DEFAULT_COMMENT_AVATAR, queries.SPOT_COMMENTS_PREVIEW, -70.6, -33.4, 200)),
+    ("GET /api/spots/{id_spot}/comments", {"comentarios"}, queries.spot_comments_sql(False),
+     lambda p: (queries.DEFAULT_COMMENT_AVATAR, p["spot"], 20)),
+    ("GET /api/spots/{id_spot}/comments?before_id= (cursor)", {"comentarios"}, queries.SPOT_COMMENT_CURSOR_SQL,
+     lambda p: (p["comment"], p["spot"])),
+    ("GET /api/spots/{id_spot}/comments?before_id=", {"comentarios"}, queries.spot_comments_sql(True),
+     lambda p: (queries.DEFAULT_COMMENT_AVATAR, p["spot"], p["now"], p["comment"], 20)),
+    ("DELETE /api/spots/{id_spot} (comentarios)", {"comentarios"}, queries.DELETE_SPOT_COMMENTS_SQL,
+     lambda p: (p["spot"],)),
+    ("DELETE /api/spots/{id_spot}", {"spots"}, queries.DELETE_SPOT_SQL, lambda p: (p["spot"],)),
+    ("DELETE /api/comments/{id} (dueño)", {"comentarios"}, queries.COMMENT_OWNER_SQL, lambda p: (p["comment"],)),
+    ("DELETE /api/comments/{id}", {"comentarios"}, queries.DELETE_COMMENT_SQL, lambda p: (p["comment"],)),
+    ("PUT /api/spots/{id_spot}/image", {"spots"}, queries.SPOT_IMAGE_SQL, lambda p: ("img", p["spot"])),
+    ("POST /api/rate/ (lock)", {"spots"}, queries.LOCK_SPOT_ASYNC_SQL, lambda p: (p["spot"],)),
+    ("POST /api/rate/", {"spots", "calificaciones"}, queries.RATE_SPOT_ASYNC_SQL,
+     lambda p: (p["spot"], p["u1"], 4)),
+    ("GET /api/spots/clusters", {"spots"}, CLUSTERS_SQL,
+     lambda p: ([0], [0], [-70.7], [-33.5], [-70.5], [-33.3], CLUSTER_GRID, CLUSTER_GRID)),
+    ("GET /api/tiles/spots/{z}/{x}/{y}.mvt", {"spots"}, SPOTS_TILE_SQL, lambda p: (12, 1244, 2451)),
+
+    # --- duelos ---
+    ("GET /api/challenges/pending/{user_id}", {"duelos"}, queries.PENDING_CHALLENGES_SQL, lambda p: (p["u1"],)),
+    ("POST /api/challenges/accept|reject", {"duelos"}, queries.PENDING_DUEL_SQL, lambda p: (p["duel"],)),
+    ("POST /api/challenges/accept|reject (estado)", {"duelos"}, queries.SET_DUEL_STATE_SQL,
+     lambda p: ("en_curso", p["duel"])),
+    ("GET /api/challenges/status/{id_duelo}", {"duelos"}, queries.CHALLENGE_STATUS_SQL, lambda p: (p["duel"],)),
+    ("POST /api/duelo/penalizar", {"duelos"}, queries.DUEL_LETTERS_SQL, lambda p: (p["duel"],)),
+    ("POST /api/duelo/penalizar (letras)", {"duelos"}, queries.SET_DUEL_LETTERS_SQL, lambda p: ("S|", p["duel"])),
+    ("POST /api/duelo/penalizar (ganador)", {"usuarios"}, queries.NICKNAME_SQL, lambda p: (p["u1"],)),
+    ("POST /api/duelo/penalizar (fin)", {"duelos"}, queries.FINISH_DUEL_SQL,
+     lambda p: (p["nick"], p["u1"], p["duel"])),
+    ("POST /api/duelo/penalizar (stats ganador)", {"usuarios"}, queries.WINNER_STATS_SQL, lambda p: (p["u1"],)),
+    ("POST /api/duelo/penalizar (stats perdedor)", {"usuarios"}, queries.LOSER_STATS_SQL, lambda p: (p["u2"],)),
+
+    # --- economía ---
+    ("POST /api/game/claim-daily", {"usuarios"}, queries.CLAIM_DAILY_USER_SQL, lambda p: (p["u1"],)),
+    ("POST /api/game/claim-daily (puntos)", {"usuarios"}, queries.CLAIM_DAILY_SQL, lambda p: (p["now"], p["u1"])),
+    ("POST /api/game/start-session", {"game_sessions"}, queries.SESSIONS_TODAY_SQL, lambda p: (p["u1"],)),
+    ("POST /api/game/submit-score (sesión)", {"game_sessions"}, queries.SESSION_BY_TOKEN_SQL,
+     lambda p: (p["token"],)),
+    ("POST /api/game/submit-score (cierre)", {"game_sessions"}, queries.COMPLETE_SESSION_SQL,
+     lambda p: (100, p["session"])),
+    ("POST /api/game/submit-score", {"transacciones_puntos"}, queries.GAME_POINTS_TODAY_SQL, lambda p: (p["u1"],)),
+    ("POST /api/game/submit-score (racha)", {"usuarios"}, queries.GAME_STREAK_SQL, lambda p: (p["u1"],)),
+    ("POST /api/game/submit-score (puntos)", {"usuarios"}, queries.AWARD_SCORE_SQL,
+     lambda p: (10, 10, 10, p["now"], 1, 1, 100, p["u1"])),
+    ("GET /api/game/rewards", set(), queries.REWARDS_CATALOG_SQL, lambda p: None),
+    ("POST /api/game/claim-reward", {"rewards"}, queries.REWARD_SQL, lambda p: (1,)),
+    ("POST /api/game/claim-reward (saldo)", {"usuarios"}, queries.USER_POINTS_SQL, lambda p: (p["u1"],)),
+    ("POST /api/game/claim-reward (descuento)", {"usuarios"}, queries.SPEND_POINTS_SQL, lambda p: (10, p["u1"])),
+    ("POST /api/game/claim-reward (stock)", {"rewards"}, queries.REWARD_STOCK_SQL, lambda p: (1,)),
+    ("GET /api/game/leaderboard", {"usuarios"}, queries.LEADERBOARD_SQL, lambda p: None),
+
+    # --- feed social ---
+    ("GET /api/posts/", {"posts"}, recent_feed_sql(None), lambda p: {"limit": 21}),
+    ("GET /api/posts/?cursor=", {"posts"}, recent_feed_sql(True),
+     lambda p: {"fecha": p["now"], "id_post": p["post"], "limit": 21}),
+    ("GET /api/posts/?mode=hot", {"posts"}, hot_feed_sql(True),
+     lambda p: {"score": 1e12, "id_post": p["post"], "limit": 21}),
+    ("GET /api/posts/?mode=nearby", {"posts", "usuarios"}, nearby_feed_sql(None),
+     lambda p: {"lat": -33.4, "lon": -70.6, "radius": NEARBY_RADIUS_M, "days": NEARBY_WINDOW_DAYS,
+                "limit": 21}),
+    ("GET /api/posts/?mode=nearby&cursor=", {"posts", "usuarios"}, nearby_feed_sql(True),
+     lambda p: {"lat": -33.4, "lon": -70.6, "radius": NEARBY_RADIUS_M, "days": NEARBY_WINDOW_DAYS,
+                "dist": 0.0, "fecha": p["now"], "id_post": p["post"], "limit": 21}),
+    ("GET /api/posts/?mode=nearby (viewer)", {"usuarios"}, VIEWER_LOCATION_SQL, lambda p: (p["u1"],)),
+    ("GET /api/posts/?viewer_id= (liked_by_me)", {"post_likes"}, LIKED_POST_IDS_SQL,
+     lambda p: ([p["post"], p["post"] - 1, p["post"] - 2], p["u1"])),
+    ("POST /api/posts/{id_post}/like", {"post_likes", "posts"}, TOGGLE_LIKE_SQL,
+     lambda p: {"post": p["post"], "user": p["u1"]}),
+    ("POST|DELETE comentario de post (contador)", {"posts"}, BUMP_COMMENTS_COUNT_SQL, lambda p: (1, p["post"])),
+    ("GET /api/posts/{id_post}/comments", {"post_comments"}, POST_COMMENTS_SQL, lambda p: (p["post"],)),
+    ("DELETE /api/posts/* (admin)", {"usuarios"}, IS_ADMIN_SQL, lambda p: (p["u1"],)),
+    ("DELETE /api/posts/{id_post} (dueño)", {"posts"}, POST_OWNER_SQL, lambda p: (p["post"],)),
+    ("DELETE /api/posts/{id_post} (likes)", {"post_likes"}, DELETE_POST_LIKES_SQL, lambda p: (p["post"],)),
+    ("DELETE /api/posts/{id_post} (comentarios)", {"post_comments"}, DELETE_POST_COMMENTS_SQL,
+     lambda p: (p["post"],)),
+    ("DELETE /api/posts/{id_post}", {"posts"}, DELETE_POST_SQL, lambda p: (p["post"],)),
+    ("DELETE /api/posts/comments/{id} (dueño)", {"post_comments"}, POST_COMMENT_OWNER_SQL,
+     lambda p: (p["post_comment"],)),
+    ("DELETE /api/posts/comments/{id}", {"post_comments"}, DELETE_POST_COMMENT_SQL,
+     lambda p: (p["post_comment"],)),
+    ("refresco de puntajes hot", {"posts"}, REFRESH_HOT_SCORES_SQL, lambda p: (HOT_WINDOW_DAYS,)),
+    ("flush de likes", {"posts"}, FLUSH_LIKES_SQL, lambda p: ([p["post"]], [1])),
+    ("reconciliación de likes (barrido)", set(), like_count_drift_sql(False), lambda p: {"ids": None}),
+    ("reconciliación de likes (segunda mirada)", {"posts", "post_likes"}, like_count_drift_sql(True),
+     lambda p: {"ids": [p["post"], p["post"] - 1]}),
+    ("reconciliación de likes (corrección)", {"posts"}, RECONCILE_LIKES_SQL,
+     lambda p: ([p["post"]], [0], [1])),
+]
+
+# Parámetros de asyncpg ($1, $2...): esas queries se preparan y se explica el EXECUTE
+ASYNC_PARAM = re.compile(r"\$\d")
+
+
+def seq_scans(plan, parents):
+    """Relaciones leídas con Seq Scan en un plan EXPLAIN (FORMAT JSON).
+    Las particiones se informan con el nombre de su tabla (parents)."""
+    found = set()
+    if plan.get("Node Type") == "Seq Scan":
+        name = plan.get("Relation Name")
+        found.add(parents.get(name, name))
+    for child in plan.get("Plans", []):
+        found |= seq_scans(child, parents)
+    return found
+
+
+def partition_parents(cur):
+    cur.execute("""
+        SELECT c.relname, p.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+    """)
+    return dict(cur.fetchall())
+
+
+def sample_params(cur):
+    def first(sql):
+        cur.execute(sql)
+        return cur.fetchone()[0]
+
+    u1 = first("SELECT MIN(id_usuario) FROM usuarios WHERE nickname LIKE 'plan\\_%'")
+    now = datetime.now()
+    return {
+        "u1": u1, "u2": u1 + 1, "nick": "plan_1", "now": now,
+        "hot": now - timedelta(days=queries.MESSAGES_HOT_DAYS),
+        "msg": first("SELECT MAX(id_mensaje) FROM mensajes"),
+        "spot": first("SELECT MAX(id_spot) FROM spots"),
+        "comment": first("SELECT MAX(id_comentario) FROM comentarios"),
+        "post": first("SELECT MAX(id_post) FROM posts"),
+        "post_comment": first("SELECT MAX(id_comment) FROM post_comments"),
+        "duel": first("SELECT MAX(id_duelo) FROM duelos"),
+        "session": first("SELECT MAX(id_session) FROM game_sessions"),
+        "token": first("SELECT session_token FROM game_sessions ORDER BY id_session DESC LIMIT 1"),
+    }
+
+
+def explain(cur, sql, args):
+    """Plan JSON de la query con esos argumentos. Las de asyncpg se preparan y se
+    explica su EXECUTE, con los mismos tipos que infiere el servidor para asyncpg."""
+    if ASYNC_PARAM.search(sql):
+        # Sin argumentos: psycopg2 no interpreta los % del SQL
+        cur.execute("PREPARE plan_check AS " + sql)
+        placeholders = ", ".join(["%s"] * len(args))
+        cur.execute(f"EXPLAIN (FORMAT JSON) EXECUTE plan_check({placeholders})", args)
+        plan = cur.fetchone()[0]
+        cur.execute("DEALLOCATE plan_check")
+    else:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, args)
+        plan = cur.fetchone()[0]
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def check():
+    run_migrations()
+    conn = get_db()
+    failures = []
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        print("🌱 Sembrando datos de prueba...")
+        cur.execute(SEED_SQL)
+        params = sample_params(cur)
+        parents = partition_parents(cur)
+        cur.execute("SET LOCAL enable_seqscan = off")
+
+        for endpoint, hot_tables, sql, args in HOT_QUERIES:
+            plan = explain(cur, sql, args(params))
+            bad = seq_scans(plan[0]["Plan"], parents) & hot_tables
+            if bad:
+                failures.append(endpoint)
+                print(f"❌ {endpoint}: Seq Scan sobre {', '.join(sorted(bad))}")
+            else:
+                print(f"✅ {endpoint}")
+    finally:
+        # Cerrar sin COMMIT descarta todo lo sembrado
+        conn.close()
+
+    if failures:
+        print(f"\n🛑 {len(failures)} queries calientes sin índice")
+        return 1
+    print(f"\n✅ {len(HOT_QUERIES)} planes OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(check())
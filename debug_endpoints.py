@@ -1,36 +1,35 @@
-from fastapi import APIRouter
-from database import get_db
+from fastapi import APIRouter, Depends
+from database import get_conn
 from psycopg2.extras import RealDictCursor
 
 router = APIRouter()
 
 @router.get("/api/debug/schema")
-def check_schema():
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 1. Check usuarios columns
-        cur.execute("""
-            SELECT column_name, data_type 
-            FROM information_schema.columns 
-            WHERE table_name = 'usuarios';
-        """)
-        user_cols = cur.fetchall()
+def check_schema(conn=Depends(get_conn)):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    # 1. Check usuarios columns
+    cur.execute("""
+        SELECT column_name, data_type 
+        FROM information_schema.columns 
+        WHERE table_name = 'usuarios';
+    """)
+    user_cols = cur.fetchall()
 
-        # 2. Check transacciones_puntos existence via catalog
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE  table_schema = 'public'
-                AND    table_name   = 'transacciones_puntos'
-            );
-        """)
-        trans_exists = cur.fetchone()['exists']
+    # 2. Check transacciones_puntos existence via catalog
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT FROM information_schema.tables 
+            WHERE  table_schema = 'public'
+            AND    table_name   = 'transacciones_puntos'
+        );
+    """)
+    trans_exists = cur.fetchone()['exists']
+
+    return {"usuarios_columns": user_cols, "transacciones_puntos_exists": trans_exists}
 
 @router.get("/api/debug/fix_user/{nickname}")
-def fix_user_points(nickname: str):
-    conn = get_db()
+def fix_user_points(nickname: str, conn=Depends(get_conn)):
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -63,5 +62,3 @@ def fix_user_points(nickname: str):
         }
     except Exception as e:
         return {"error": str(e)}
-    finally:
-        conn.close()
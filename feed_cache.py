@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+
+# ==========================================
+# 🗞️ CACHE DE LAS PRIMERAS PÁGINAS DEL FEED
+# ==========================================
+# Las primeras FEED_CACHE_PAGES páginas del feed cronológico son iguales para
+# todos: se guardan ya serializadas (bytes JSON) y la respuesta es una copia
+# de memoria. Una sola carga por página a la vez (single-flight): el resto de
+# los requests espera ese resultado en vez de ir todos a la base.
+# Las escrituras avisan por pg_notify en el canal FEED_CHANNEL y cada worker
+# (conexión LISTEN de inbox_ws) limpia su cache o parcha los contadores.
+
+FEED_CACHE_TTL = float(os.environ.get('FEED_CACHE_TTL', 60))
+FEED_CACHE_PAGES = int(os.environ.get('FEED_CACHE_PAGES', 3))
+FEED_LOAD_WAIT = 5.0   # segundos máximos esperando la carga de otro request
+FEED_CHANNEL = "feed"
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} no serializable")
+
+
+def dump_json(value):
+    """Igual que la respuesta JSON de FastAPI (compacto, UTF-8)."""
+    return json.dumps(value, default=_json_default, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class FeedPage:
+    """Página del feed serializada: el cuerpo completo y cada post por separado."""
+
+    def __init__(self, rows, next_cursor):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.ids = [row['id_post'] for row in rows]
+        self.items = [dump_json(row) for row in rows]
+        self.body = b"[" + b",".join(self.items) + b"]"
+
+    def body_for_viewer(self, liked_ids):
+        """Cuerpo con liked_by_me en cada post, sin volver a serializar la página:
+        se agrega el campo al final de cada objeto ya armado."""
+        flags = [b',"liked_by_me":true}' if id_post in liked_ids else b',"liked_by_me":false}'
+                 for id_post in self.ids]
+        return b"[" + b",".join(item[:-1] + flag for item, flag in zip(self.items, flags)) + b"]"
+
+    def patched(self, id_post, fields):
+        """Copia con los contadores del post cambiados (o la misma si no está)."""
+        if id_post not in self.ids:
+            return self
+        rows = [{**row, **fields} if row['id_post'] == id_post else row for row in self.rows]
+        return FeedPage(rows, self.next_cursor)
+
+
+class FeedPageCache:
+    def __init__(self, ttl, max_pages):
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self._entries = {}    # (cursor, limit) -> (guardado_en, FeedPage)
+        self._depth = {}      # (cursor, limit) -> número de página (0 = la primera)
+        self._inflight = {}   # (cursor, limit) -> Event de la carga en curso
+        self._generation = 0  # sube con cada invalidación: cargas viejas no se guardan
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, cursor, limit):
+        return cursor is None or (cursor, limit) in self._depth
+
+    def get_or_load(self, cursor, limit, loader):
+        """FeedPage de (cursor, limit); loader() -> (rows, next_cursor) solo si no está."""
+        key = (cursor, limit)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                    self.hits += 1
+                    return entry[1]
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    generation = self._generation
+                    break
+            # Otro request ya la está cargando: se espera y se vuelve a mirar
+            event.wait(FEED_LOAD_WAIT)
+
+        try:
+            self.misses += 1
+            page = FeedPage(*loader())
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (time.monotonic(), page)
+                    depth = 0 if cursor is None else self._depth.get(key, 0)
+                    if page.next_cursor is not None and depth + 1 < self.max_pages:
+                        self._depth[(page.next_cursor, limit)] = depth + 1
+            return page
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._depth.clear()
+
+    def patch(self, id_post, fields):
+        """Cambia contadores de un post en las páginas guardadas (likes, comentarios)."""
+        with self._lock:
+            self._generation += 1   # una carga en curso pudo leer el valor anterior
+            for key, (stored_at, page) in list(self._entries.items()):
+                self._entries[key] = (stored_at, page.patched(id_post, fields))
+
+    def on_notify(self, payload):
+        """Aviso del canal FEED_CHANNEL (None = reconexión, pudo perderse algo)."""
+        event = json.loads(payload) if payload else {}
+        if event.get("op") == "patch":
+            self.patch(event["id_post"], event["fields"])
+        else:
+            self.invalidate()
+
+    def metrics(self):
+        with self._lock:
+            return {"pages": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+feed_cache = FeedPageCache(FEED_CACHE_TTL, FEED_CACHE_PAGES)
+
+
+def notify_feed(cur, event=None):
+    """Avisar a todos los workers (y a este) que el feed cambió.
+    event=None invalida; {"op": "patch", "id_post", "fields"} parcha contadores."""
+    cur.execute("SELECT pg_notify(%s, %s)", (FEED_CHANNEL, json.dumps(event) if event else ""))
+    feed_cache.on_notify(json.dumps(event) if event else None)
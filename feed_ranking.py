@@ -0,0 +1,40 @@
+import os
+
+from database import db_connection
+
+# ==========================================
+# 🔥 RANKING DEL FEED (MODO HOT)
+# ==========================================
+# posts.hot_score = ln(max(likes + 2·comentarios, 1)) + epoch(fecha_creacion) / HOT_DECAY_SECONDS
+# Es el decaimiento por tiempo escrito en escala logarítmica: cada
+# HOT_DECAY_SECONDS de antigüedad pesan lo mismo que multiplicar por e el
+# engagement. Como la parte de tiempo no cambia, el puntaje de un post solo se
+# mueve cuando recibe likes o comentarios: el orden es estable entre páginas y
+# el índice idx_posts_hot sirve para paginar por cursor.
+# El job recalcula solo los posts de los últimos HOT_WINDOW_DAYS cuyo
+# engagement cambió; los más viejos ya no compiten por arriba del feed.
+
+HOT_DECAY_SECONDS = 45000   # 12,5 h. Si cambia, hay que recalcular toda la tabla (ver migración 11)
+HOT_WINDOW_DAYS = int(os.environ.get('HOT_WINDOW_DAYS', 7))
+HOT_REFRESH_INTERVAL = float(os.environ.get('HOT_REFRESH_INTERVAL', 60))
+
+HOT_SCORE_SQL = f"""(
+    ln(GREATEST(COALESCE(likes_count, 0) + 2 * COALESCE(comments_count, 0), 1))
+    + EXTRACT(EPOCH FROM fecha_creacion) / {HOT_DECAY_SECONDS}
+)"""
+
+REFRESH_HOT_SCORES_SQL = f"""
+    UPDATE posts
+    SET hot_score = {HOT_SCORE_SQL}
+    WHERE fecha_creacion >= NOW() - make_interval(days => %s)
+      AND hot_score IS DISTINCT FROM {HOT_SCORE_SQL}
+"""
+
+
+def refresh_hot_scores():
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(REFRESH_HOT_SCORES_SQL, (HOT_WINDOW_DAYS,))
+        if cur.rowcount:
+            print(f"🔥 Feed hot: {cur.rowcount} puntajes recalculados")
+        return cur.rowcount
@@ -0,0 +1,72 @@
+import math
+from fastapi import HTTPException
+
+# ==========================================
+# 🌎 HELPERS GEOGRÁFICOS COMPARTIDOS
+# ==========================================
+
+def _parse_floats(value, n, name):
+    try:
+        parts = [float(p) for p in value.split(",")]
+    except ValueError:
+        parts = []
+    if len(parts) != n:
+        raise HTTPException(400, f"Parámetro '{name}' inválido")
+    return parts
+
+def parse_bbox(value):
+    """'minLon,minLat,maxLon,maxLat' -> (min_lon, min_lat, max_lon, max_lat)"""
+    min_lon, min_lat, max_lon, max_lat = _parse_floats(value, 4, "bbox")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(400, "bbox debe ser minLon,minLat,maxLon,maxLat")
+    return min_lon, min_lat, max_lon, max_lat
+
+def parse_latlon(value, name="near"):
+    """'lat,lon' -> (lat, lon)"""
+    lat, lon = _parse_floats(value, 2, name)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(400, f"Parámetro '{name}' fuera de rango")
+    return lat, lon
+
+# --- Tiles Web Mercator (z/x/y, como los del mapa de Flutter) ---
+MAX_MERCATOR_LAT = 85.05112878
+
+def lonlat_to_tile(lon, lat, z):
+    """Tile (x, y) que contiene el punto en el zoom z."""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def tile_bounds(z, x, y):
+    """(west, south, east, north) en grados del tile z/x/y."""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def tiles_for_bbox(bbox, z, max_tiles=None):
+    """Todos los tiles del zoom z que tocan el bbox (min_lon, min_lat, max_lon, max_lat).
+    Con max_tiles se rechaza (400) antes de armar la lista: un bbox del mundo en
+    zoom alto serían billones de tiles."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x0, y0 = lonlat_to_tile(min_lon, max_lat, z)
+    x1, y1 = lonlat_to_tile(max_lon, min_lat, z)
+    if max_tiles is not None and (x1 - x0 + 1) * (y1 - y0 + 1) > max_tiles:
+        raise HTTPException(400, "bbox demasiado grande para ese zoom")
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+# --- Distancias ---
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEG_LAT = 111320.0
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Distancia en metros sobre la esfera entre dos puntos (grados)."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+from database import db_connection
+from geo import haversine_m
+
+# ==========================================
+# 🛰️ BUFFER DE ESCRITURA DE LATIDOS GPS
+# ==========================================
+# Cada latido deja solo la última posición del usuario en memoria; cada
+# GPS_FLUSH_INTERVAL segundos se escribe todo en UN UPDATE ... FROM unnest().
+# Los latidos que se movieron menos de GPS_EPSILON_M respecto de lo ya
+# escrito no generan escritura, salvo que hayan pasado GPS_KEEPALIVE segundos
+# (así ultima_conexion en la base no queda vieja para la recarga del radar).
+
+GPS_FLUSH_INTERVAL = float(os.environ.get('GPS_FLUSH_INTERVAL', 30))
+GPS_EPSILON_M = float(os.environ.get('GPS_EPSILON_M', 5))
+GPS_KEEPALIVE = float(os.environ.get('GPS_KEEPALIVE', 120))   # < LIVE_TTL
+
+FLUSH_GPS_SQL = """
+    UPDATE usuarios u
+    SET ubicacion_actual = ST_SetSRID(ST_MakePoint(v.lon, v.lat), 4326),
+        ultima_conexion = NOW() - make_interval(secs => v.age)
+    FROM unnest(%s::int[], %s::float8[], %s::float8[], %s::float8[]) AS v(id, lat, lon, age)
+    WHERE u.id_usuario = v.id
+"""
+
+
+class GpsWriteBuffer:
+    def __init__(self, epsilon_m, keepalive):
+        self.epsilon_m = epsilon_m
+        self.keepalive = keepalive
+        self._pending = {}   # id_usuario -> (lat, lon, ts) último latido sin escribir
+        self._written = {}   # id_usuario -> (lat, lon, ts) lo que ya está en la base
+        self._lock = threading.Lock()
+        # Métricas acumuladas desde el arranque
+        self.pings = 0
+        self.dropped = 0
+        self.accepted = 0
+        self.rows_written = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def record(self, user_id, lat, lon):
+        now = time.time()
+        with self._lock:
+            self.pings += 1
+            written = self._written.get(user_id)
+            if (user_id not in self._pending and written is not None
+                    and now - written[2] < self.keepalive
+                    and haversine_m(lat, lon, written[0], written[1]) < self.epsilon_m):
+                self.dropped += 1
+                return
+            self.accepted += 1
+            self._pending[user_id] = (lat, lon, now)
+
+    def flush(self):
+        """Escribe lo pendiente en una sola sentencia. Devuelve filas escritas."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        # Orden fijo por id: dos flushes concurrentes no se bloquean en orden cruzado
+        ids = sorted(batch)
+        now = time.time()
+        start = time.perf_counter()
+        try:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(FLUSH_GPS_SQL, (ids,
+                      [batch[i][0] for i in ids],
+                      [batch[i][1] for i in ids],
+                      [now - batch[i][2] for i in ids]))
+        except Exception:
+            # Se reintenta en el próximo ciclo sin pisar latidos más nuevos
+            with self._lock:
+                for uid, entry in batch.items():
+                    self._pending.setdefault(uid, entry)
+            raise
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._written.update(batch)
+            cutoff = now - self.keepalive
+            for uid in [u for u, w in self._written.items() if w[2] < cutoff]:
+                del self._written[uid]
+            self.rows_written += len(ids)
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.total_flush_ms += elapsed_ms
+        return len(ids)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "buffer_size": len(self._pending),
+                "pings": self.pings,
+                "dropped_epsilon": self.dropped,
+                "rows_written": self.rows_written,
+                "flushes": self.flushes,
+                # latidos aceptados por fila escrita: cuánto colapsa el buffer
+                "coalescing_ratio": round(self.accepted / self.rows_written, 2) if self.rows_written else None,
+                "last_flush_ms": round(self.last_flush_ms, 2),
+                "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else None,
+            }
+
+
+gps_buffer = GpsWriteBuffer(GPS_EPSILON_M, GPS_KEEPALIVE)
+
+
+def flush_gps_buffer():
+    rows = gps_buffer.flush()
+    if rows:
+        print(f"🛰️ GPS: {rows} posiciones escritas ({gps_buffer.last_flush_ms:.1f} ms)")
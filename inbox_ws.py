@@ -0,0 +1,178 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import asyncio
+import asyncpg
+import json
+import os
+
+from database import get_dsn, init_async_pool
+from unread_counters import unread_cache, unread_total_async
+
+router = APIRouter()
+
+# ==========================================
+# 📬 INBOX EN VIVO (WEBSOCKET + LISTEN/NOTIFY)
+# ==========================================
+# Los endpoints publican con pg_notify dentro de su transacción (se entrega
+# al hacer COMMIT). Cada worker tiene UNA conexión escuchando el canal y
+# reparte a los sockets de los destinatarios que tenga abiertos.
+# Payload: {"to": [ids], "event": {...}}. Eventos que ve el cliente:
+#   {"type": "message", id_mensaje, id_remitente, id_destinatario, texto, fecha_envio}
+#   {"type": "unread", "total", "id_remitente", "cantidad"}   badge + no leídos de ese chat
+#   {"type": "read", "id_lector", "id_remitente", "updated"}  acuse de lectura
+#   {"type": "challenge", id_duelo, challenger_id, opponent_id}
+#   {"type": "resync"}   se perdieron eventos (cliente lento): volver a pedir por HTTP
+
+INBOX_CHANNEL = "inbox"
+INBOX_QUEUE_MAX = int(os.environ.get('INBOX_QUEUE_MAX', 200))
+INBOX_LISTEN_CHECK = float(os.environ.get('INBOX_LISTEN_CHECK', 30))
+NOTIFY_MAX_BYTES = 7900   # NOTIFY acepta hasta 8000 bytes de payload
+
+
+def notify_payload(to, event):
+    payload = json.dumps({"to": list(to), "event": event}, default=str)
+    if len(payload.encode()) > NOTIFY_MAX_BYTES and "texto" in event:
+        # Mensaje muy largo: va sin texto y el cliente lo trae por HTTP
+        event = {**event, "texto": None, "truncado": True}
+        payload = json.dumps({"to": list(to), "event": event}, default=str)
+    return payload
+
+
+async def publish(conn, to, event):
+    """Publicar desde asyncpg (dentro de la transacción del endpoint)."""
+    await conn.execute("SELECT pg_notify($1, $2)", INBOX_CHANNEL, notify_payload(to, event))
+
+
+def publish_sync(cur, to, event):
+    """Publicar desde psycopg2 (dentro de la transacción del endpoint)."""
+    cur.execute("SELECT pg_notify(%s, %s)", (INBOX_CHANNEL, notify_payload(to, event)))
+
+
+class InboxSocket:
+    def __init__(self):
+        self.queue = asyncio.Queue(INBOX_QUEUE_MAX)
+        self.overflow = False
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflow = True
+
+
+class InboxHub:
+    """Sockets abiertos en este worker por usuario. Todo corre en el loop."""
+
+    def __init__(self):
+        self._sockets = {}   # id_usuario -> set(InboxSocket)
+
+    def register(self, user_id, sock):
+        self._sockets.setdefault(user_id, set()).add(sock)
+
+    def unregister(self, user_id, sock):
+        socks = self._sockets.get(user_id)
+        if socks is not None:
+            socks.discard(sock)
+            if not socks:
+                del self._sockets[user_id]
+
+    def on_notify(self, connection, pid, channel, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        event = data["event"]
+        for user_id in data.get("to", []):
+            # Todos los workers ven todos los eventos: así el cache del badge no queda viejo
+            if event.get("type") == "unread" and event.get("total") is not None:
+                unread_cache.set(user_id, event["total"])
+            for sock in self._sockets.get(user_id, ()):
+                sock.push(event)
+
+
+inbox_hub = InboxHub()
+_listener_task = None
+_channel_listeners = {}   # otros canales en la misma conexión: canal -> fn(payload)
+
+
+def listen_channel(channel, fn):
+    """Escuchar otro canal con la conexión LISTEN del worker. fn(payload) corre en
+    el loop; al (re)conectar se llama fn(None): pudo perderse algún aviso."""
+    _channel_listeners[channel] = fn
+
+
+def _channel_callback(fn):
+    return lambda connection, pid, channel, payload: fn(payload)
+
+
+async def _listen_forever():
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(get_dsn())
+            await conn.add_listener(INBOX_CHANNEL, inbox_hub.on_notify)
+            for channel, fn in _channel_listeners.items():
+                await conn.add_listener(channel, _channel_callback(fn))
+                fn(None)
+            print(f"📬 Escuchando canales {[INBOX_CHANNEL, *_channel_listeners]}")
+            # Un SELECT de vez en cuando detecta conexiones muertas y fuerza reconexión
+            while True:
+                await asyncio.sleep(INBOX_LISTEN_CHECK)
+                await conn.execute("SELECT 1")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Listener del inbox caído, reintentando: {e}")
+            await asyncio.sleep(5)
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+
+
+def start_inbox_listener():
+    global _listener_task
+    if _listener_task is None:
+        _listener_task = asyncio.get_running_loop().create_task(_listen_forever())
+
+
+async def stop_inbox_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+
+
+async def _sender(websocket, sock):
+    while True:
+        event = await sock.queue.get()
+        if sock.overflow:
+            while not sock.queue.empty():
+                sock.queue.get_nowait()
+            sock.overflow = False
+            event = {"type": "resync"}
+        await websocket.send_json(event)
+
+
+@router.websocket("/ws/inbox")
+async def inbox_stream(websocket: WebSocket, user_id: int):
+    """Canal push del usuario: mensajes, badge de no leídos, acuses y retos."""
+    await websocket.accept()
+    sock = InboxSocket()
+    inbox_hub.register(user_id, sock)
+    sender = asyncio.create_task(_sender(websocket, sock))
+    try:
+        # Estado inicial del badge
+        pool = await init_async_pool()
+        sock.push({"type": "unread", "total": await unread_total_async(pool, user_id)})
+        while True:
+            await websocket.receive_text()   # pings del cliente; nada que hacer
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"❌ Error en /ws/inbox: {e}")
+    finally:
+        inbox_hub.unregister(user_id, sock)
+        sender.cancel()
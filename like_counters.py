@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+
+from database import db_connection
+from feed_cache import notify_feed
+
+# ==========================================
+# ❤️ CONTADORES DE LIKES EN LOTE
+# ==========================================
+# toggle_like solo escribe post_likes; el +1/-1 de posts.likes_count se
+# acumula aquí por post y cada LIKES_FLUSH_INTERVAL segundos se aplica todo en
+# UN UPDATE ... FROM unnest(). Así un post viral no hace cola en su fila.
+# Cada LIKES_RECONCILE_INTERVAL se compara likes_count con COUNT(*) de
+# post_likes y se corrige la deriva (p.ej. deltas perdidos en un reinicio).
+
+LIKES_FLUSH_INTERVAL = float(os.environ.get('LIKES_FLUSH_INTERVAL', 5))
+LIKES_RECONCILE_INTERVAL = float(os.environ.get('LIKES_RECONCILE_INTERVAL', 3600))
+# Espera entre las dos lecturas del reconcile: más que un flush de cualquier worker
+LIKES_RECONCILE_SETTLE = float(os.environ.get('LIKES_RECONCILE_SETTLE', 3 * LIKES_FLUSH_INTERVAL))
+
+FLUSH_LIKES_SQL = """
+    UPDATE posts p
+    SET likes_count = COALESCE(p.likes_count, 0) + v.delta
+    FROM unnest(%s::int[], %s::int[]) AS v(id, delta)
+    WHERE p.id_post = v.id
+    RETURNING p.id_post, p.likes_count
+"""
+
+
+class LikeCounterBuffer:
+    def __init__(self):
+        self._pending = {}   # id_post -> delta sin escribir
+        self._lock = threading.Lock()
+        self.rows_written = 0
+        self.flushes = 0
+
+    def add(self, id_post, delta):
+        """Suma el delta; devuelve lo pendiente de ese post (para responder el conteo)."""
+        with self._lock:
+            pending = self._pending.get(id_post, 0) + delta
+            if pending:
+                self._pending[id_post] = pending
+            else:
+                self._pending.pop(id_post, None)
+            return pending
+
+    def flush(self):
+        """Aplica los deltas en una sola sentencia. Devuelve [(id_post, likes_count)]."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return []
+
+        # Orden fijo por id: dos workers no se bloquean en orden cruzado
+        ids = sorted(batch)
+        try:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                # UPDATE y avisos en una transacción: si un aviso falla no queda
+                # escrito el UPDATE y reencolar el lote no cuenta dos veces
+                cur.execute("BEGIN")
+                cur.execute(FLUSH_LIKES_SQL, (ids, [batch[i] for i in ids]))
+                counts = cur.fetchall()
+                for id_post, likes_count in counts:
+                    notify_feed(cur, {"op": "patch", "id_post": id_post,
+                                      "fields": {"likes_count": likes_count}})
+                conn.commit()
+        except Exception:
+            # Nada quedó escrito (putconn hace ROLLBACK): se reintenta en el
+            # próximo ciclo sumando a lo que llegó entretanto
+            with self._lock:
+                for id_post, delta in batch.items():
+                    self._pending[id_post] = self._pending.get(id_post, 0) + delta
+            raise
+
+        with self._lock:
+            self.rows_written += len(counts)
+            self.flushes += 1
+        return counts
+
+
+like_counter_buffer = LikeCounterBuffer()
+
+
+def flush_like_counters():
+    counts = like_counter_buffer.flush()
+    if counts:
+        print(f"❤️ Likes: {len(counts)} contadores actualizados")
+
+
+def like_count_drift_sql(filtered):
+    """Posts con likes_count distinto de COUNT(*); filtered = solo los de %(ids)s."""
+    return f"""
+        SELECT p.id_post, p.likes_count, COALESCE(c.n, 0)
+        FROM posts p
+        LEFT JOIN (
+            SELECT id_post, COUNT(*) as n FROM post_likes
+            {"WHERE id_post = ANY(%(ids)s)" if filtered else ""}
+            GROUP BY id_post
+        ) c ON c.id_post = p.id_post
+        WHERE p.likes_count IS DISTINCT FROM COALESCE(c.n, 0)
+          {"AND p.id_post = ANY(%(ids)s)" if filtered else ""}
+    """
+
+
+def _like_count_drift(cur, post_ids=None):
+    """{id_post: (likes_count, COUNT(*))} de los posts donde no calzan."""
+    cur.execute(like_count_drift_sql(post_ids is not None), {"ids": post_ids})
+    return {id_post: (seen, actual) for id_post, seen, actual in cur.fetchall()}
+
+
+RECONCILE_LIKES_SQL = """
+    UPDATE posts p
+    SET likes_count = v.actual
+    FROM unnest(%s::int[], %s::int[], %s::int[]) AS v(id, seen, actual)
+    WHERE p.id_post = v.id AND p.likes_count IS NOT DISTINCT FROM v.seen
+    RETURNING p.id_post, p.likes_count
+"""
+
+
+def reconcile_like_counts():
+    """Corrige likes_count contra COUNT(*). Un desfase puede ser solo un delta
+    que otro worker aún no escribe: se mira dos veces y se corrigen los que
+    siguen igual de desfasados (sin actividad entre medio)."""
+    with db_connection() as conn:
+        first = _like_count_drift(conn.cursor())
+    if not first:
+        return 0
+    time.sleep(LIKES_RECONCILE_SETTLE)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        second = _like_count_drift(cur, list(first))
+        stable = [(id_post, seen, actual) for id_post, (seen, actual) in second.items()
+                  if first.get(id_post) == (seen, actual)]
+        if not stable:
+            return 0
+        cur.execute(RECONCILE_LIKES_SQL,
+                    ([s[0] for s in stable], [s[1] for s in stable], [s[2] for s in stable]))
+        fixed = cur.fetchall()
+        for id_post, likes_count in fixed:
+            notify_feed(cur, {"op": "patch", "id_post": id_post, "fields": {"likes_count": likes_count}})
+    if fixed:
+        print(f"❤️ Likes: {len(fixed)} contadores corregidos contra COUNT(*)")
+    return len(fixed)
@@ -0,0 +1,241 @@
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from database import db_connection
+from gps_buffer import gps_buffer
+from proximity import ProximityIndex, visible_value
+from queries import PROFILES_SQL, WARM_LIVE_SQL
+from shared_positions import SharedLiveTable
+
+# ==========================================
+# 📡 POSICIONES EN VIVO (RADAR EN MEMORIA)
+# ==========================================
+# Los latidos de GPS ya no tocan `usuarios`: se guardan aquí, en arreglos
+# NumPy (proximity.py), y el radar se responde desde memoria.
+# La escritura a Postgres (ubicacion_actual / ultima_conexion) va por el
+# buffer de gps_buffer.py; la base sigue siendo la fuente para el resto de la
+# app y para recargar el índice al reiniciar.
+# Con LIVE_SHARED_MEMORY (por defecto) las posiciones van a la tabla en
+# memoria compartida de shared_positions.py y todos los workers del host
+# responden el radar con los mismos datos; si no se puede crear, cada worker
+# usa su propio índice.
+
+LIVE_TTL = float(os.environ.get('LIVE_TTL', 300))                  # mismo corte de 5 min que tenía el radar
+LIVE_EXPIRE_INTERVAL = float(os.environ.get('LIVE_EXPIRE_INTERVAL', 60))
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', 600))
+LIVE_SHARED_MEMORY = os.environ.get('LIVE_SHARED_MEMORY', '1') == '1'
+# Cada cuánto se buscan cambios en la tabla compartida para el radar en vivo
+LIVE_POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL', 0.5))
+
+
+class LivePositionStore:
+    """Última posición de cada usuario activo, sobre el índice NumPy de proximity.py
+    o la tabla compartida entre workers."""
+
+    def __init__(self, ttl, index):
+        self.ttl = ttl
+        self._index = index
+        self._lock = threading.Lock()
+        # La tabla compartida se lee sin lock (seqlock por fila)
+        self._read_lock = nullcontext() if getattr(index, "lock_free_reads", False) else self._lock
+        self._listeners = []   # callbacks de cambios, p.ej. el radar por WebSocket
+        # Con la tabla compartida los cambios salen de poll() (latidos de todos
+        # los workers); con el índice local se avisan al escribir
+        self._polled = hasattr(index, "changes")
+
+    def add_listener(self, fn):
+        """fn(evento, id_usuario, lat, lon, visible) con evento 'update' o 'remove'.
+        Se llama fuera del lock, desde el hilo que hizo el cambio."""
+        self._listeners.append(fn)
+
+    def _emit(self, event, user_id, lat=None, lon=None, visible=None):
+        for fn in self._listeners:
+            try:
+                fn(event, user_id, lat, lon, visible)
+            except Exception as e:
+                print(f"❌ Listener del radar falló: {e}")
+
+    def update(self, user_id, lat, lon, visible=None):
+        """Latido: nueva posición (y opcionalmente visibilidad) del usuario."""
+        with self._lock:
+            visible = self._index.upsert(user_id, lat, lon, time.time(), visible)
+        if not self._polled:
+            self._emit("update", user_id, lat, lon, visible)
+
+    def set_visible(self, user_id, visible):
+        with self._lock:
+            position = self._index.set_visible(user_id, visible)
+        if position is not None and not self._polled:
+            self._emit("update", user_id, position[0], position[1], visible)
+
+    def poll(self):
+        """Avisa a los listeners lo que cambió en la tabla compartida desde la
+        pasada anterior, venga del worker que venga."""
+        if not self._polled:
+            return 0
+        with self._lock:
+            updated, displaced = self._index.changes()
+        for uid in displaced:
+            self._emit("remove", uid)
+        for uid, lat, lon, visible in updated:
+            self._emit("update", uid, lat, lon, visible)
+        return len(updated)
+
+    def load(self, rows):
+        """Carga inicial desde la base: [(id, lat, lon, visible, last_seen)]."""
+        with self._lock:
+            for user_id, lat, lon, visible, last_seen in rows:
+                # Otro worker pudo haber recibido ya un latido más nuevo
+                self._index.upsert(user_id, lat, lon, last_seen, visible, only_if_newer=True)
+
+    def nearby(self, lat, lon, radius_m, exclude_id=None):
+        """Arreglos (ids, lats, lons, visible, distance_m) de los activos dentro
+        del radio, ordenados por (distancia, id). visible usa VISIBLE_UNKNOWN."""
+        with self._read_lock:
+            return self._index.within(lat, lon, radius_m, time.time() - self.ttl, exclude_id)
+
+    def expire(self):
+        """Saca del índice a quien no late hace más de TTL."""
+        with self._lock:
+            stale = self._index.remove_older_than(time.time() - self.ttl)
+        for uid in stale:
+            self._emit("remove", uid)
+        return len(stale)
+
+    def __len__(self):
+        return len(self._index)
+
+
+class ProfileCache:
+    """nickname/avatar/crew/stance/visible por usuario para armar la respuesta del radar."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}   # id_usuario -> (cargado_en, perfil)
+        self._lock = threading.Lock()
+
+    def get_many(self, user_ids):
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for uid in user_ids:
+                entry = self._entries.get(uid)
+                if entry is not None and now - entry[0] <= self.ttl:
+                    found[uid] = entry[1]
+                else:
+                    missing.append(uid)
+        if missing:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(PROFILES_SQL, (missing,))
+                rows = cur.fetchall()
+            with self._lock:
+                for uid, nickname, avatar, crew, stance, visible in rows:
+                    profile = {"nickname": nickname, "avatar": avatar, "crew": crew,
+                               "stance": stance, "visible": visible}
+                    self._entries[uid] = (now, profile)
+                    found[uid] = profile
+        return found
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def expire(self):
+        now = time.monotonic()
+        with self._lock:
+            for uid in [u for u, e in self._entries.items() if now - e[0] > self.ttl]:
+                del self._entries[uid]
+
+
+def _make_index():
+    if LIVE_SHARED_MEMORY:
+        try:
+            return SharedLiveTable(reuse_after=LIVE_TTL)
+        except Exception as e:
+            print(f"⚠️ Sin memoria compartida ({e}): el radar solo verá los latidos de este worker")
+    return ProximityIndex()
+
+
+live_store = LivePositionStore(LIVE_TTL, _make_index())
+profile_cache = ProfileCache(PROFILE_CACHE_TTL)
+
+
+def skater_payload(user_id, lat, lon, visible, profile):
+    """Fila del radar como la espera la app, o None si no se debe mostrar."""
+    if profile is None:
+        return None  # usuario borrado
+    if not (visible if visible is not None else profile["visible"]):
+        return None
+    return {
+        "id_usuario": user_id,
+        "nickname": profile["nickname"],
+        "avatar": profile["avatar"],
+        "crew": profile["crew"],
+        "stance": profile["stance"],
+        "longitude": lon,
+        "latitude": lat,
+    }
+
+
+def skaters_nearby(lat, lon, radius_m, exclude_id=None, limit=None, after=None):
+    """Skaters visibles y activos en el radio, del más cercano al más lejano,
+    con los campos que espera la app + distance_m.
+    after=(distance_m, id_usuario) del último de la página anterior.
+    Devuelve (skaters, siguiente_after o None si no hay más)."""
+    ids, lats, lons, visible, dist = live_store.nearby(lat, lon, radius_m, exclude_id)
+    if after is not None:
+        keep = (dist > after[0]) | ((dist == after[0]) & (ids > after[1]))
+        ids, lats, lons, visible, dist = ids[keep], lats[keep], lons[keep], visible[keep], dist[keep]
+
+    skaters = []
+    last = None   # (distance_m, id_usuario) del último de la página
+    total = len(ids)
+    chunk = limit or total or 1
+    # Perfiles por tandas: solo se resuelven los que pueden entrar en la página
+    for i in range(0, total, chunk):
+        batch = list(zip(ids[i:i + chunk].tolist(), lats[i:i + chunk].tolist(),
+                         lons[i:i + chunk].tolist(), visible[i:i + chunk].tolist(),
+                         dist[i:i + chunk].tolist()))
+        profiles = profile_cache.get_many([b[0] for b in batch])
+        for user_id, p_lat, p_lon, flag, distance in batch:
+            skater = skater_payload(user_id, p_lat, p_lon, visible_value(flag), profiles.get(user_id))
+            if skater is None:
+                continue
+            if last is not None:
+                return skaters, last   # hay al menos un visible más: vale la pena otra página
+            skater["distance_m"] = round(distance, 1)
+            skaters.append(skater)
+            if limit is not None and len(skaters) == limit:
+                last = (distance, user_id)
+    # Página llena pero lo que quedaba era invisible: no hay siguiente
+    return skaters, None
+
+
+def warm_live_positions():
+    """Recarga en la grilla a los usuarios con latido reciente en la base."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(WARM_LIVE_SQL, (LIVE_TTL,))
+        now = time.time()
+        rows = [(uid, lat, lon, visible, now - float(age))
+                for uid, lat, lon, visible, age in cur.fetchall()]
+    live_store.load(rows)
+    print(f"📡 Radar en memoria: {len(rows)} posiciones recientes cargadas")
+
+
+def record_heartbeat(user_id, lat, lon, visible=None):
+    """Latido de GPS: al radar en memoria y al buffer de escritura a la base."""
+    live_store.update(user_id, lat, lon, visible)
+    gps_buffer.record(user_id, lat, lon)
+
+
+def poll_live_positions():
+    live_store.poll()
+
+
+def expire_live_positions():
+    live_store.expire()
+    profile_cache.expire()
@@ -1,22 +1,81 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime, timedelta, date
 import secrets
 import os
 
 from database import * # Import everything from our new shared module
-from posts_endpoints import router as posts_router
+from database import ConversacionRequest  # el modelo con paginación (before_id/after_id/limit)
+from queries import *  # SQL de los endpoints (queries.py: importable sin levantar la app)
+from geo import parse_bbox, parse_latlon
+from posts_endpoints import router as posts_router, IS_ADMIN_SQL
+from map_endpoints import (router as map_router, invalidate_spot_caches, on_spots_notify,
+                           sweep_tile_cache, TILE_SWEEP_INTERVAL, SPOTS_CHANNEL)
+from radar_ws import router as radar_ws_router
+from inbox_ws import (router as inbox_ws_router, publish, publish_sync, listen_channel,
+                      start_inbox_listener, stop_inbox_listener)
+from feed_cache import feed_cache, FEED_CHANNEL
+from unread_counters import unread_cache, unread_total
 from migrations import run_migrations
+from background import register_task, start_background_tasks, stop_background_tasks
+from live_positions import (live_store, profile_cache, skaters_nearby, record_heartbeat,
+                            warm_live_positions, expire_live_positions, poll_live_positions,
+                            LIVE_EXPIRE_INTERVAL, LIVE_POLL_INTERVAL)
+from gps_buffer import gps_buffer, flush_gps_buffer, GPS_FLUSH_INTERVAL
+from message_partitions import maintain_message_partitions, MESSAGES_PARTITION_INTERVAL
+from like_counters import (flush_like_counters, reconcile_like_counts,
+                           LIKES_FLUSH_INTERVAL, LIKES_RECONCILE_INTERVAL)
+from feed_ranking import refresh_hot_scores, HOT_REFRESH_INTERVAL
 
 app = FastAPI()
 
+register_task("flush-gps", GPS_FLUSH_INTERVAL, flush_gps_buffer)
+register_task("expirar-radar", LIVE_EXPIRE_INTERVAL, expire_live_positions, run_on_stop=False)
+register_task("cambios-radar", LIVE_POLL_INTERVAL, poll_live_positions, run_on_stop=False)
+register_task("particiones-mensajes", MESSAGES_PARTITION_INTERVAL, maintain_message_partitions, run_on_stop=False)
+register_task("flush-likes", LIKES_FLUSH_INTERVAL, flush_like_counters)
+register_task("reconciliar-likes", LIKES_RECONCILE_INTERVAL, reconcile_like_counts, run_on_stop=False)
+register_task("puntajes-hot", HOT_REFRESH_INTERVAL, refresh_hot_scores, run_on_stop=False)
+register_task("limpiar-tiles", TILE_SWEEP_INTERVAL, sweep_tile_cache, run_on_stop=False)
+listen_channel(FEED_CHANNEL, feed_cache.on_notify)
+listen_channel(SPOTS_CHANNEL, on_spots_notify)
+
 # --- STARTUP EVENT ---
 @app.on_event("startup")
 def on_startup():
     run_migrations()
+    try:
+        maintain_message_partitions()
+    except Exception as e:
+        print(f"⚠️ No se pudieron revisar las particiones de mensajes: {e}")
+    try:
+        warm_live_positions()
+    except Exception as e:
+        print(f"⚠️ No se pudo precargar el radar: {e}")
+    start_background_tasks()
+
+@app.on_event("startup")
+async def on_startup_async():
+    await init_async_pool()
+    start_inbox_listener()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    # Último flush de las tareas (posiciones pendientes) antes de cerrar el pool
+    stop_background_tasks()
+    db_pool.closeall()
+
+@app.on_event("shutdown")
+async def on_shutdown_async():
+    await stop_inbox_listener()
+    await close_async_pool()
 
 # --- CORS ---
 app.include_router(posts_router)
+app.include_router(map_router)
+app.include_router(radar_ws_router)
+app.include_router(inbox_ws_router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,6 +91,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # 1. Configuración de Base de Datos
@@ -75,10 +135,6 @@ class MensajeNuevo(BaseModel):
     id_destinatario: int
     texto: str
 
-class ConversacionRequest(BaseModel):
-    id1: int
-    id2: int
-
 class DueloCreate(BaseModel):
     challenger_id: int
     opponent_id: int
@@ -100,21 +156,6 @@ class ChallengeReject(BaseModel):
     id_duelo: int
     id_usuario: int
 
-class PostNuevo(BaseModel):
-    id_usuario: int
-    texto: str
-    imagen: str = ""
-    tipo: str = "general"
-
-class PostLike(BaseModel):
-    id_post: int
-    id_usuario: int
-
-class PostComment(BaseModel):
-    id_post: int
-    id_usuario: int
-    texto: str
-
 class ClaimRequest(BaseModel):
     id_usuario: int
 
@@ -129,192 +170,16 @@ class RewardClaimRequest(BaseModel):
     id_usuario: int
     id_reward: int
 
-# 3. FUNCIONES DE CONEXIÓN
-def get_db():
-    print(f"🔌 [DEBUG] get_db using URL: {DATABASE_URL}")
-    conn = psycopg2.connect(DATABASE_URL)
-    conn.autocommit = True
-    return conn
-
-def init_db():
-    conn = get_db()
-    cur = conn.cursor()
-    # Esto borrará las ubicaciones antiguas para que todos deban marcar su GPS de nuevo
-    cur.execute("UPDATE usuarios SET ubicacion_actual = NULL;")
-    script_sql = """
-    CREATE EXTENSION IF NOT EXISTS postgis;
-
-    CREATE TABLE IF NOT EXISTS public.usuarios (
-        id_usuario serial4 NOT NULL,
-        nickname varchar(50) NOT NULL,
-        "password" text DEFAULT '1234',
-        email varchar(100) DEFAULT 'skater@mail.com',
-        avatar text,
-        edad int4,
-        comuna varchar(100),
-        crew varchar(100),
-        stance varchar(20) DEFAULT 'Regular',
-        trayectoria varchar(50),
-        saldo_puntos int4 DEFAULT 0,
-        ubicacion_actual geometry(point, 4326),
-        es_premium bool DEFAULT false,
-        visible bool DEFAULT true,
-        ultima_conexion timestamp,
-        total_retos int4 DEFAULT 0,
-        retos_ganados int4 DEFAULT 0,
-        retos_perdidos int4 DEFAULT 0,
-        CONSTRAINT usuarios_nickname_key UNIQUE (nickname),
-        CONSTRAINT usuarios_pkey PRIMARY KEY (id_usuario)
-    );
-
-    CREATE TABLE IF NOT EXISTS public.spots (
-        id_spot serial4 NOT NULL,
-        nombre varchar(100),
-        descripcion text,
-        tipo varchar(50),
-        ubicacion varchar(100),
-        image text,
-        coordenadas geometry(point, 4326),
-        CONSTRAINT spots_pkey PRIMARY KEY (id_spot)
-    );
-
-    CREATE TABLE IF NOT EXISTS public.comentarios (
-        id_comentario serial4 NOT NULL,
-        id_spot int4,
-        id_usuario int4,
-        texto text,
-        fecha timestamp DEFAULT CURRENT_TIMESTAMP,
-        CONSTRAINT comentarios_pkey PRIMARY KEY (id_comentario)
-    );
-
-    CREATE TABLE IF NOT EXISTS public.mensajes (
-        id_mensaje serial4 NOT NULL,
-        id_remitente int4,
-        id_destinatario int4,
-        texto text,
-        leido bool DEFAULT false,
-        fecha_envio timestamp DEFAULT NOW(),
-        CONSTRAINT mensajes_pkey PRIMARY KEY (id_mensaje)
-    );
-
-    CREATE TABLE IF NOT EXISTS public.duelos (
-        id_duelo serial4 NOT NULL,
-        challenger_id int4,
-        opponent_id int4,
-        letras_actuales varchar(20) DEFAULT '|',
-        estado varchar(20) DEFAULT 'pendiente',
-        ganador varchar(100),
-        ganador_id int4,
-        fecha_creacion timestamp DEFAULT NOW(),
-        CONSTRAINT duelos_pkey PRIMARY KEY (id_duelo)
-    );
-
-    CREATE TABLE IF NOT EXISTS public.posts (
-        id_post serial4 NOT NULL,
-        id_usuario int4,
-        texto text NOT NULL,
-        imagen text,
-        tipo varchar(50) DEFAULT 'general',
-        likes_count int4 DEFAULT 0,
-        comments_count int4 DEFAULT 0,
-        fecha_creacion timestamp DEFAULT NOW(),
-        CONSTRAINT posts_pkey PRIMARY KEY (id_post)
-    );
-
-    CREATE TABLE IF NOT EXISTS public.post_likes (
-        id_like serial4 NOT NULL,
-        id_post int4,
-        id_usuario int4,
-        fecha timestamp DEFAULT NOW(),
-        CONSTRAINT post_likes_pkey PRIMARY KEY (id_like),
-        CONSTRAINT post_likes_unique UNIQUE (id_post, id_usuario)
-    );
-
-    CREATE TABLE IF NOT EXISTS public.post_comments (
-        id_comment serial4 NOT NULL,
-        id_post int4,
-        id_usuario int4,
-        texto text NOT NULL,
-        fecha timestamp DEFAULT NOW(),
-        CONSTRAINT post_comments_pkey PRIMARY KEY (id_comment)
-    );
-
-    ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS puntos_actuales int4 DEFAULT 0;
-    ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS puntos_historicos int4 DEFAULT 0;
-    ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS ultima_fecha_juego date;
-    ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS racha_actual int4 DEFAULT 0;
-    ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS mejor_racha int4 DEFAULT 0;
-    ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS ultimo_juego_fecha date;
-    ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS es_admin bool DEFAULT false;
-
-    CREATE TABLE IF NOT EXISTS public.transacciones_puntos (
-        id_transaccion serial4 NOT NULL,
-        id_usuario int4,
-        cantidad int4,
-        tipo_transaccion varchar(50),
-        descripcion text,
-        fecha_creacion timestamp DEFAULT NOW(),
-        CONSTRAINT transacciones_puntos_pkey PRIMARY KEY (id_transaccion),
-        CONSTRAINT fk_usuario FOREIGN KEY (id_usuario) REFERENCES usuarios(id_usuario)
-    );
-
-    CREATE TABLE IF NOT EXISTS public.game_sessions (
-        id_session serial4 PRIMARY KEY,
-        id_usuario int4 REFERENCES usuarios(id_usuario),
-        session_token varchar(64) UNIQUE NOT NULL,
-        fecha_inicio timestamp DEFAULT NOW(),
-        fecha_expiracion timestamp NOT NULL,
-        score_final int4,
-        estado varchar(20) DEFAULT 'active',
-        ip_address varchar(45)
-    );
-
-    CREATE TABLE IF NOT EXISTS public.rewards (
-        id_reward serial4 PRIMARY KEY,
-        nombre varchar(100) NOT NULL,
-        descripcion text,
-        imagen text,
-        costo_puntos int4 NOT NULL,
-        marca varchar(100),
-        stock int4 DEFAULT 0,
-        activo bool DEFAULT true,
-        fecha_creacion timestamp DEFAULT NOW()
-    );
-
-    CREATE TABLE IF NOT EXISTS public.user_rewards (
-        id_claim serial4 PRIMARY KEY,
-        id_usuario int4 REFERENCES usuarios(id_usuario),
-        id_reward int4 REFERENCES rewards(id_reward),
-        fecha_canje timestamp DEFAULT NOW(),
-        estado varchar(20) DEFAULT 'pendiente',
-        codigo_canje varchar(20) UNIQUE
-    );
-
-    UPDATE usuarios SET es_premium = true;
-    UPDATE usuarios SET es_admin = true WHERE LOWER(nickname) IN ('alvaro', 'vbvsone');
-    """
-    cur.execute(script_sql)
-    conn.commit()
-    cur.close()
-    conn.close()
-
-# Iniciar tablas al arrancar
-init_db()
-
 @app.get("/")
 def read_root():
     return {"mensaje": "API Skate v8.0 - Live en Render 🚀"}
 
 @app.get("/api/debug/admins")
-def debug_admins():
+def debug_admins(conn=Depends(get_conn)):
     """Endpoint temporal para verificar usuarios admin"""
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT id_usuario, nickname, es_admin FROM usuarios WHERE es_admin = true OR LOWER(nickname) IN ('alvaro', 'vbvsone')")
-        return cur.fetchall()
-    finally:
-        conn.close()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(DEBUG_ADMINS_SQL)
+    return cur.fetchall()
 
 
 # ==========================================
@@ -323,236 +188,261 @@ def debug_admins():
 
 # 1. Actualizar MI posición (El "Latido")
 # 1. Actualizar MI posición y marcar actividad reciente
+# El latido va al radar en memoria; usuarios se actualiza en lote (gps_buffer)
 @app.put("/api/users/{id_usuario}/gps")
 def update_gps(id_usuario: int, gps: Coordenadas):
-    conn = get_db()
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            UPDATE usuarios 
-            SET ubicacion_actual = ST_SetSRID(ST_MakePoint(%s, %s), 4326),
-                ultima_conexion = NOW()  -- 👈 Esto elimina los "fantasmas"
-            WHERE id_usuario = %s
-        """, (gps.lon, gps.lat, id_usuario))
-        return {"msg": "Ubicación actualizada"}
-    except Exception as e:
-        raise HTTPException(500, str(e))
-    finally:
-        conn.close()
+    record_heartbeat(id_usuario, gps.lat, gps.lon)
+    return {"msg": "Ubicación actualizada"}
+
+@app.get("/api/metrics/gps")
+def get_gps_metrics():
+    """Estado del buffer de latidos: tamaño, latencia de flush y coalescencia."""
+    return {**gps_buffer.metrics(), "live_positions": len(live_store)}
+
+@app.get("/api/metrics/feed")
+def get_feed_metrics():
+    """Páginas del feed en cache y aciertos desde el arranque."""
+    return feed_cache.metrics()
+
+# Radio por defecto: 12.000km para cubrir toda América (clientes viejos no mandan radius_m)
+RADAR_RADIUS_M = 12000000
+RADAR_DEFAULT_LIMIT = 50
+RADAR_MAX_LIMIT = 200
 
-# 2. Radar de 80km con filtros de privacidad y tiempo
+# 2. Radar con filtros de privacidad y tiempo (solo activos en los últimos 5 minutos)
 @app.get("/api/radar")
-def get_skaters_nearby(lat: float, lon: float, user_id: int):
-    conn = get_db()
+def get_skaters_nearby(lat: float, lon: float, user_id: int, response: Response,
+                       radius_m: float = RADAR_RADIUS_M, limit: int = RADAR_DEFAULT_LIMIT,
+                       cursor: str = None):
+    """Skaters cercanos ordenados por distancia (distance_m), de a `limit`.
+    Si hay más, el header X-Next-Cursor trae el `cursor` para la página siguiente."""
+    if not 0 < radius_m <= RADAR_RADIUS_M:
+        raise HTTPException(400, f"radius_m debe estar entre 1 y {RADAR_RADIUS_M}")
+    limit = max(1, min(limit, RADAR_MAX_LIMIT))
+    after = None
+    if cursor:
+        try:
+            distance, last_id = cursor.split(":")
+            after = (float(distance), int(last_id))
+        except ValueError:
+            raise HTTPException(400, "cursor inválido")
     try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        query = """
-            SELECT id_usuario, nickname, avatar, crew, stance,
-                   ST_X(ubicacion_actual::geometry) as longitude, 
-                   ST_Y(ubicacion_actual::geometry) as latitude
-            FROM usuarios
-            WHERE id_usuario != %s 
-            AND visible = true              -- 👈 Solo gente en "Online"
-            AND ubicacion_actual IS NOT NULL 
-            AND ultima_conexion >= NOW() - INTERVAL '5 minutes' -- 👈 Solo usuarios activos en los últimos 5 minutos
-            AND ST_DWithin(
-                ubicacion_actual::geography, 
-                ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, 
-                12000000  -- 👈 12.000km para cubrir toda América
-            );
-        """
-        cur.execute(query, (user_id, lon, lat))
-        return cur.fetchall()
-    finally:
-        conn.close()
+        skaters, next_after = skaters_nearby(lat, lon, radius_m, exclude_id=user_id,
+                                             limit=limit, after=after)
+    except Exception as e:
+        raise HTTPException(500, str(e))
+    if next_after is not None:
+        response.headers["X-Next-Cursor"] = f"{next_after[0]!r}:{next_after[1]}"
+    return skaters
 
 # 3. Nuevo Endpoint para el Switch de Flutter (CORREGIDO)
 @app.post("/api/users/status")
-def update_status(data: dict):
-    conn = get_db()
+def update_status(data: dict, conn=Depends(get_conn)):
     try:
         cur = conn.cursor()
-        # 1. Corregimos el nombre de la tabla a 'usuarios'
-        # 2. Agregamos que actualice la ubicación si viene en el paquete
+        # La visibilidad se guarda al tiro (privacidad); la posición va por el radar en memoria
+        cur.execute(SET_VISIBLE_SQL, (data['visible'], data['id']))
         if data.get('lat') and data.get('lon'):
-            cur.execute("""
-                UPDATE usuarios 
-                SET visible = %s, 
-                    ubicacion_actual = ST_SetSRID(ST_MakePoint(%s, %s), 4326),
-                    ultima_conexion = NOW()
-                WHERE id_usuario = %s
-            """, (data['visible'], data['lon'], data['lat'], data['id']))
+            record_heartbeat(data['id'], data['lat'], data['lon'], visible=data['visible'])
         else:
             # Si no hay GPS, al menos cambiamos la visibilidad
-            cur.execute("UPDATE usuarios SET visible = %s WHERE id_usuario = %s", 
-                       (data['visible'], data['id']))
-        
-        conn.commit()  # 🔥 CRÍTICO: Sin esto, nada se guarda en PostgreSQL
+            live_store.set_visible(data['id'], data['visible'])
+        profile_cache.invalidate(data['id'])
         return {"success": True, "db_updated": True}
     except Exception as e:
         print(f"Error en status: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 # ==========================================
 # 💬 SISTEMA DE MENSAJERÍA
 # ==========================================
 
 @app.post("/api/messages")
-def send_message(msg: MensajeNuevo):
+async def send_message(msg: MensajeNuevo, conn=Depends(get_async_conn)):
     """Enviar un mensaje de un usuario a otro"""
-    conn = get_db()
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO mensajes (id_remitente, id_destinatario, texto)
-            VALUES (%s, %s, %s)
-            RETURNING id_mensaje, fecha_envio
-        """, (msg.id_remitente, msg.id_destinatario, msg.texto))
-        result = cur.fetchone()
-        conn.commit()
-        
+        async with conn.transaction():
+            result = await conn.fetchrow("""
+                INSERT INTO mensajes (id_remitente, id_destinatario, texto)
+                VALUES ($1, $2, $3)
+                RETURNING id_mensaje, fecha_envio
+            """, msg.id_remitente, msg.id_destinatario, msg.texto)
+
+            summary = await conn.fetchrow(
+                CONVERSATION_SUMMARY_UPSERT_SQL, msg.id_remitente, msg.id_destinatario,
+                result['id_mensaje'], msg.texto, result['fecha_envio'], MESSAGE_PREVIEW_CHARS)
+
+            # Push a los sockets abiertos (pg_notify sale al hacer COMMIT)
+            await publish(conn, {msg.id_remitente, msg.id_destinatario}, {
+                "type": "message",
+                "id_mensaje": result['id_mensaje'],
+                "id_remitente": msg.id_remitente,
+                "id_destinatario": msg.id_destinatario,
+                "texto": msg.texto,
+                "fecha_envio": result['fecha_envio'],
+            })
+            cantidad = summary['no_leidos_a'] if msg.id_destinatario == summary['usuario_a'] else summary['no_leidos_b']
+            total = await conn.fetchval(UNREAD_INCREMENT_SQL, msg.id_destinatario)
+            await publish(conn, [msg.id_destinatario], {
+                "type": "unread", "total": total,
+                "id_remitente": msg.id_remitente, "cantidad": cantidad,
+            })
+        
+        unread_cache.set(msg.id_destinatario, total)
         print(f"💬 Mensaje enviado: User {msg.id_remitente} → User {msg.id_destinatario}")
         return {
             "success": True,
-            "id_mensaje": result[0],
-            "fecha_envio": result[1]
+            "id_mensaje": result['id_mensaje'],
+            "fecha_envio": result['fecha_envio']
         }
     except Exception as e:
         print(f"❌ Error enviando mensaje: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
+
+# Historial de chat por páginas de id_mensaje (índice idx_mensajes_par_id)
+MESSAGES_DEFAULT_LIMIT = 50
+MESSAGES_MAX_LIMIT = 200
+# id_mensaje y fecha_envio avanzan juntos salvo por segundos entre transacciones concurrentes
+MESSAGES_CLOCK_SKEW = timedelta(hours=1)
+
+def _history_bounds(primer_mensaje):
+    """Cotas inferiores de fecha_envio a probar, de la más barata a la completa."""
+    primer_mensaje = primer_mensaje or datetime.min
+    hot = datetime.now() - timedelta(days=MESSAGES_HOT_DAYS)
+    if primer_mensaje < hot:
+        return [hot, primer_mensaje]
+    return [primer_mensaje]
+
+def _conversation_cursor(before_id, after_id, limit):
+    """Valida los cursores: (limit, id del cursor, True si pagina hacia adelante)."""
+    if before_id is not None and after_id is not None:
+        raise HTTPException(400, "Usa before_id o after_id, no ambos")
+    limit = max(1, min(limit or MESSAGES_DEFAULT_LIMIT, MESSAGES_MAX_LIMIT))
+    if after_id is not None:
+        return limit, after_id, True
+    return limit, before_id, False
+
+def _conversation_page(rows, participantes, limit, forward):
+    """Arma la página a partir de limit+1 filas en orden del índice
+    (DESC hacia atrás, ASC hacia adelante). Mensajes siempre en orden cronológico."""
+    has_more = len(rows) > limit
+    rows = list(rows[:limit])
+    if not forward:
+        rows.reverse()
+    return {
+        "mensajes": rows,
+        # nickname/avatar una vez por participante, no por mensaje
+        "participantes": participantes,
+        "next_before_id": rows[0]["id_mensaje"] if rows and has_more and not forward else None,
+        "next_after_id": rows[-1]["id_mensaje"] if rows and has_more and forward else None,
+    }
 
 @app.get("/api/messages/conversation")
-def get_conversation(user1: int, user2: int):
-    """Obtener todos los mensajes entre dos usuarios con timestamps en timezone de Chile"""
-    conn = get_db()
+def get_conversation(user1: int, user2: int, before_id: int = None, after_id: int = None,
+                     limit: int = MESSAGES_DEFAULT_LIMIT, conn=Depends(get_conn)):
+    """Mensajes entre dos usuarios con timestamps en timezone de Chile, paginados:
+    - sin cursor: la última página (los `limit` más recientes)
+    - before_id: la página anterior a ese mensaje (scroll hacia arriba)
+    - after_id: los mensajes nuevos desde ese id
+    Responde {mensajes, participantes, next_before_id, next_after_id}."""
+    limit, cursor_id, forward = _conversation_cursor(before_id, after_id, limit)
+    query = conversation_history_sql(forward, cursor_id is not None)
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT 
-                m.id_mensaje,
-                m.id_remitente,
-                m.id_destinatario,
-                m.texto,
-                m.leido,
-                to_char(m.fecha_envio AT TIME ZONE 'UTC' AT TIME ZONE 'America/Santiago', 'YYYY-MM-DD\"T\"HH24:MI:SS\"−03:00\"') as fecha_envio,
-                u.nickname as remitente_nombre,
-                u.avatar as remitente_avatar
-            FROM mensajes m
-            JOIN usuarios u ON m.id_remitente = u.id_usuario
-            WHERE (id_remitente = %s AND id_destinatario = %s)
-               OR (id_remitente = %s AND id_destinatario = %s)
-            ORDER BY fecha_envio ASC
-        """, (user1, user2, user2, user1))
-        
-        msgs = cur.fetchall()
-        print(f"💬 Conversación User {user1} ↔ User {user2}: {len(msgs)} mensajes")
-        return msgs
+        cur.execute(FIRST_MESSAGE_SQL, {"u1": user1, "u2": user2})
+        conversacion = cur.fetchone()
+        rows = []
+        if conversacion is not None:   # sin resumen no hay mensajes
+            bounds = _history_bounds(conversacion['fecha_primer_mensaje'])
+            for i, desde in enumerate(bounds):
+                cur.execute(query, {"u1": user1, "u2": user2, "desde": desde,
+                                    "cursor": cursor_id, "limit": limit + 1})
+                rows = cur.fetchall()
+                if len(rows) > limit or i == len(bounds) - 1:
+                    break
+                if forward:
+                    # Cursor reciente: todo lo posterior está en la ventana caliente
+                    cur.execute(CURSOR_IN_WINDOW_SQL, (cursor_id, desde + MESSAGES_CLOCK_SKEW))
+                    if cur.fetchone():
+                        break
+
+        cur.execute(PARTICIPANTS_SQL, (user1, user2))
+        participantes = cur.fetchall()
+
+        page = _conversation_page(rows, participantes, limit, forward)
+        print(f"💬 Conversación User {user1} ↔ User {user2}: {len(page['mensajes'])} mensajes")
+        return page
     except Exception as e:
         print(f"❌ Error obteniendo conversación: {e}")
-        return []
-    finally:
-        conn.close()
+        raise HTTPException(500, str(e))
 
 @app.get("/api/messages/unread")
-def get_unread_messages(user_id: int):
-    """Obtener mensajes no leídos agrupados por remitente (para notificaciones)"""
-    conn = get_db()
+def get_unread_messages(user_id: int, conn=Depends(get_conn)):
+    """Obtener mensajes no leídos agrupados por remitente (para notificaciones).
+    Sale de los contadores de conversaciones, sin contar filas de mensajes."""
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT 
-                id_remitente,
-                u.nickname,
-                u.avatar,
-                COUNT(*) as cantidad,
-                MAX(fecha_envio) as ultimo_mensaje
-            FROM mensajes m
-            JOIN usuarios u ON m.id_remitente = u.id_usuario
-            WHERE id_destinatario = %s AND leido = FALSE
-            GROUP BY id_remitente, u.nickname, u.avatar
-            ORDER BY ultimo_mensaje DESC
-        """, (user_id,))
+        cur.execute(UNREAD_BY_SENDER_SQL, (user_id, user_id))
         
         unread = cur.fetchall()
         total = sum([u['cantidad'] for u in unread])
+        unread_cache.set(user_id, total)
         print(f"🔔 User {user_id} tiene {total} mensajes no leídos")
         return unread
     except Exception as e:
         print(f"❌ Error obteniendo no leídos: {e}")
         return []
-    finally:
-        conn.close()
+
+@app.get("/api/messages/unread/count")
+def get_unread_count(user_id: int, conn=Depends(get_conn)):
+    """Número del badge: cache del worker o contadores_no_leidos (por PK)."""
+    try:
+        return {"total": unread_total(conn, user_id)}
+    except Exception as e:
+        print(f"❌ Error obteniendo contador de no leídos: {e}")
+        raise HTTPException(500, str(e))
 
 @app.post("/api/messages/mark_read")
-def mark_as_read(data: dict):
+def mark_as_read(data: dict, conn=Depends(get_conn)):
     """Marcar mensajes como leídos cuando se abre el chat"""
-    conn = get_db()
+    lector, remitente = data['id_destinatario'], data['id_remitente']
     try:
         cur = conn.cursor()
-        cur.execute("""
-            UPDATE mensajes 
-            SET leido = TRUE
-            WHERE id_destinatario = %s 
-              AND id_remitente = %s
-              AND leido = FALSE
-        """, (data['id_destinatario'], data['id_remitente']))
-        conn.commit()
-        
+        cur.execute("BEGIN")
+        cur.execute(MARK_READ_LOCK_SQL, {"lector": lector, "remitente": remitente})
+        conversacion = cur.fetchone()
+        desde = (conversacion[0] if conversacion else None) or datetime.min
+        cur.execute(MARK_READ_SQL, {"lector": lector, "remitente": remitente, "desde": desde})
         updated = cur.rowcount
+        if updated:
+            cur.execute(MARK_READ_SUMMARY_SQL, {"lector": lector, "remitente": remitente, "n": updated})
+            # Acuse para quien envió y badge actualizado para quien leyó
+            publish_sync(cur, [remitente], {
+                "type": "read", "id_lector": lector, "id_remitente": remitente, "updated": updated,
+            })
+            cur.execute(UNREAD_DECREMENT_SQL, (updated, lector))
+            row = cur.fetchone()
+            total = row[0] if row else 0
+            publish_sync(cur, [lector], {
+                "type": "unread", "total": total, "id_remitente": remitente, "cantidad": 0,
+            })
+        cur.execute("COMMIT")
+        if updated:
+            unread_cache.set(lector, total)
+        
         print(f"✅ Marcados {updated} mensajes como leídos")
         return {"success": True, "updated": updated}
     except Exception as e:
         print(f"❌ Error marcando como leído: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 @app.get("/api/messages/conversations/{user_id}")
-def get_user_conversations(user_id: int):
-    """Obtener todas las conversaciones de un usuario con el último mensaje y fecha en timezone de Chile"""
-    conn = get_db()
+def get_user_conversations(user_id: int, conn=Depends(get_conn)):
+    """Obtener todas las conversaciones de un usuario con el último mensaje y fecha en timezone de Chile.
+    Se lee del resumen `conversaciones` (una fila por par), no de mensajes."""
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        # Obtenemos todas las conversaciones donde el usuario participó
-        cur.execute("""
-            WITH conversaciones AS (
-                SELECT DISTINCT
-                    CASE 
-                        WHEN id_remitente = %s THEN id_destinatario
-                        ELSE id_remitente
-                    END as otro_usuario_id
-                FROM mensajes
-                WHERE id_remitente = %s OR id_destinatario = %s
-            )
-            SELECT 
-                c.otro_usuario_id,
-                u.nickname,
-                u.avatar,
-                (SELECT texto 
-                 FROM mensajes m 
-                 WHERE (m.id_remitente = %s AND m.id_destinatario = c.otro_usuario_id)
-                    OR (m.id_remitente = c.otro_usuario_id AND m.id_destinatario = %s)
-                 ORDER BY m.fecha_envio DESC 
-                 LIMIT 1) as ultimo_mensaje,
-                (SELECT to_char(fecha_envio AT TIME ZONE 'UTC' AT TIME ZONE 'America/Santiago', 'YYYY-MM-DD\"T\"HH24:MI:SS\"−03:00\"')
-                 FROM mensajes m 
-                 WHERE (m.id_remitente = %s AND m.id_destinatario = c.otro_usuario_id)
-                    OR (m.id_remitente = c.otro_usuario_id AND m.id_destinatario = %s)
-                 ORDER BY m.fecha_envio DESC 
-                 LIMIT 1) as fecha_ultimo_mensaje,
-                (SELECT COUNT(*) 
-                 FROM mensajes m 
-                 WHERE m.id_remitente = c.otro_usuario_id 
-                   AND m.id_destinatario = %s 
-                   AND m.leido = FALSE) as mensajes_no_leidos
-            FROM conversaciones c
-            JOIN usuarios u ON c.otro_usuario_id = u.id_usuario
-            ORDER BY fecha_ultimo_mensaje DESC
-        """, (user_id, user_id, user_id, user_id, user_id, user_id, user_id, user_id))
+        cur.execute(USER_CONVERSATIONS_SQL, (user_id, user_id))
         
         conversations = cur.fetchall()
         print(f"💬 Usuario {user_id} tiene {len(conversations)} conversaciones")
@@ -560,50 +450,43 @@ def get_user_conversations(user_id: int):
     except Exception as e:
         print(f"❌ Error obteniendo conversaciones: {e}")
         return []
-    finally:
-        conn.close()
 
 # ==========================================
 # 🔐 AUTH, PERFIL Y SPOTS (TU CÓDIGO PROBADO)
 # ==========================================
 
 @app.post("/api/login/")
-def login(user: UserAuth):
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT * FROM usuarios WHERE nickname = %s AND password = %s", (user.username, user.password))
-        u = cur.fetchone()
-        if u:
-            return {
-                "id_usuario": u['id_usuario'],
-                "username": u['nickname'],
-                "level": "Pro" if (u['saldo_puntos'] or 0) > 1000 else "Novato",
-                "avatar": u['avatar'] if u['avatar'] else "",
-                
-                # --- AGREGA ESTAS LÍNEAS NUEVAS ---
-                "es_premium": u['es_premium'] if u['es_premium'] else False,
-                "es_admin": u.get('es_admin', False) or False,
-                # ----------------------------------
-
-                "edad": u['edad'] if u['edad'] else 0,
-                "comuna": u['comuna'] if u['comuna'] else "",
-                "crew": u['crew'] if u['crew'] else "",
-                "stance": u['stance'] if u['stance'] else "Regular",
-                "trayectoria": u['trayectoria'] if u['trayectoria'] else "",
-                
-                # --- ECONOMÍA ---
-                "puntos_actuales": u['puntos_actuales'] if u['puntos_actuales'] else 0,
-                "puntos_historicos": u['puntos_historicos'] if u['puntos_historicos'] else 0,
-            }
-        else:
-            raise HTTPException(401, "Credenciales incorrectas")
-    finally:
-        conn.close()
+def login(user: UserAuth, conn=Depends(get_conn)):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(LOGIN_SQL, (user.username, user.password))
+    u = cur.fetchone()
+    if u:
+        return {
+            "id_usuario": u['id_usuario'],
+            "username": u['nickname'],
+            "level": "Pro" if (u['saldo_puntos'] or 0) > 1000 else "Novato",
+            "avatar": u['avatar'] if u['avatar'] else "",
+            
+            # --- AGREGA ESTAS LÍNEAS NUEVAS ---
+            "es_premium": u['es_premium'] if u['es_premium'] else False,
+            "es_admin": u.get('es_admin', False) or False,
+            # ----------------------------------
+
+            "edad": u['edad'] if u['edad'] else 0,
+            "comuna": u['comuna'] if u['comuna'] else "",
+            "crew": u['crew'] if u['crew'] else "",
+            "stance": u['stance'] if u['stance'] else "Regular",
+            "trayectoria": u['trayectoria'] if u['trayectoria'] else "",
+            
+            # --- ECONOMÍA ---
+            "puntos_actuales": u['puntos_actuales'] if u['puntos_actuales'] else 0,
+            "puntos_historicos": u['puntos_historicos'] if u['puntos_historicos'] else 0,
+        }
+    else:
+        raise HTTPException(401, "Credenciales incorrectas")
 
 @app.post("/api/register/")
-def register(user: UserAuth):
-    conn = get_db()
+def register(user: UserAuth, conn=Depends(get_conn)):
     try:
         cur = conn.cursor()
         cur.execute("INSERT INTO usuarios (nickname, password) VALUES (%s, %s)", (user.username, user.password))
@@ -613,52 +496,41 @@ def register(user: UserAuth):
         import traceback
         traceback.print_exc()
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 @app.put("/api/users/{id_usuario}/profile")
-def update_profile(id_usuario: int, p: PerfilFull):
-    conn = get_db()
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            UPDATE usuarios 
-            SET avatar=%s, edad=%s, comuna=%s, crew=%s, stance=%s, trayectoria=%s
-            WHERE id_usuario=%s
-        """, (p.avatar, p.edad, p.comuna, p.crew, p.stance, p.trayectoria, id_usuario))
-        return {"msg": "Perfil actualizado"}
-    finally:
-        conn.close()
+def update_profile(id_usuario: int, p: PerfilFull, conn=Depends(get_conn)):
+    cur = conn.cursor()
+    cur.execute(UPDATE_PROFILE_SQL, (p.avatar, p.edad, p.comuna, p.crew, p.stance, p.trayectoria, id_usuario))
+    profile_cache.invalidate(id_usuario)
+    return {"msg": "Perfil actualizado"}
+
+# Tope de spots por request cuando se pide un viewport (bbox / near)
+SPOTS_DEFAULT_LIMIT = 200
+SPOTS_MAX_LIMIT = 1000
 
 @app.get("/api/spots")
 @app.get("/api/spots/")
-def get_spots():
+def get_spots(bbox: str = None, near: str = None, limit: int = SPOTS_DEFAULT_LIMIT, conn=Depends(get_conn)):
+    """Spots del mapa.
+    - bbox=minLon,minLat,maxLon,maxLat: solo los del viewport (índice GiST de coordenadas)
+    - near=lat,lon: orden KNN por distancia (operador <->), con distance_m
+    Sin bbox ni near devuelve todos (compatibilidad con clientes viejos)."""
     print("--- SOLICITANDO SPOTS ---")
-    conn = get_db()
-    if not conn:
-        return []
+
+    near_params = []
+    if near is not None:
+        near_lat, near_lon = parse_latlon(near)
+        near_params = [near_lon, near_lat]
+    params = [*near_params, DEFAULT_COMMENT_AVATAR, SPOT_COMMENTS_PREVIEW]
+    if bbox is not None:
+        params.extend(parse_bbox(bbox))
+    params.extend(near_params)
+    if bbox is not None or near is not None:
+        params.append(max(1, min(limit, SPOTS_MAX_LIMIT)))
         
     try:
         cur = conn.cursor()
-        
-        # Pedimos 'image' (nombre real en BD)
-        # Pedimos 'image' y calculamos el promedio de estrellas
-        cur.execute("""
-            SELECT 
-                s.id_spot, 
-                s.nombre, 
-                s.descripcion, 
-                s.tipo,
-                s.ubicacion,
-                s.image,
-                ST_X(s.coordenadas::geometry), 
-                ST_Y(s.coordenadas::geometry),
-                COALESCE(AVG(c.estrellas), 0) as promedio
-            FROM spots s
-            LEFT JOIN calificaciones c ON s.id_spot = c.id_spot
-            GROUP BY s.id_spot
-            ORDER BY s.id_spot DESC
-        """)
+        cur.execute(spots_sql(bbox is not None, near is not None), params)
         rows = cur.fetchall()
         print(f"Spots encontrados en DB: {len(rows)}")
 
@@ -675,30 +547,14 @@ def get_spots():
                 "longitude": row[6],
                 "latitude": row[7],
                 "promedio": float(row[8]),  # <--- NUEVO CAMPO AGREGADO
-                "comments": []
+                "comments": row[9]
             }
+            if row[10] is not None:
+                spot_dict["distance_m"] = round(row[10], 1)
 
             # Parche para imágenes rotas
             if spot_dict["imagen"] and "blob:" in spot_dict["imagen"]:
                  spot_dict["imagen"] = "https://images.unsplash.com/photo-1520045864914-894836162391"
-
-            cur.execute("""
-                SELECT c.texto, u.nickname, u.avatar, c.id_comentario
-                FROM comentarios c
-                JOIN usuarios u ON c.id_usuario = u.id_usuario
-                WHERE c.id_spot = %s
-                ORDER BY c.fecha DESC
-            """, (row[0],))
-            
-            comentarios = cur.fetchall()
-            for c in comentarios:
-                avatar = c[2] if c[2] else "https://images.unsplash.com/photo-1544005313-94ddf0286df2"
-                spot_dict["comments"].append({
-                    "texto": c[0],
-                    "user": c[1],
-                    "avatar": avatar,
-                    "id": c[3] # ID de comentario para borrar
-                })
             
             spots_list.append(spot_dict)
 
@@ -707,36 +563,54 @@ def get_spots():
     except Exception as e:
         print(f"\n🛑 ERROR REAL: {e}\n")
         return []
-    finally:
-        conn.close()
 
-@app.post("/api/spots/")
-def create_spot(spot: SpotNuevo):
-    conn = get_db()
+@app.get("/api/spots/{id_spot}/comments")
+def get_spot_comments(id_spot: int, before_id: int = 0, limit: int = 20, conn=Depends(get_conn)):
+    """Hilo completo de comentarios de un spot, del más nuevo al más viejo.
+    Paginado por cursor: pasar el `id` del último comentario recibido como `before_id`.
+    Un before_id que no es de este spot (o que ya se borró) responde 404."""
+    limit = max(1, min(limit, 100))
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO spots (nombre, tipo, descripcion, ubicacion, image, coordenadas) 
-            VALUES (%s, %s, %s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326))
-        """, (spot.nombre, spot.tipo, spot.descripcion, spot.ubicacion, spot.image, spot.lon, spot.lat))
-        return {"msg": "Spot creado"}
-    finally:
-        conn.close()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        after = ()
+        if before_id:
+            cur.execute(SPOT_COMMENT_CURSOR_SQL, (before_id, id_spot))
+            cursor_row = cur.fetchone()
+            if cursor_row is None:
+                raise HTTPException(404, "before_id no es un comentario de este spot")
+            after = (cursor_row['fecha'], cursor_row['id_comentario'])
+        cur.execute(spot_comments_sql(bool(after)), (DEFAULT_COMMENT_AVATAR, id_spot, *after, limit))
+        
+        comments = cur.fetchall()
+        return {
+            "comments": comments,
+            "next_before_id": comments[-1]['id'] if len(comments) == limit else None
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error obteniendo comentarios del spot: {e}")
+        raise HTTPException(500, str(e))
+
+@app.post("/api/spots/")
+def create_spot(spot: SpotNuevo, conn=Depends(get_conn)):
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO spots (nombre, tipo, descripcion, ubicacion, image, coordenadas) 
+        VALUES (%s, %s, %s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326))
+    """, (spot.nombre, spot.tipo, spot.descripcion, spot.ubicacion, spot.image, spot.lon, spot.lat))
+    invalidate_spot_caches(spot.lat, spot.lon, cur)
+    return {"msg": "Spot creado"}
 
 @app.get("/api/users/") # Para S.K.A.T.E
-def get_users(exclude_id: int = 0):
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT id_usuario, nickname, avatar, saldo_puntos FROM usuarios WHERE id_usuario != %s", (exclude_id,))
-        return cur.fetchall()
-    finally:
-        conn.close()
+def get_users(exclude_id: int = 0, conn=Depends(get_conn)):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(USERS_LIST_SQL, (exclude_id,))
+    return cur.fetchall()
 # --- ESTO ES LO QUE TE FALTA ---
 
 @app.post("/api/comments/")
-def add_comment(comment: ComentarioNuevo): # Usamos tu clase 'ComentarioNuevo'
-    conn = get_db()
+def add_comment(comment: ComentarioNuevo, conn=Depends(get_conn)): # Usamos tu clase 'ComentarioNuevo'
     try:
         cur = conn.cursor()
         # Guardamos en la tabla 'comentarios' de la base de datos
@@ -748,8 +622,6 @@ def add_comment(comment: ComentarioNuevo): # Usamos tu clase 'ComentarioNuevo'
     except Exception as e:
         print(f"Error comentarios: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
         # ==========================================
 # 🥊 ZONA DE DUELOS (LO QUE FALTABA)
 # ==========================================
@@ -762,8 +634,7 @@ class DueloCreate(BaseModel):
 # 2. Creamos la ruta para recibir el desafío
 @app.post("/api/duelo/crear")
 @app.post("/api/duelo/crear/") 
-def crear_duelo(duelo: DueloCreate):
-    conn = get_db()
+def crear_duelo(duelo: DueloCreate, conn=Depends(get_conn)):
     try:
         print(f"🔥 NUEVO DUELO: {duelo.challenger_id} vs {duelo.opponent_id}")
         cur = conn.cursor()
@@ -777,13 +648,15 @@ def crear_duelo(duelo: DueloCreate):
         """, (duelo.challenger_id, duelo.opponent_id))
         
         new_id = cur.fetchone()[0]
+        publish_sync(cur, [duelo.opponent_id], {
+            "type": "challenge", "id_duelo": new_id,
+            "challenger_id": duelo.challenger_id, "opponent_id": duelo.opponent_id,
+        })
         return {"msg": "Duelo enviado", "id_duelo": new_id}
         
     except Exception as e:
         print(f"Error creando duelo: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 
 # ==========================================
@@ -791,8 +664,7 @@ def crear_duelo(duelo: DueloCreate):
 # ==========================================
 
 @app.delete("/api/spots/{id_spot}")
-def delete_spot(id_spot: int, user_id: int):
-    conn = get_db()
+def delete_spot(id_spot: int, user_id: int, conn=Depends(get_conn)):
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -803,7 +675,7 @@ def delete_spot(id_spot: int, user_id: int):
         # CREATE TABLE spots (id_spot serial4, ...). No tiene id_usuario.
         # Entonces solo ADMIN puede borrar spots.
         
-        cur.execute("SELECT es_admin FROM usuarios WHERE id_usuario = %s", (user_id,))
+        cur.execute(IS_ADMIN_SQL, (user_id,))
         user_result = cur.fetchone()
         
         is_admin = False
@@ -814,32 +686,32 @@ def delete_spot(id_spot: int, user_id: int):
             raise HTTPException(403, "Solo administradores pueden eliminar spots")
 
         # Borrar comentarios asociados primero
-        cur.execute("DELETE FROM comentarios WHERE id_spot = %s", (id_spot,))
+        cur.execute(DELETE_SPOT_COMMENTS_SQL, (id_spot,))
         # Borrar spot
-        cur.execute("DELETE FROM spots WHERE id_spot = %s", (id_spot,))
+        cur.execute(DELETE_SPOT_SQL, (id_spot,))
+        deleted = cur.fetchone()
         
         conn.commit()
+        if deleted and deleted['lat'] is not None:
+            invalidate_spot_caches(deleted['lat'], deleted['lon'], cur)
         return {"msg": "Spot eliminado"}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 @app.delete("/api/comments/{id_comentario}")
-def delete_comment(id_comentario: int, user_id: int):
-    conn = get_db()
+def delete_comment(id_comentario: int, user_id: int, conn=Depends(get_conn)):
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Verificar dueño del comentario
-        cur.execute("SELECT id_usuario FROM comentarios WHERE id_comentario = %s", (id_comentario,))
+        cur.execute(COMMENT_OWNER_SQL, (id_comentario,))
         comment = cur.fetchone()
         if not comment:
             raise HTTPException(404, "Comentario no encontrado")
             
-        cur.execute("SELECT es_admin FROM usuarios WHERE id_usuario = %s", (user_id,))
+        cur.execute(IS_ADMIN_SQL, (user_id,))
         user_result = cur.fetchone()
         
         is_admin = False
@@ -849,52 +721,36 @@ def delete_comment(id_comentario: int, user_id: int):
         if comment['id_usuario'] != user_id and not is_admin:
             raise HTTPException(403, "No tienes permiso")
 
-        cur.execute("DELETE FROM comentarios WHERE id_comentario = %s", (id_comentario,))
+        cur.execute(DELETE_COMMENT_SQL, (id_comentario,))
         conn.commit()
         return {"msg": "Comentario eliminado"}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 class SpotImageUpdate(BaseModel):
     image: str
 
 @app.put("/api/spots/{id_spot}/image")
-def update_spot_image(id_spot: int, data: SpotImageUpdate):
-    conn = get_db()
-    try:
-        cur = conn.cursor()
-        cur.execute("UPDATE spots SET image = %s WHERE id_spot = %s", (data.image, id_spot))
-        return {"msg": "Imagen actualizada"}
-    finally:
-        conn.close()
+def update_spot_image(id_spot: int, data: SpotImageUpdate, conn=Depends(get_conn)):
+    cur = conn.cursor()
+    cur.execute(SPOT_IMAGE_SQL, (data.image, id_spot))
+    updated = cur.fetchone()
+    if updated and updated[0] is not None:
+        invalidate_spot_caches(updated[0], updated[1], cur)
+    return {"msg": "Imagen actualizada"}
 
 # ==========================================
 # 🔔 CHALLENGE NOTIFICATIONS
 # ==========================================
 
 @app.get("/api/challenges/pending/{user_id}")
-def get_pending_challenges(user_id: int):
+def get_pending_challenges(user_id: int, conn=Depends(get_conn)):
     """Obtener todos los retos pendientes para un usuario"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT 
-                d.id_duelo,
-                d.challenger_id,
-                d.fecha_creacion,
-                u.nickname as challenger_name,
-                u.avatar as challenger_avatar
-            FROM duelos d
-            JOIN usuarios u ON d.challenger_id = u.id_usuario
-            WHERE d.opponent_id = %s 
-              AND d.estado = 'pendiente'
-            ORDER BY d.fecha_creacion DESC
-        """, (user_id,))
+        cur.execute(PENDING_CHALLENGES_SQL, (user_id,))
         
         challenges = cur.fetchall()
         print(f"🔔 Usuario {user_id} tiene {len(challenges)} retos pendientes")
@@ -902,22 +758,15 @@ def get_pending_challenges(user_id: int):
     except Exception as e:
         print(f"❌ Error obteniendo retos pendientes: {e}")
         return []
-    finally:
-        conn.close()
 
 @app.post("/api/challenges/accept")
-def accept_challenge(data: ChallengeAccept):
+def accept_challenge(data: ChallengeAccept, conn=Depends(get_conn)):
     """Aceptar un reto"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Verificar que el usuario es el oponente del duelo
-        cur.execute("""
-            SELECT challenger_id, opponent_id 
-            FROM duelos 
-            WHERE id_duelo = %s AND estado = 'pendiente'
-        """, (data.id_duelo,))
+        cur.execute(PENDING_DUEL_SQL, (data.id_duelo,))
         
         duelo = cur.fetchone()
         if not duelo:
@@ -927,11 +776,7 @@ def accept_challenge(data: ChallengeAccept):
             raise HTTPException(403, "No tienes permiso para aceptar este duelo")
         
         # Actualizar estado a 'en_curso'
-        cur.execute("""
-            UPDATE duelos 
-            SET estado = 'en_curso' 
-            WHERE id_duelo = %s
-        """, (data.id_duelo,))
+        cur.execute(SET_DUEL_STATE_SQL, ('en_curso', data.id_duelo))
         
         conn.commit()
         print(f"✅ Reto {data.id_duelo} aceptado por usuario {data.id_usuario}")
@@ -941,22 +786,15 @@ def accept_challenge(data: ChallengeAccept):
     except Exception as e:
         print(f"❌ Error aceptando reto: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 @app.post("/api/challenges/reject")
-def reject_challenge(data: ChallengeReject):
+def reject_challenge(data: ChallengeReject, conn=Depends(get_conn)):
     """Rechazar un reto"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Verificar que el usuario es el oponente del duelo
-        cur.execute("""
-            SELECT opponent_id 
-            FROM duelos 
-            WHERE id_duelo = %s AND estado = 'pendiente'
-        """, (data.id_duelo,))
+        cur.execute(PENDING_DUEL_SQL, (data.id_duelo,))
         
         duelo = cur.fetchone()
         if not duelo:
@@ -966,11 +804,7 @@ def reject_challenge(data: ChallengeReject):
             raise HTTPException(403, "No tienes permiso para rechazar este duelo")
         
         # Actualizar estado a 'rechazado'
-        cur.execute("""
-            UPDATE duelos 
-            SET estado = 'rechazado' 
-            WHERE id_duelo = %s
-        """, (data.id_duelo,))
+        cur.execute(SET_DUEL_STATE_SQL, ('rechazado', data.id_duelo))
         
         conn.commit()
         print(f"❌ Reto {data.id_duelo} rechazado por usuario {data.id_usuario}")
@@ -980,27 +814,13 @@ def reject_challenge(data: ChallengeReject):
     except Exception as e:
         print(f"❌ Error rechazando reto: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 @app.get("/api/users/{id_usuario}/stats")
-def get_user_stats(id_usuario: int):
+def get_user_stats(id_usuario: int, conn=Depends(get_conn)):
     """Obtener estadísticas de retos de un usuario"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT 
-                total_retos,
-                retos_ganados,
-                retos_perdidos,
-                CASE 
-                    WHEN total_retos > 0 THEN ROUND((retos_ganados::numeric / total_retos::numeric) * 100, 1)
-                    ELSE 0 
-                END as win_rate
-            FROM usuarios
-            WHERE id_usuario = %s
-        """, (id_usuario,))
+        cur.execute(USER_STATS_SQL, (id_usuario,))
         
         stats = cur.fetchone()
         if stats:
@@ -1021,26 +841,13 @@ def get_user_stats(id_usuario: int):
             "retos_perdidos": 0,
             "win_rate": 0
         }
-    finally:
-        conn.close()
 
 @app.get("/api/challenges/status/{id_duelo}")
-def get_challenge_status(id_duelo: int):
+def get_challenge_status(id_duelo: int, conn=Depends(get_conn)):
     """Verificar el estado de un duelo específico"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT 
-                d.id_duelo,
-                d.estado,
-                d.challenger_id,
-                d.opponent_id,
-                u.nickname as opponent_name
-            FROM duelos d
-            JOIN usuarios u ON d.opponent_id = u.id_usuario
-            WHERE d.id_duelo = %s
-        """, (id_duelo,))
+        cur.execute(CHALLENGE_STATUS_SQL, (id_duelo,))
         
         duelo = cur.fetchone()
         if duelo:
@@ -1052,8 +859,6 @@ def get_challenge_status(id_duelo: int):
     except Exception as e:
         print(f"❌ Error obteniendo estado del duelo: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 # --- MODELO PARA EL CASTIGO ---
 class DueloPenalize(BaseModel):
@@ -1063,13 +868,12 @@ class DueloPenalize(BaseModel):
 # --- FUNCION DE PENALIZACIÓN (S.K.A.T.E.) ---
 @app.post("/api/duelo/penalizar")
 @app.post("/api/duelo/penalizar/")
-def penalizar_duelo(pen: DueloPenalize):
-    conn = get_db()
+def penalizar_duelo(pen: DueloPenalize, conn=Depends(get_conn)):
     try:
         cur = conn.cursor()
         
         # 1. Buscamos cómo va el duelo
-        cur.execute("SELECT letras_actuales, challenger_id, opponent_id, ganador FROM duelos WHERE id_duelo = %s", (pen.id_duelo,))
+        cur.execute(DUEL_LETTERS_SQL, (pen.id_duelo,))
         row = cur.fetchone()
         
         if not row:
@@ -1097,7 +901,7 @@ def penalizar_duelo(pen: DueloPenalize):
             
         # 3. Guardamos
         new_state = f"{c_letters}|{o_letters}"
-        cur.execute("UPDATE duelos SET letras_actuales = %s WHERE id_duelo = %s", (new_state, pen.id_duelo))
+        cur.execute(SET_DUEL_LETTERS_SQL, (new_state, pen.id_duelo))
         
         # 4. Revisamos si alguien perdió (Game Over)
         game_over = False
@@ -1108,31 +912,16 @@ def penalizar_duelo(pen: DueloPenalize):
             winner_id = row[2] if is_challenger else row[1]
             loser_id = row[1] if is_challenger else row[2]
             
-            cur.execute("SELECT nickname FROM usuarios WHERE id_usuario = %s", (winner_id,))
+            cur.execute(NICKNAME_SQL, (winner_id,))
             w_name = cur.fetchone()[0]
             winner_msg = f"¡Ganó {w_name}!"
             
             # Actualizar duelo
-            cur.execute("""
-                UPDATE duelos 
-                SET estado = 'finalizado', ganador = %s, ganador_id = %s 
-                WHERE id_duelo = %s
-            """, (w_name, winner_id, pen.id_duelo))
+            cur.execute(FINISH_DUEL_SQL, (w_name, winner_id, pen.id_duelo))
             
             # 🏆 ACTUALIZAR ESTADÍSTICAS
-            cur.execute("""
-                UPDATE usuarios 
-                SET total_retos = total_retos + 1,
-                    retos_ganados = retos_ganados + 1
-                WHERE id_usuario = %s
-            """, (winner_id,))
-            
-            cur.execute("""
-                UPDATE usuarios 
-                SET total_retos = total_retos + 1,
-                    retos_perdidos = retos_perdidos + 1
-                WHERE id_usuario = %s
-            """, (loser_id,))
+            cur.execute(WINNER_STATS_SQL, (winner_id,))
+            cur.execute(LOSER_STATS_SQL, (loser_id,))
             
             print(f"📊 Estadísticas actualizadas: Ganador={winner_id} ({w_name}), Perdedor={loser_id}")
             print(f"🏆 Estado final: {new_state}, Game Over: {game_over}, Ganador: {winner_msg}")
@@ -1151,58 +940,35 @@ def penalizar_duelo(pen: DueloPenalize):
         import traceback
         traceback.print_exc()
         return {"letras_actuales": "", "game_over": False} 
-    finally:
-        conn.close()
 
 # ==================== ENDPOINTS DE MENSAJERÍA ====================
 
 @app.post("/api/messages/conversation")
-async def get_conversation(data: ConversacionRequest):
-    """Obtener mensajes entre dos usuarios"""
+async def get_conversation_post(data: ConversacionRequest, conn=Depends(get_async_conn)):
+    """Obtener mensajes entre dos usuarios (misma paginación que el GET)"""
+    limit, cursor_id, forward = _conversation_cursor(data.before_id, data.after_id, data.limit)
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        query = """
-            SELECT id_mensaje, id_remitente, id_destinatario, texto, fecha_envio, leido
-            FROM mensajes
-            WHERE (id_remitente = %s AND id_destinatario = %s)
-               OR (id_remitente = %s AND id_destinatario = %s)
-            ORDER BY fecha_envio ASC
-        """
-        cur.execute(query, (data.id1, data.id2, data.id2, data.id1))
-        mensajes = cur.fetchall()
-        
-        return mensajes
+        query = conversation_history_async_sql(forward, cursor_id is not None, limit)
+        primer_mensaje = await conn.fetchrow(FIRST_MESSAGE_ASYNC_SQL, data.id1, data.id2)
+        mensajes = []
+        if primer_mensaje is not None:   # sin resumen no hay mensajes
+            bounds = _history_bounds(primer_mensaje['fecha_primer_mensaje'])
+            for i, desde in enumerate(bounds):
+                args = [data.id1, data.id2, desde] + ([cursor_id] if cursor_id is not None else [])
+                mensajes = await conn.fetch(query, *args)
+                if len(mensajes) > limit or i == len(bounds) - 1:
+                    break
+                if forward and await conn.fetchval(
+                        CURSOR_IN_WINDOW_ASYNC_SQL, cursor_id, desde + MESSAGES_CLOCK_SKEW):
+                    break   # cursor reciente: todo lo posterior está en la ventana caliente
+        participantes = await conn.fetch(PARTICIPANTS_ASYNC_SQL, data.id1, data.id2)
+
+        return _conversation_page([dict(m) for m in mensajes], [dict(p) for p in participantes],
+                                  limit, forward)
     
     except Exception as e:
         print(f"❌ Error obteniendo conversación: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
-
-@app.post("/api/messages")
-async def send_message(mensaje: MensajeNuevo):
-    """Enviar un nuevo mensaje"""
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        query = """
-            INSERT INTO mensajes (id_remitente, id_destinatario, texto, fecha_envio, leido)
-            VALUES (%s, %s, %s, NOW(), FALSE)
-        """
-        cur.execute(query, (mensaje.id_remitente, mensaje.id_destinatario, mensaje.texto))
-        conn.commit()
-        
-        print(f"✅ Mensaje enviado: {mensaje.id_remitente} -> {mensaje.id_destinatario}")
-        return {"success": True}
-    
-        print(f"❌ Error enviando mensaje: {e}")
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 # ==================== ENDPOINT DE CALIFICACIÓN ====================
 
@@ -1212,249 +978,50 @@ class RatingData(BaseModel):
     estrellas: int
 
 @app.post("/api/rate/")
-async def rate_spot(rating: RatingData):
-    """Calificar un spot con estrellas (1-5) y recalcular promedio"""
+async def rate_spot(rating: RatingData, conn=Depends(get_async_conn)):
+    """Calificar un spot con estrellas (1-5). La suma y el conteo viven en `spots`
+    y se ajustan por delta: O(1) por voto, sin recorrer las calificaciones."""
+    if not 1 <= rating.estrellas <= 5:
+        raise HTTPException(status_code=400, detail="Las estrellas van de 1 a 5")
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        # Insertar o actualizar calificación del usuario
-        query = """
-            INSERT INTO calificaciones (id_spot, id_usuario, estrellas)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (id_spot, id_usuario) 
-            DO UPDATE SET estrellas = EXCLUDED.estrellas
-        """
-        cur.execute(query, (rating.id_spot, rating.id_usuario, rating.estrellas))
-        
-        # Recalcular promedio del spot
-        avg_query = """
-            UPDATE spots
-            SET promedio = (
-                SELECT AVG(estrellas)::numeric(3,2)
-                FROM calificaciones
-                WHERE id_spot = %s
-            )
-            WHERE id_spot = %s
-        """
-        cur.execute(avg_query, (rating.id_spot, rating.id_spot))
-        
-        conn.commit()
-        print(f"⭐ Spot {rating.id_spot} calificado con {rating.estrellas} estrellas por usuario {rating.id_usuario}")
-        
-        return {"success": True, "message": "Calificación guardada"}
-    
-    except Exception as e:
-        print(f"❌ Error guardando calificación: {e}")
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
-
-# ==========================================
-# 📸 SOCIAL FEED - POSTS API
-# ==========================================
+        async with conn.transaction():
+            spot = await conn.fetchrow(LOCK_SPOT_ASYNC_SQL, rating.id_spot)
+            if not spot:
+                raise HTTPException(status_code=404, detail="Spot no encontrado")
 
-@app.get("/api/posts/")
-def get_posts(offset: int = 0, limit: int = 20):
-    """Obtener posts del feed social (cronológico)"""
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT 
-                p.id_post,
-                p.id_usuario,
-                p.texto,
-                p.imagen,
-                p.tipo,
-                p.likes_count,
-                p.comments_count,
-                p.fecha_creacion,
-                u.nickname as usuario_nombre,
-                u.avatar as usuario_avatar
-            FROM posts p
-            JOIN usuarios u ON p.id_usuario = u.id_usuario
-            ORDER BY p.fecha_creacion DESC
-            LIMIT %s OFFSET %s
-        """, (limit, offset))
-        
-        posts = cur.fetchall()
-        print(f"📸 Obteniendo {len(posts)} posts (offset: {offset}, limit: {limit})")
-        return posts
-    except Exception as e:
-        print(f"❌ Error obteniendo posts: {e}")
-        return []
-    finally:
-        conn.close()
-
-@app.post("/api/posts/")
-def create_post(post: PostNuevo):
-    """Crear un nuevo post en el feed"""
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            INSERT INTO posts (id_usuario, texto, imagen, tipo)
-            VALUES (%s, %s, %s, %s)
-            RETURNING id_post, fecha_creacion
-        """, (post.id_usuario, post.texto, post.imagen, post.tipo))
-        
-        result = cur.fetchone()
-        conn.commit()
-        
-        print(f"📸 Nuevo post creado: ID={result['id_post']} por usuario {post.id_usuario}")
-        return {
-            "success": True,
-            "id_post": result['id_post'],
-            "fecha_creacion": result['fecha_creacion']
-        }
-    except Exception as e:
-        print(f"❌ Error creando post: {e}")
-        raise HTTPException(500, str(e))
-    finally:
-        conn.close()
-
-@app.post("/api/posts/{id_post}/like")
-def toggle_like(id_post: int, like: PostLike):
-    """Dar o quitar like a un post"""
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+            result = await conn.fetchrow(RATE_SPOT_ASYNC_SQL,
+                                         rating.id_spot, rating.id_usuario, rating.estrellas)
         
-        # Verificar si ya existe el like
-        cur.execute("""
-            SELECT id_like FROM post_likes 
-            WHERE id_post = %s AND id_usuario = %s
-        """, (id_post, like.id_usuario))
-        
-        existing_like = cur.fetchone()
-        
-        if existing_like:
-            # Quitar like
-            cur.execute("""
-                DELETE FROM post_likes 
-                WHERE id_post = %s AND id_usuario = %s
-            """, (id_post, like.id_usuario))
-            
-            cur.execute("""
-                UPDATE posts 
-                SET likes_count = likes_count - 1 
-                WHERE id_post = %s
-            """, (id_post,))
-            
-            action = "removido"
-        else:
-            # Agregar like
-            cur.execute("""
-                INSERT INTO post_likes (id_post, id_usuario)
-                VALUES (%s, %s)
-            """, (id_post, like.id_usuario))
-            
-            cur.execute("""
-                UPDATE posts 
-                SET likes_count = likes_count + 1 
-                WHERE id_post = %s
-            """, (id_post,))
-            
-            action = "agregado"
-        
-        conn.commit()
-        print(f"❤️ Like {action}: Post {id_post} por usuario {like.id_usuario}")
-        
-        # Obtener el nuevo conteo
-        cur.execute("SELECT likes_count FROM posts WHERE id_post = %s", (id_post,))
-        new_count = cur.fetchone()['likes_count']
-        
-        return {
-            "success": True,
-            "liked": action == "agregado",
-            "likes_count": new_count
-        }
-    except Exception as e:
-        print(f"❌ Error con like: {e}")
-        raise HTTPException(500, str(e))
-    finally:
-        conn.close()
-
-@app.post("/api/posts/{id_post}/comment")
-def add_post_comment(id_post: int, comment: PostComment):
-    """Agregar comentario a un post"""
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cur.execute("""
-            INSERT INTO post_comments (id_post, id_usuario, texto)
-            VALUES (%s, %s, %s)
-            RETURNING id_comment, fecha
-        """, (id_post, comment.id_usuario, comment.texto))
-        
-        result = cur.fetchone()
-        
-        # Incrementar contador de comentarios
-        cur.execute("""
-            UPDATE posts 
-            SET comments_count = comments_count + 1 
-            WHERE id_post = %s
-        """, (id_post,))
-        
-        conn.commit()
+        # El promedio viaja en los vector tiles del mapa
+        if spot['lat'] is not None:
+            await run_in_threadpool(invalidate_spot_caches, spot['lat'], spot['lon'])
+        print(f"⭐ Spot {rating.id_spot} calificado con {rating.estrellas} estrellas por usuario {rating.id_usuario}")
         
-        print(f"💬 Comentario agregado: Post {id_post} por usuario {comment.id_usuario}")
         return {
             "success": True,
-            "id_comment": result['id_comment'],
-            "fecha": result['fecha']
+            "message": "Calificación guardada",
+            "promedio": float(result['promedio'] or 0),
+            "total_calificaciones": result['total_calificaciones']
         }
+    
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Error agregando comentario: {e}")
-        raise HTTPException(500, str(e))
-    finally:
-        conn.close()
-
-@app.get("/api/posts/{id_post}/comments")
-def get_post_comments(id_post: int):
-    """Obtener comentarios de un post"""
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT 
-                c.id_comment,
-                c.id_usuario,
-                c.texto,
-                c.fecha,
-                u.nickname as usuario_nombre,
-                u.avatar as usuario_avatar
-            FROM post_comments c
-            JOIN usuarios u ON c.id_usuario = u.id_usuario
-            WHERE c.id_post = %s
-            ORDER BY c.fecha ASC
-        """, (id_post,))
-        
-        comments = cur.fetchall()
-        print(f"💬 Obteniendo {len(comments)} comentarios para post {id_post}")
-        return comments
-    except Exception as e:
-        print(f"❌ Error obteniendo comentarios: {e}")
-        return []
-    finally:
-        conn.close()
+        print(f"❌ Error guardando calificación: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 # ==========================================
 # === SKATE ECONOMY ===
 # ==========================================
 
 @app.post("/api/game/claim-daily")
-def claim_daily_points(claim: ClaimRequest):
+def claim_daily_points(claim: ClaimRequest, conn=Depends(get_conn)):
     """Reclamar 10 puntos diarios (una vez por día)"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Validar si el usuario existe
-        cur.execute("SELECT id_usuario, ultima_fecha_juego FROM usuarios WHERE id_usuario = %s", (claim.id_usuario,))
+        cur.execute(CLAIM_DAILY_USER_SQL, (claim.id_usuario,))
         usuario = cur.fetchone()
         
         if not usuario:
@@ -1467,13 +1034,7 @@ def claim_daily_points(claim: ClaimRequest):
         
         # Iniciar transacción para otorgar puntos
         # a) Sumar 10 puntos a puntos_actuales y puntos_historicos
-        cur.execute("""
-            UPDATE usuarios 
-            SET puntos_actuales = puntos_actuales + 10,
-                puntos_historicos = puntos_historicos + 10,
-                ultima_fecha_juego = %s
-            WHERE id_usuario = %s
-        """, (hoy, claim.id_usuario))
+        cur.execute(CLAIM_DAILY_SQL, (hoy, claim.id_usuario))
         
         # b) Insertar registro en transacciones_puntos
         cur.execute("""
@@ -1495,8 +1056,6 @@ def claim_daily_points(claim: ClaimRequest):
     except Exception as e:
         print(f"❌ Error en claim-daily: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 
@@ -1505,18 +1064,13 @@ def claim_daily_points(claim: ClaimRequest):
 # ==========================================
 
 @app.post("/api/game/start-session")
-def start_game_session(req: GameStartRequest):
+def start_game_session(req: GameStartRequest, conn=Depends(get_conn)):
     """Iniciar nueva sesión de juego (anti-cheat)"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Límite diario: 500 partidas max (AUMENTADO PARA TESTING)
-        cur.execute("""
-            SELECT COUNT(*) as count FROM game_sessions 
-            WHERE id_usuario = %s 
-            AND DATE(fecha_inicio) = CURRENT_DATE
-        """, (req.id_usuario,))
+        cur.execute(SESSIONS_TODAY_SQL, (req.id_usuario,))
         
         if cur.fetchone()['count'] >= 500:
             raise HTTPException(status_code=429, detail="Límite diario alcanzado (500 partidas)")
@@ -1542,23 +1096,16 @@ def start_game_session(req: GameStartRequest):
     except Exception as e:
         print(f"❌ Error creando sesión: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.post("/api/game/submit-score")
-def submit_game_score(req: ScoreSubmitRequest):
+def submit_game_score(req: ScoreSubmitRequest, conn=Depends(get_conn)):
     """Enviar puntaje del juego con validación anti-cheat"""
     print(f"🎮 [DEBUG] Entering submit_game_score with score: {req.score}")
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Validar sesión
-        cur.execute("""
-            SELECT id_session, id_usuario, fecha_expiracion, estado
-            FROM game_sessions
-            WHERE session_token = %s
-        """, (req.session_token,))
+        cur.execute(SESSION_BY_TOKEN_SQL, (req.session_token,))
         
         session = cur.fetchone()
         if not session:
@@ -1575,11 +1122,7 @@ def submit_game_score(req: ScoreSubmitRequest):
             raise HTTPException(status_code=400, detail="Puntaje sospechoso")
         
         # Marcar sesión como completada
-        cur.execute("""
-            UPDATE game_sessions 
-            SET score_final = %s, estado = 'completed'
-            WHERE id_session = %s
-        """, (req.score, session['id_session']))
+        cur.execute(COMPLETE_SESSION_SQL, (req.score, session['id_session']))
         
         # Otorgar puntos (1 punto por cada 1 de score, directo)
         points_earned = req.score 
@@ -1589,13 +1132,7 @@ def submit_game_score(req: ScoreSubmitRequest):
         
         # --- NUEVA LÓGICA ANTI-FARMING (Límite Diario) ---
         MAX_DIARIO = 500
-        cur.execute("""
-            SELECT COALESCE(SUM(cantidad), 0) as total
-            FROM transacciones_puntos 
-            WHERE id_usuario = %s 
-              AND tipo_transaccion = 'game_score' 
-              AND fecha_creacion::date = CURRENT_DATE
-        """, (session['id_usuario'],))
+        cur.execute(GAME_POINTS_TODAY_SQL, (session['id_usuario'],))
         row = cur.fetchone()
         puntos_hoy = row['total'] if row else 0
         
@@ -1613,7 +1150,7 @@ def submit_game_score(req: ScoreSubmitRequest):
         print(f"💰 Anti-Farming: Hoy {puntos_hoy}/{MAX_DIARIO}. Gana: {points_earned}{msg_limit}")
         # -------------------------------------------------
 
-        cur.execute("SELECT ultimo_juego_fecha, racha_actual, mejor_puntaje FROM usuarios WHERE id_usuario = %s", (session['id_usuario'],))
+        cur.execute(GAME_STREAK_SQL, (session['id_usuario'],))
         user_data = cur.fetchone()
         ultima_fecha = user_data['ultimo_juego_fecha']
         racha = user_data['racha_actual'] or 0
@@ -1637,17 +1174,7 @@ def submit_game_score(req: ScoreSubmitRequest):
         
         # Actualizar usuario
         # IMPORTANTE: mejor_puntaje se actualiza SIEMPRE si es record, aunque points_earned sea 0
-        cur.execute("""
-            UPDATE usuarios 
-            SET puntos_actuales = puntos_actuales + %s,
-                saldo_puntos = saldo_puntos + %s,  -- KEEP LEGACY IN SYNC
-                puntos_historicos = puntos_historicos + %s,
-                ultimo_juego_fecha = %s,
-                racha_actual = %s,
-                mejor_racha = GREATEST(mejor_racha, %s),
-                mejor_puntaje = GREATEST(COALESCE(mejor_puntaje, 0), %s) 
-            WHERE id_usuario = %s
-        """, (points_earned, points_earned, points_earned, hoy, racha, racha, req.score, session['id_usuario']))
+        cur.execute(AWARD_SCORE_SQL, (points_earned, points_earned, points_earned, hoy, racha, racha, req.score, session['id_usuario']))
         
         # Registrar transacción (DEFENSIVO: Si falla, no revertir los puntos)
         if points_earned > 0:
@@ -1676,26 +1203,17 @@ def submit_game_score(req: ScoreSubmitRequest):
     except Exception as e:
         print(f"❌ Error submit-score: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 # ==========================================
 # === REWARDS CATALOG & REDEMPTION ===
 # ==========================================
 
 @app.get("/api/game/rewards")
-def get_rewards():
+def get_rewards(conn=Depends(get_conn)):
     """Obtener catálogo de premios disponibles"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT id_reward, nombre, descripcion, imagen, 
-                   costo_puntos, marca, stock
-            FROM rewards
-            WHERE activo = true AND stock > 0
-            ORDER BY costo_puntos ASC
-        """)
+        cur.execute(REWARDS_CATALOG_SQL)
         
         rewards = cur.fetchall()
         print(f"🎁 Catálogo: {len(rewards)} premios disponibles")
@@ -1704,39 +1222,32 @@ def get_rewards():
     except Exception as e:
         print(f"❌ Error obteniendo rewards: {e}")
         return []
-    finally:
-        conn.close()
 
 @app.post("/api/game/claim-reward")
-def claim_reward(req: RewardClaimRequest):
+def claim_reward(req: RewardClaimRequest, conn=Depends(get_conn)):
     """Canjear puntos por premio"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Obtener costo del premio
-        cur.execute("SELECT costo_puntos, stock, nombre FROM rewards WHERE id_reward = %s", (req.id_reward,))
+        cur.execute(REWARD_SQL, (req.id_reward,))
         reward = cur.fetchone()
         
         if not reward or reward['stock'] <= 0:
             raise HTTPException(status_code=404, detail="Premio no disponible")
         
         # Verificar puntos del usuario
-        cur.execute("SELECT puntos_actuales FROM usuarios WHERE id_usuario = %s", (req.id_usuario,))
+        cur.execute(USER_POINTS_SQL, (req.id_usuario,))
         user = cur.fetchone()
         
         if user['puntos_actuales'] < reward['costo_puntos']:
             raise HTTPException(status_code=400, detail="Puntos insuficientes")
         
         # Descontar puntos
-        cur.execute("""
-            UPDATE usuarios 
-            SET puntos_actuales = puntos_actuales - %s
-            WHERE id_usuario = %s
-        """, (reward['costo_puntos'], req.id_usuario))
+        cur.execute(SPEND_POINTS_SQL, (reward['costo_puntos'], req.id_usuario))
         
         # Reducir stock
-        cur.execute("UPDATE rewards SET stock = stock - 1 WHERE id_reward = %s", (req.id_reward,))
+        cur.execute(REWARD_STOCK_SQL, (req.id_reward,))
         
         # Crear registro de canje
         codigo = secrets.token_hex(4).upper()
@@ -1768,12 +1279,9 @@ def claim_reward(req: RewardClaimRequest):
     except Exception as e:
         print(f"❌ Error canjeando premio: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.post("/api/game/start-session")
-def start_session(req: GameStartRequest):
-    conn = get_db()
+def start_session(req: GameStartRequest, conn=Depends(get_conn)):
     try:
         cur = conn.cursor()
         
@@ -1802,29 +1310,22 @@ def start_session(req: GameStartRequest):
         raise he
     except Exception as e:
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 
 
 @app.get("/api/game/rewards")
-def get_game_rewards(): # Renamed to avoid confusion with any other get_rewards
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT * FROM rewards 
-            WHERE activo = TRUE 
-            AND stock_disponible > 0
-            ORDER BY costo_puntos ASC
-        """)
-        return cur.fetchall()
-    finally:
-        conn.close()
+def get_game_rewards(conn=Depends(get_conn)): # Renamed to avoid confusion with any other get_rewards
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT * FROM rewards 
+        WHERE activo = TRUE 
+        AND stock_disponible > 0
+        ORDER BY costo_puntos ASC
+    """)
+    return cur.fetchall()
 
 @app.post("/api/game/claim-reward")
-def claim_reward(req: RewardClaimRequest):
-    conn = get_db()
+def claim_reward(req: RewardClaimRequest, conn=Depends(get_conn)):
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -1877,21 +1378,10 @@ def claim_reward(req: RewardClaimRequest):
     except Exception as e:
         conn.rollback()
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
 
 @app.get("/api/game/leaderboard")
-def get_leaderboard():
-    conn = get_db()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT id_usuario, nickname, avatar, comuna, puntos_historicos, mejor_racha, mejor_puntaje
-            FROM usuarios
-            ORDER BY mejor_puntaje DESC NULLS LAST
-            LIMIT 10
-        """)
-        return cur.fetchall()
-    finally:
-        conn.close()
+def get_leaderboard(conn=Depends(get_conn)):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(LEADERBOARD_SQL)
+    return cur.fetchall()
 
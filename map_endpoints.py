@@ -0,0 +1,369 @@
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from collections import OrderedDict
+import fcntl
+import hashlib
+import json
+import threading
+import time
+import os
+
+from database import get_conn, db_connection
+from geo import parse_bbox, lonlat_to_tile, tile_bounds, tiles_for_bbox
+
+router = APIRouter()
+
+# ==========================================
+# 🗺️ MAPA - CLUSTERS DE SPOTS
+# ==========================================
+
+MAX_CLUSTER_ZOOM = 20
+CLUSTER_GRID = 8                # celdas por lado dentro de cada tile (~32px en tiles de 256px)
+MAX_TILES_PER_REQUEST = 64
+# Cada worker tiene su propio cache: las escrituras avisan por pg_notify en
+# SPOTS_CHANNEL y cada worker (conexión LISTEN de inbox_ws) borra los tiles
+# del punto. El TTL queda de respaldo si se pierde un aviso.
+SPOTS_CHANNEL = "spots"
+CLUSTER_CACHE_TTL = float(os.environ.get('CLUSTER_CACHE_TTL', 300))
+CLUSTER_CACHE_MAX = int(os.environ.get('CLUSTER_CACHE_MAX', 5000))
+
+
+class ClusterCache:
+    """Clusters ya calculados por tile (z, x, y), con LRU + TTL."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (z, x, y) -> (creado_en, clusters)
+        self._generation = 0           # sube con cada invalidación: cálculos viejos no se guardan
+        self._lock = threading.Lock()
+
+    def generation(self):
+        """Tomarla antes de calcular y pasarla a put()."""
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, clusters, generation):
+        with self._lock:
+            if generation != self._generation:
+                return   # hubo una invalidación mientras se calculaba
+            self._entries[key] = (time.monotonic(), clusters)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_point(self, lat, lon):
+        """Borra, en todos los zooms, el tile que contiene el punto."""
+        with self._lock:
+            self._generation += 1
+            for z in range(MAX_CLUSTER_ZOOM + 1):
+                x, y = lonlat_to_tile(lon, lat, z)
+                self._entries.pop((z, x, y), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+cluster_cache = ClusterCache(CLUSTER_CACHE_TTL, CLUSTER_CACHE_MAX)
+
+
+def invalidate_spot_caches(lat, lon, cur=None):
+    """Llamar después de crear/borrar/editar un spot en (lat, lon): avisa a
+    todos los workers (y a este). Sin cur usa una conexión del pool."""
+    payload = json.dumps({"lat": lat, "lon": lon})
+    if cur is None:
+        with db_connection() as conn:
+            conn.cursor().execute("SELECT pg_notify(%s, %s)", (SPOTS_CHANNEL, payload))
+    else:
+        cur.execute("SELECT pg_notify(%s, %s)", (SPOTS_CHANNEL, payload))
+    on_spots_notify(payload)
+
+
+def on_spots_notify(payload):
+    """Aviso del canal SPOTS_CHANNEL (None = reconexión, pudo perderse algo)."""
+    if payload is None:
+        cluster_cache.clear()   # el disco lo cubre su TTL
+        return
+    point = json.loads(payload)
+    cluster_cache.invalidate_point(point["lat"], point["lon"])
+    tile_cache.invalidate_point(point["lat"], point["lon"])
+
+
+CLUSTERS_SQL = """
+    SELECT t.x, t.y,
+           COUNT(*) as count,
+           ST_Y(ST_Centroid(ST_Collect(s.coordenadas))) as lat,
+           ST_X(ST_Centroid(ST_Collect(s.coordenadas))) as lon,
+           CASE WHEN COUNT(*) = 1 THEN MIN(s.id_spot) END as id_spot
+    FROM unnest(%s::int[], %s::int[], %s::float8[], %s::float8[], %s::float8[], %s::float8[])
+         AS t(x, y, w, s, e, n)
+    JOIN spots s
+      ON s.coordenadas && ST_MakeEnvelope(t.w, t.s, t.e, t.n, 4326)
+     -- bordes semiabiertos: un spot justo en el borde cuenta en un solo tile
+     AND ST_X(s.coordenadas) >= t.w AND ST_X(s.coordenadas) < t.e
+     AND ST_Y(s.coordenadas) >= t.s AND ST_Y(s.coordenadas) < t.n
+    GROUP BY t.x, t.y,
+             ST_SnapToGrid(s.coordenadas, t.w, t.s, (t.e - t.w) / %s, (t.n - t.s) / %s)
+"""
+
+
+def compute_clusters(conn, z, tiles):
+    """Clusters de varios tiles en UNA query: grilla ST_SnapToGrid alineada a cada tile."""
+    xs, ys, ws, ss, es, ns = [], [], [], [], [], []
+    for x, y in tiles:
+        west, south, east, north = tile_bounds(z, x, y)
+        xs.append(x); ys.append(y)
+        ws.append(west); ss.append(south); es.append(east); ns.append(north)
+
+    cur = conn.cursor()
+    cur.execute(CLUSTERS_SQL, (xs, ys, ws, ss, es, ns, CLUSTER_GRID, CLUSTER_GRID))
+
+    result = {tile: [] for tile in tiles}
+    for x, y, count, lat, lon, id_spot in cur.fetchall():
+        cluster = {"count": count, "lat": lat, "lon": lon}
+        if id_spot is not None:
+            cluster["id_spot"] = id_spot
+        result[(x, y)].append(cluster)
+    return result
+
+
+@router.get("/api/spots/clusters")
+def get_spot_clusters(bbox: str, zoom: int, conn=Depends(get_conn)):
+    """Spots agrupados para vistas alejadas del mapa: [{count, lat, lon, id_spot?}]
+    (id_spot solo cuando el cluster es un spot individual)."""
+    if not 0 <= zoom <= MAX_CLUSTER_ZOOM:
+        raise HTTPException(400, f"zoom debe estar entre 0 y {MAX_CLUSTER_ZOOM}")
+    tiles = tiles_for_bbox(parse_bbox(bbox), zoom, MAX_TILES_PER_REQUEST)
+
+    clusters = []
+    missing = []
+    for x, y in tiles:
+        cached = cluster_cache.get((zoom, x, y))
+        if cached is None:
+            missing.append((x, y))
+        else:
+            clusters.extend(cached)
+
+    if missing:
+        generation = cluster_cache.generation()
+        try:
+            computed = compute_clusters(conn, zoom, missing)
+        except Exception as e:
+            print(f"❌ Error calculando clusters: {e}")
+            raise HTTPException(500, str(e))
+        for (x, y), tile_clusters in computed.items():
+            cluster_cache.put((zoom, x, y), tile_clusters, generation)
+            clusters.extend(tile_clusters)
+
+    print(f"🗺️ Clusters z{zoom}: {len(tiles)} tiles ({len(missing)} calculados), {len(clusters)} clusters")
+    return clusters
+
+
+# ==========================================
+# 🧱 MAPA - VECTOR TILES (MVT) DE SPOTS
+# ==========================================
+# Cache en disco direccionado por contenido:
+#   blobs/<sha256>.mvt  -> bytes del tile (tiles idénticos, p.ej. vacíos, comparten blob)
+#   index/<z>/<x>/<y>   -> sha256 del blob vigente para ese tile
+# Invalidar un tile = borrar su entrada del índice. El disco es compartido por
+# todos los workers del host, así que la invalidación se ve en todos (y el
+# aviso de SPOTS_CHANNEL la repite en los otros hosts).
+# Cada invalidación reemplaza además el archivo .invalidated: put() recibe la
+# marca tomada antes de renderizar y no deja la entrada si cambió entretanto.
+# Los blobs que ya no apunta ninguna entrada los borra sweep() (tarea
+# periódica): solo los que llevan más de TILE_BLOB_GRACE sin tocarse, para no
+# pisar un put() que escribió el blob y todavía no su entrada.
+
+MAX_TILE_ZOOM = 22
+TILE_CACHE_DIR = os.environ.get('TILE_CACHE_DIR', '/tmp/skate_tiles')
+# Respaldo por si una escritura en otra máquina no llegó a invalidar este disco
+TILE_CACHE_TTL = float(os.environ.get('TILE_CACHE_TTL', 3600))
+TILE_SWEEP_INTERVAL = float(os.environ.get('TILE_SWEEP_INTERVAL', 3600))
+TILE_BLOB_GRACE = float(os.environ.get('TILE_BLOB_GRACE', 600))
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+class TileDiskCache:
+    """Tiles MVT en disco: índice (z, x, y) -> digest, blobs por digest."""
+
+    def __init__(self, root, ttl):
+        self.root = root
+        self.ttl = ttl
+
+    def _index_path(self, z, x, y):
+        return os.path.join(self.root, "index", str(z), str(x), str(y))
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], digest + ".mvt")
+
+    def _stamp_path(self):
+        return os.path.join(self.root, ".invalidated")
+
+    def stamp(self):
+        """Marca de la última invalidación; tomarla antes de renderizar y pasarla a put().
+        (inodo, mtime): cada invalidación reemplaza el archivo, así cambia aunque
+        el reloj del sistema de archivos sea grueso."""
+        try:
+            st = os.stat(self._stamp_path())
+            return st.st_ino, st.st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _atomic_write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, z, x, y):
+        """(digest, bytes) del tile o None si no está o expiró."""
+        index_path = self._index_path(z, x, y)
+        try:
+            if time.time() - os.path.getmtime(index_path) > self.ttl:
+                return None
+            with open(index_path) as f:
+                digest = f.read().strip()
+            with open(self._blob_path(digest), "rb") as f:
+                return digest, f.read()
+        except OSError:
+            return None
+
+    def put(self, z, x, y, data, stamp):
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self._blob_path(digest)
+        try:
+            os.utime(blob_path)   # blob compartido: que sweep() lo vea recién usado
+        except OSError:
+            self._atomic_write(blob_path, data)
+        index_path = self._index_path(z, x, y)
+        self._atomic_write(index_path, digest.encode())
+        # Se mira después de escribir: si la invalidación vino antes, la marca ya
+        # cambió; si viene después, ella misma borra la entrada
+        if self.stamp() != stamp:
+            try:
+                os.remove(index_path)
+            except OSError:
+                pass
+        return digest
+
+    def invalidate_point(self, lat, lon):
+        self._atomic_write(self._stamp_path(), b"")   # antes de borrar: ver put()
+        for z in range(MAX_TILE_ZOOM + 1):
+            x, y = lonlat_to_tile(lon, lat, z)
+            try:
+                os.remove(self._index_path(z, x, y))
+            except OSError:
+                pass
+
+    def sweep(self, grace):
+        """Borra entradas vencidas, blobs sin referencias y .tmp abandonados.
+        Devuelve (entradas, blobs) borrados. Un solo worker a la vez (flock)."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".sweep.lock"), "a+") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return 0, 0   # otro worker está barriendo
+            now = time.time()
+            referenced, entries = set(), 0
+            for dirpath, _, files in os.walk(os.path.join(self.root, "index")):
+                for name in files:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        age = now - os.path.getmtime(path)
+                        if name.endswith(".tmp"):
+                            if age > grace:
+                                os.remove(path)
+                        elif age > self.ttl:
+                            os.remove(path)
+                            entries += 1
+                        else:
+                            with open(path) as f:
+                                referenced.add(f.read().strip())
+                    except OSError:
+                        pass   # la borró una invalidación entretanto
+            blobs = 0
+            for dirpath, _, files in os.walk(os.path.join(self.root, "blobs")):
+                for name in files:
+                    if name.endswith(".mvt") and name[:-4] in referenced:
+                        continue
+                    path = os.path.join(dirpath, name)
+                    try:
+                        if now - os.path.getmtime(path) > grace:
+                            os.remove(path)
+                            blobs += 1
+                    except OSError:
+                        pass
+            return entries, blobs
+
+
+tile_cache = TileDiskCache(TILE_CACHE_DIR, TILE_CACHE_TTL)
+
+
+def sweep_tile_cache():
+    entries, blobs = tile_cache.sweep(TILE_BLOB_GRACE)
+    if entries or blobs:
+        print(f"🧱 Cache de tiles: {entries} entradas vencidas y {blobs} blobs sin uso borrados")
+
+
+SPOTS_TILE_SQL = """
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(%s, %s, %s) as geom
+    ),
+    mvtgeom AS (
+        SELECT ST_AsMVTGeom(ST_Transform(s.coordenadas, 3857), bounds.geom) as geom,
+               s.id_spot as id,
+               s.tipo,
+               COALESCE(s.promedio, 0)::float8 as promedio
+        FROM spots s, bounds
+        WHERE s.coordenadas && ST_Transform(bounds.geom, 4326)
+    )
+    SELECT ST_AsMVT(mvtgeom.*, 'spots', 4096, 'geom', 'id') FROM mvtgeom
+"""
+
+
+def render_spots_tile(conn, z, x, y):
+    cur = conn.cursor()
+    cur.execute(SPOTS_TILE_SQL, (z, x, y))
+    data = cur.fetchone()[0]
+    return bytes(data) if data is not None else b""
+
+
+@router.get("/api/tiles/spots/{z}/{x}/{y}.mvt")
+def get_spots_tile(z: int, x: int, y: int, request: Request, conn=Depends(get_conn)):
+    """Capa de spots como Mapbox Vector Tile (atributos: id, tipo, promedio)."""
+    if not 0 <= z <= MAX_TILE_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(404, "Tile fuera de rango")
+
+    cached = tile_cache.get(z, x, y)
+    if cached:
+        digest, data = cached
+    else:
+        stamp = tile_cache.stamp()
+        try:
+            data = render_spots_tile(conn, z, x, y)
+        except Exception as e:
+            print(f"❌ Error generando tile {z}/{x}/{y}: {e}")
+            raise HTTPException(500, str(e))
+        digest = tile_cache.put(z, x, y, data, stamp)
+
+    # El digest del contenido sirve directo como ETag
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=60"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=MVT_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,139 @@
+import os
+from datetime import datetime
+
+from database import db_connection
+from inbox_ws import publish_sync
+
+# ==========================================
+# 🗄️ PARTICIONES MENSUALES DE MENSAJES
+# ==========================================
+# mensajes está particionada por mes de fecha_envio (migración 9). Este job:
+#   - crea por adelantado las particiones de los próximos MESSAGES_MONTHS_AHEAD
+#     meses (y rescata a su mes lo que haya caído en mensajes_default)
+#   - archiva los meses más viejos que MESSAGES_RETENTION_MONTHS: DETACH de la
+#     partición y la mueve al esquema `archivo`. Ahí queda fuera de todas las
+#     queries del chat; respaldarla/borrarla es una tarea de operación.
+# Corre en un solo worker a la vez (advisory lock).
+
+MESSAGES_MONTHS_AHEAD = int(os.environ.get('MESSAGES_MONTHS_AHEAD', 2))
+MESSAGES_RETENTION_MONTHS = int(os.environ.get('MESSAGES_RETENTION_MONTHS', 12))
+MESSAGES_PARTITION_INTERVAL = float(os.environ.get('MESSAGES_PARTITION_INTERVAL', 6 * 3600))
+ARCHIVE_LOCK_TIMEOUT = os.environ.get('MESSAGES_ARCHIVE_LOCK_TIMEOUT', '5s')
+
+PARTITIONS_LOCK_ID = 74102812
+
+
+def month_start(moment, offset=0):
+    """Primer día del mes de `moment` desplazado `offset` meses."""
+    index = moment.year * 12 + moment.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"mensajes_p{month:%Y%m}"
+
+
+def existing_partitions(cur):
+    """Nombres de las particiones mensuales adjuntas a mensajes."""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'public.mensajes'::regclass AND c.relname LIKE 'mensajes\\_p%'
+    """)
+    return {row[0] for row in cur.fetchall()}
+
+
+def create_partition(cur, month):
+    """Crea la partición del mes. Si ya hay filas de ese mes en mensajes_default
+    se mueven a la tabla nueva antes de adjuntarla (si no, el ATTACH falla)."""
+    name, start, end = partition_name(month), month, month_start(month, 1)
+    cur.execute("BEGIN")
+    try:
+        cur.execute(f"CREATE TABLE {name} (LIKE mensajes INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cur.execute(f"""
+            WITH movidos AS (
+                DELETE FROM mensajes_default
+                WHERE fecha_envio >= %s AND fecha_envio < %s
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM movidos
+        """, (start, end))
+        rescued = cur.rowcount
+        cur.execute(f"ALTER TABLE mensajes ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                    (start, end))
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    print(f"🗄️ Partición {name} creada" + (f" ({rescued} mensajes rescatados de default)" if rescued else ""))
+
+
+def archive_partition(cur, name):
+    """Saca la partición de mensajes. Antes descuenta sus no leídos de
+    conversaciones y contadores_no_leidos: mark_as_read ya no los va a ver."""
+    cur.execute("BEGIN")
+    try:
+        # DETACH pide lock exclusivo de mensajes: si el chat lo tiene ocupado,
+        # se reintenta en la próxima pasada en vez de dejar a todos esperando
+        cur.execute("SET LOCAL lock_timeout = %s", (ARCHIVE_LOCK_TIMEOUT,))
+        cur.execute("LOCK TABLE mensajes IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"""
+            WITH no_leidos AS (
+                SELECT id_destinatario as lector,
+                       LEAST(id_remitente, id_destinatario) as a,
+                       GREATEST(id_remitente, id_destinatario) as b,
+                       COUNT(*) as n
+                FROM {name}
+                WHERE leido = FALSE
+                GROUP BY 1, 2, 3
+            )
+            UPDATE conversaciones c
+            SET no_leidos_a = CASE WHEN c.usuario_a = nl.lector THEN GREATEST(c.no_leidos_a - nl.n, 0) ELSE c.no_leidos_a END,
+                no_leidos_b = CASE WHEN c.usuario_a = nl.lector THEN c.no_leidos_b ELSE GREATEST(c.no_leidos_b - nl.n, 0) END
+            FROM no_leidos nl
+            WHERE c.usuario_a = nl.a AND c.usuario_b = nl.b
+        """)
+        cur.execute(f"""
+            UPDATE contadores_no_leidos cn
+            SET total = GREATEST(cn.total - nl.n, 0)
+            FROM (
+                SELECT id_destinatario, COUNT(*) as n FROM {name}
+                WHERE leido = FALSE GROUP BY 1
+            ) nl
+            WHERE cn.id_usuario = nl.id_destinatario
+            RETURNING cn.id_usuario, cn.total
+        """)
+        for user_id, total in cur.fetchall():
+            publish_sync(cur, [user_id], {"type": "unread", "total": total})
+        cur.execute(f"ALTER TABLE mensajes DETACH PARTITION {name}")
+        cur.execute(f"ALTER TABLE {name} SET SCHEMA archivo")
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    print(f"📦 Partición {name} archivada en archivo.{name}")
+
+
+def maintain_message_partitions():
+    """Crea los meses que faltan y archiva los vencidos."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (PARTITIONS_LOCK_ID,))
+        if not cur.fetchone()[0]:
+            return  # otro worker está en eso
+        try:
+            now = datetime.now()
+            existing = existing_partitions(cur)
+            for offset in range(MESSAGES_MONTHS_AHEAD + 1):
+                month = month_start(now, offset)
+                if partition_name(month) not in existing:
+                    create_partition(cur, month)
+
+            # Nombres mensajes_pYYYYMM: el orden alfabético es el cronológico
+            oldest_kept = partition_name(month_start(now, -MESSAGES_RETENTION_MONTHS))
+            for name in sorted(existing):
+                if name < oldest_kept:
+                    archive_partition(cur, name)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (PARTITIONS_LOCK_ID,))
@@ -1,67 +1,486 @@
 import psycopg2
-from database import get_db
+from psycopg2 import errors as pg_errors
+from database import db_connection
+
+# ==========================================
+# 🗂️ MIGRACIONES VERSIONADAS
+# ==========================================
+# Cada migración corre UNA sola vez y queda registrada en schema_migrations.
+# Para cambiar el esquema se agrega una entrada nueva al final de MIGRATIONS
+# (nunca se edita una ya publicada). Todo el SQL debe ser idempotente
+# (IF NOT EXISTS) porque las bases existentes ya tienen parte del esquema.
+
+# Clave del advisory lock: solo un worker aplica migraciones a la vez
+MIGRATIONS_LOCK_ID = 74102811
+
+MIGRATIONS = [
+    (1, "esquema base", """
+        CREATE EXTENSION IF NOT EXISTS postgis;
+
+        CREATE TABLE IF NOT EXISTS public.usuarios (
+            id_usuario serial4 NOT NULL,
+            nickname varchar(50) NOT NULL,
+            "password" text DEFAULT '1234',
+            email varchar(100) DEFAULT 'skater@mail.com',
+            avatar text,
+            edad int4,
+            comuna varchar(100),
+            crew varchar(100),
+            stance varchar(20) DEFAULT 'Regular',
+            trayectoria varchar(50),
+            saldo_puntos int4 DEFAULT 0,
+            ubicacion_actual geometry(point, 4326),
+            es_premium bool DEFAULT false,
+            visible bool DEFAULT true,
+            ultima_conexion timestamp,
+            total_retos int4 DEFAULT 0,
+            retos_ganados int4 DEFAULT 0,
+            retos_perdidos int4 DEFAULT 0,
+            CONSTRAINT usuarios_nickname_key UNIQUE (nickname),
+            CONSTRAINT usuarios_pkey PRIMARY KEY (id_usuario)
+        );
+
+        CREATE TABLE IF NOT EXISTS public.spots (
+            id_spot serial4 NOT NULL,
+            nombre varchar(100),
+            descripcion text,
+            tipo varchar(50),
+            ubicacion varchar(100),
+            image text,
+            coordenadas geometry(point, 4326),
+            CONSTRAINT spots_pkey PRIMARY KEY (id_spot)
+        );
+
+        CREATE TABLE IF NOT EXISTS public.comentarios (
+            id_comentario serial4 NOT NULL,
+            id_spot int4,
+            id_usuario int4,
+            texto text,
+            fecha timestamp DEFAULT CURRENT_TIMESTAMP,
+            CONSTRAINT comentarios_pkey PRIMARY KEY (id_comentario)
+        );
+
+        CREATE TABLE IF NOT EXISTS public.mensajes (
+            id_mensaje serial4 NOT NULL,
+            id_remitente int4,
+            id_destinatario int4,
+            texto text,
+            leido bool DEFAULT false,
+            fecha_envio timestamp DEFAULT NOW(),
+            CONSTRAINT mensajes_pkey PRIMARY KEY (id_mensaje)
+        );
+
+        CREATE TABLE IF NOT EXISTS public.duelos (
+            id_duelo serial4 NOT NULL,
+            challenger_id int4,
+            opponent_id int4,
+            letras_actuales varchar(20) DEFAULT '|',
+            estado varchar(20) DEFAULT 'pendiente',
+            ganador varchar(100),
+            ganador_id int4,
+            fecha_creacion timestamp DEFAULT NOW(),
+            CONSTRAINT duelos_pkey PRIMARY KEY (id_duelo)
+        );
+
+        CREATE TABLE IF NOT EXISTS public.posts (
+            id_post serial4 NOT NULL,
+            id_usuario int4,
+            texto text NOT NULL,
+            imagen text,
+            tipo varchar(50) DEFAULT 'general',
+            likes_count int4 DEFAULT 0,
+            comments_count int4 DEFAULT 0,
+            fecha_creacion timestamp DEFAULT NOW(),
+            CONSTRAINT posts_pkey PRIMARY KEY (id_post)
+        );
+
+        CREATE TABLE IF NOT EXISTS public.post_likes (
+            id_like serial4 NOT NULL,
+            id_post int4,
+            id_usuario int4,
+            fecha timestamp DEFAULT NOW(),
+            CONSTRAINT post_likes_pkey PRIMARY KEY (id_like),
+            CONSTRAINT post_likes_unique UNIQUE (id_post, id_usuario)
+        );
+
+        CREATE TABLE IF NOT EXISTS public.post_comments (
+            id_comment serial4 NOT NULL,
+            id_post int4,
+            id_usuario int4,
+            texto text NOT NULL,
+            fecha timestamp DEFAULT NOW(),
+            CONSTRAINT post_comments_pkey PRIMARY KEY (id_comment)
+        );
+
+        ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS puntos_actuales int4 DEFAULT 0;
+        ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS puntos_historicos int4 DEFAULT 0;
+        ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS ultima_fecha_juego date;
+        ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS racha_actual int4 DEFAULT 0;
+        ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS mejor_racha int4 DEFAULT 0;
+        ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS ultimo_juego_fecha date;
+        ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS es_admin bool DEFAULT false;
+
+        CREATE TABLE IF NOT EXISTS public.transacciones_puntos (
+            id_transaccion serial4 NOT NULL,
+            id_usuario int4,
+            cantidad int4,
+            tipo_transaccion varchar(50),
+            descripcion text,
+            fecha_creacion timestamp DEFAULT NOW(),
+            CONSTRAINT transacciones_puntos_pkey PRIMARY KEY (id_transaccion),
+            CONSTRAINT fk_usuario FOREIGN KEY (id_usuario) REFERENCES usuarios(id_usuario)
+        );
+
+        CREATE TABLE IF NOT EXISTS public.game_sessions (
+            id_session serial4 PRIMARY KEY,
+            id_usuario int4 REFERENCES usuarios(id_usuario),
+            session_token varchar(64) UNIQUE NOT NULL,
+            fecha_inicio timestamp DEFAULT NOW(),
+            fecha_expiracion timestamp NOT NULL,
+            score_final int4,
+            estado varchar(20) DEFAULT 'active',
+            ip_address varchar(45)
+        );
+
+        CREATE TABLE IF NOT EXISTS public.rewards (
+            id_reward serial4 PRIMARY KEY,
+            nombre varchar(100) NOT NULL,
+            descripcion text,
+            imagen text,
+            costo_puntos int4 NOT NULL,
+            marca varchar(100),
+            stock int4 DEFAULT 0,
+            activo bool DEFAULT true,
+            fecha_creacion timestamp DEFAULT NOW()
+        );
+
+        CREATE TABLE IF NOT EXISTS public.user_rewards (
+            id_claim serial4 PRIMARY KEY,
+            id_usuario int4 REFERENCES usuarios(id_usuario),
+            id_reward int4 REFERENCES rewards(id_reward),
+            fecha_canje timestamp DEFAULT NOW(),
+            estado varchar(20) DEFAULT 'pendiente',
+            codigo_canje varchar(20) UNIQUE
+        );
+
+        -- Referenciadas por /api/rate/ y /api/spots pero nunca creadas por el código
+        CREATE TABLE IF NOT EXISTS public.calificaciones (
+            id_calificacion serial4 PRIMARY KEY,
+            id_spot int4,
+            id_usuario int4,
+            estrellas int4 NOT NULL,
+            fecha timestamp DEFAULT NOW(),
+            CONSTRAINT calificaciones_spot_usuario_key UNIQUE (id_spot, id_usuario)
+        );
+        ALTER TABLE spots ADD COLUMN IF NOT EXISTS promedio numeric(3,2) DEFAULT 0;
+    """),
+    (2, "columnas de economía y puntos legacy", """
+        ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS mejor_puntaje int4 DEFAULT 0;
+        ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS avatar text DEFAULT '';
+
+        -- Si puntos_actuales es 0 pero saldo_puntos (legacy) tiene valor, lo copiamos
+        UPDATE usuarios
+        SET puntos_actuales = saldo_puntos
+        WHERE puntos_actuales = 0 AND saldo_puntos > 0;
+
+        CREATE INDEX IF NOT EXISTS idx_usuarios_puntos ON usuarios(puntos_actuales DESC);
+    """),
+    (3, "premium por defecto y admins", """
+        -- Antes se hacía en cada arranque; ahora una vez + default para los nuevos
+        UPDATE usuarios SET es_premium = true WHERE es_premium IS DISTINCT FROM true;
+        ALTER TABLE usuarios ALTER COLUMN es_premium SET DEFAULT true;
+        UPDATE usuarios SET es_admin = true
+        WHERE LOWER(nickname) IN ('alvaro', 'vbvsone') AND es_admin IS DISTINCT FROM true;
+    """),
+    (4, "índices para las queries calientes", """
+        -- Chat: historial por par (ambos sentidos), bandeja y no leídos
+        CREATE INDEX IF NOT EXISTS idx_mensajes_par_fecha
+            ON mensajes (id_remitente, id_destinatario, fecha_envio);
+        CREATE INDEX IF NOT EXISTS idx_mensajes_destinatario_fecha
+            ON mensajes (id_destinatario, id_remitente, fecha_envio);
+        CREATE INDEX IF NOT EXISTS idx_mensajes_no_leidos
+            ON mensajes (id_destinatario, id_remitente) WHERE leido = FALSE;
+
+        -- Comentarios de spots y posts
+        CREATE INDEX IF NOT EXISTS idx_comentarios_spot_fecha ON comentarios (id_spot, fecha DESC);
+        CREATE INDEX IF NOT EXISTS idx_post_comments_post_fecha ON post_comments (id_post, fecha);
+
+        -- Feed cronológico
+        CREATE INDEX IF NOT EXISTS idx_posts_fecha ON posts (fecha_creacion DESC);
+
+        -- Economía: límite diario de partidas y de puntos
+        CREATE INDEX IF NOT EXISTS idx_game_sessions_usuario_fecha ON game_sessions (id_usuario, fecha_inicio);
+        CREATE INDEX IF NOT EXISTS idx_transacciones_usuario_tipo_fecha
+            ON transacciones_puntos (id_usuario, tipo_transaccion, fecha_creacion);
+
+        -- Retos pendientes
+        CREATE INDEX IF NOT EXISTS idx_duelos_pendientes
+            ON duelos (opponent_id, fecha_creacion DESC) WHERE estado = 'pendiente';
+
+        -- Espaciales: el radar filtra con ::geography, el mapa por geometry
+        CREATE INDEX IF NOT EXISTS idx_usuarios_ubicacion_geog ON usuarios USING GIST ((ubicacion_actual::geography));
+        CREATE INDEX IF NOT EXISTS idx_spots_coordenadas ON spots USING GIST (coordenadas);
+
+        -- Leaderboard ordena por mejor_puntaje; el índice viejo era sobre puntos_actuales
+        DROP INDEX IF EXISTS idx_usuarios_puntos;
+        CREATE INDEX IF NOT EXISTS idx_usuarios_mejor_puntaje ON usuarios (mejor_puntaje DESC NULLS LAST);
+    """),
+    (5, "agregados incrementales de calificaciones", """
+        ALTER TABLE spots ADD COLUMN IF NOT EXISTS suma_estrellas int8 NOT NULL DEFAULT 0;
+        ALTER TABLE spots ADD COLUMN IF NOT EXISTS total_calificaciones int4 NOT NULL DEFAULT 0;
+
+        UPDATE spots s
+        SET suma_estrellas = c.suma,
+            total_calificaciones = c.total,
+            promedio = ROUND(c.suma::numeric / c.total, 2)
+        FROM (
+            SELECT id_spot, SUM(estrellas) as suma, COUNT(*) as total
+            FROM calificaciones
+            GROUP BY id_spot
+        ) c
+        WHERE c.id_spot = s.id_spot;
+    """),
+    (6, "resumen de conversaciones para la bandeja", """
+        -- Una fila por par de usuarios (usuario_a <= usuario_b). send_message y
+        -- mark_as_read la mantienen en la misma transacción que tocan mensajes.
+        CREATE TABLE IF NOT EXISTS conversaciones (
+            usuario_a int4 NOT NULL,
+            usuario_b int4 NOT NULL,
+            id_ultimo_mensaje int4 NOT NULL,
+            ultimo_texto text,
+            fecha_ultimo_mensaje timestamp NOT NULL,
+            no_leidos_a int4 NOT NULL DEFAULT 0,   -- mensajes para usuario_a sin leer
+            no_leidos_b int4 NOT NULL DEFAULT 0,   -- mensajes para usuario_b sin leer
+            CONSTRAINT conversaciones_pkey PRIMARY KEY (usuario_a, usuario_b),
+            CONSTRAINT conversaciones_par_ordenado CHECK (usuario_a <= usuario_b)
+        );
+        CREATE INDEX IF NOT EXISTS idx_conversaciones_b ON conversaciones (usuario_b);
+
+        INSERT INTO conversaciones (usuario_a, usuario_b, id_ultimo_mensaje, ultimo_texto,
+                                    fecha_ultimo_mensaje, no_leidos_a, no_leidos_b)
+        SELECT u.a, u.b, u.id_mensaje, left(u.texto, 200), u.fecha_envio,
+               COALESCE(n.no_leidos_a, 0), COALESCE(n.no_leidos_b, 0)
+        FROM (
+            SELECT DISTINCT ON (LEAST(id_remitente, id_destinatario), GREATEST(id_remitente, id_destinatario))
+                   LEAST(id_remitente, id_destinatario) as a,
+                   GREATEST(id_remitente, id_destinatario) as b,
+                   id_mensaje, texto, fecha_envio
+            FROM mensajes
+            WHERE id_remitente IS NOT NULL AND id_destinatario IS NOT NULL AND fecha_envio IS NOT NULL
+            ORDER BY LEAST(id_remitente, id_destinatario), GREATEST(id_remitente, id_destinatario),
+                     fecha_envio DESC, id_mensaje DESC
+        ) u
+        LEFT JOIN (
+            SELECT LEAST(id_remitente, id_destinatario) as a,
+                   GREATEST(id_remitente, id_destinatario) as b,
+                   COUNT(*) FILTER (WHERE id_destinatario <= id_remitente) as no_leidos_a,
+                   COUNT(*) FILTER (WHERE id_destinatario > id_remitente) as no_leidos_b
+            FROM mensajes
+            WHERE leido = FALSE
+            GROUP BY 1, 2
+        ) n ON n.a = u.a AND n.b = u.b
+        ON CONFLICT (usuario_a, usuario_b) DO NOTHING;
+    """),
+    (7, "historial de chat paginado por id", """
+        -- Las dos direcciones del par en un mismo rango, ordenado por id_mensaje
+        CREATE INDEX IF NOT EXISTS idx_mensajes_par_id
+            ON mensajes ((LEAST(id_remitente, id_destinatario)), (GREATEST(id_remitente, id_destinatario)), id_mensaje);
+        -- Lo usaba solo el historial completo ordenado por fecha
+        DROP INDEX IF EXISTS idx_mensajes_par_fecha;
+    """),
+    (8, "contador de no leídos por usuario", """
+        -- Total para el badge; el detalle por remitente ya está en conversaciones
+        CREATE TABLE IF NOT EXISTS contadores_no_leidos (
+            id_usuario int4 NOT NULL,
+            total int4 NOT NULL DEFAULT 0,
+            CONSTRAINT contadores_no_leidos_pkey PRIMARY KEY (id_usuario)
+        );
+
+        INSERT INTO contadores_no_leidos (id_usuario, total)
+        SELECT id_usuario, SUM(no_leidos)
+        FROM (
+            SELECT usuario_a as id_usuario, no_leidos_a as no_leidos FROM conversaciones
+            UNION ALL
+            SELECT usuario_b, no_leidos_b FROM conversaciones WHERE usuario_a <> usuario_b
+        ) c
+        GROUP BY id_usuario
+        ON CONFLICT (id_usuario) DO UPDATE SET total = EXCLUDED.total;
+    """),
+    (9, "mensajes particionada por mes", """
+        -- Rango mensual por fecha_envio. La PK tiene que incluir la clave de
+        -- partición; id_mensaje sigue saliendo de la misma secuencia. Las
+        -- particiones siguientes las crea message_partitions.py.
+        DO $$
+        DECLARE
+            seq text;
+            mes timestamp;
+            ultimo timestamp;
+        BEGIN
+            IF (SELECT relkind FROM pg_class WHERE oid = 'public.mensajes'::regclass) = 'p' THEN
+                RETURN;
+            END IF;
+
+            seq := pg_get_serial_sequence('public.mensajes', 'id_mensaje');
+            ALTER TABLE mensajes RENAME TO mensajes_legacy;
+            ALTER TABLE mensajes_legacy RENAME CONSTRAINT mensajes_pkey TO mensajes_legacy_pkey;
+            ALTER TABLE mensajes_legacy ALTER COLUMN id_mensaje DROP DEFAULT;
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', seq);
+
+            EXECUTE format($t$
+                CREATE TABLE mensajes (
+                    id_mensaje int4 NOT NULL DEFAULT nextval(%L::regclass),
+                    id_remitente int4,
+                    id_destinatario int4,
+                    texto text,
+                    leido bool DEFAULT false,
+                    fecha_envio timestamp NOT NULL DEFAULT NOW(),
+                    CONSTRAINT mensajes_pkey PRIMARY KEY (id_mensaje, fecha_envio)
+                ) PARTITION BY RANGE (fecha_envio)
+            $t$, seq);
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY mensajes.id_mensaje', seq);
+
+            -- Red de seguridad si el job no alcanzó a crear el mes; el job la vacía
+            CREATE TABLE mensajes_default PARTITION OF mensajes DEFAULT;
+
+            mes := date_trunc('month', COALESCE((SELECT MIN(fecha_envio) FROM mensajes_legacy), NOW()));
+            ultimo := date_trunc('month', NOW()) + INTERVAL '2 months';
+            WHILE mes <= ultimo LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF mensajes FOR VALUES FROM (%L) TO (%L)',
+                               'mensajes_p' || to_char(mes, 'YYYYMM'), mes, mes + INTERVAL '1 month');
+                mes := mes + INTERVAL '1 month';
+            END LOOP;
+
+            -- Los pocos sin fecha quedan en 1970 (partición default)
+            INSERT INTO mensajes (id_mensaje, id_remitente, id_destinatario, texto, leido, fecha_envio)
+            SELECT id_mensaje, id_remitente, id_destinatario, texto, leido, COALESCE(fecha_envio, 'epoch')
+            FROM mensajes_legacy;
+            DROP TABLE mensajes_legacy;
+        END $$;
+
+        CREATE INDEX IF NOT EXISTS idx_mensajes_par_id
+            ON mensajes ((LEAST(id_remitente, id_destinatario)), (GREATEST(id_remitente, id_destinatario)), id_mensaje);
+        CREATE INDEX IF NOT EXISTS idx_mensajes_destinatario_fecha
+            ON mensajes (id_destinatario, id_remitente, fecha_envio);
+        CREATE INDEX IF NOT EXISTS idx_mensajes_no_leidos
+            ON mensajes (id_destinatario, id_remitente) WHERE leido = FALSE;
+
+        -- Cota inferior de fecha para el historial: poda las particiones
+        -- anteriores al primer mensaje del par
+        ALTER TABLE conversaciones ADD COLUMN IF NOT EXISTS fecha_primer_mensaje timestamp;
+        UPDATE conversaciones c
+        SET fecha_primer_mensaje = m.primero
+        FROM (
+            SELECT LEAST(id_remitente, id_destinatario) as a,
+                   GREATEST(id_remitente, id_destinatario) as b,
+                   MIN(fecha_envio) as primero
+            FROM mensajes
+            GROUP BY 1, 2
+        ) m
+        WHERE m.a = c.usuario_a AND m.b = c.usuario_b AND c.fecha_primer_mensaje IS NULL;
+
+        CREATE SCHEMA IF NOT EXISTS archivo;
+    """),
+    (10, "feed por keyset", """
+        -- El feed pagina por (fecha_creacion, id_post): sin NULLs en la clave
+        UPDATE posts SET fecha_creacion = 'epoch' WHERE fecha_creacion IS NULL;
+        ALTER TABLE posts ALTER COLUMN fecha_creacion SET NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_posts_fecha_id ON posts (fecha_creacion DESC, id_post DESC);
+        DROP INDEX IF EXISTS idx_posts_fecha;
+    """),
+    (11, "feed hot y cercano", """
+        -- Puntaje hot guardado (fórmula en feed_ranking.HOT_SCORE_SQL, 45000 = HOT_DECAY_SECONDS)
+        ALTER TABLE posts ADD COLUMN IF NOT EXISTS hot_score float8 NOT NULL DEFAULT 0;
+        UPDATE posts
+        SET hot_score = ln(GREATEST(COALESCE(likes_count, 0) + 2 * COALESCE(comments_count, 0), 1))
+                        + EXTRACT(EPOCH FROM fecha_creacion) / 45000;
+        CREATE INDEX IF NOT EXISTS idx_posts_hot ON posts (hot_score DESC, id_post DESC);
+
+        -- Feed cercano: posts recientes de cada autor encontrado por ubicación
+        CREATE INDEX IF NOT EXISTS idx_posts_usuario_fecha ON posts (id_usuario, fecha_creacion DESC);
+    """),
+    (12, "último no leído por lector en conversaciones", """
+        -- /api/messages/unread muestra la fecha del último mensaje SIN LEER de
+        -- cada remitente, no la del último mensaje del par (que puede ser propio)
+        ALTER TABLE conversaciones ADD COLUMN IF NOT EXISTS fecha_ultimo_no_leido_a timestamp;
+        ALTER TABLE conversaciones ADD COLUMN IF NOT EXISTS fecha_ultimo_no_leido_b timestamp;
+
+        UPDATE conversaciones c
+        SET fecha_ultimo_no_leido_a = nl.ultimo
+        FROM (
+            SELECT id_destinatario, id_remitente, MAX(fecha_envio) as ultimo
+            FROM mensajes WHERE leido = FALSE GROUP BY 1, 2
+        ) nl
+        WHERE c.usuario_a = nl.id_destinatario AND c.usuario_b = nl.id_remitente;
+
+        UPDATE conversaciones c
+        SET fecha_ultimo_no_leido_b = nl.ultimo
+        FROM (
+            SELECT id_destinatario, id_remitente, MAX(fecha_envio) as ultimo
+            FROM mensajes WHERE leido = FALSE GROUP BY 1, 2
+        ) nl
+        WHERE c.usuario_b = nl.id_destinatario AND c.usuario_a = nl.id_remitente
+          AND c.usuario_a <> c.usuario_b;
+    """),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cur):
+    """Versión aplicada (0 si la tabla de control aún no existe)."""
+    try:
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        return cur.fetchone()[0]
+    except pg_errors.UndefinedTable:
+        return 0
+
 
 def run_migrations():
     print("🔄 Running Auto-Migrations...")
     try:
-        conn = get_db()
-        cur = conn.cursor()
-
-        # 1. Asegurar columnas en tabla USUARIOS
-        # puntos_actuales
-        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='usuarios' AND column_name='puntos_actuales';")
-        if not cur.fetchone():
-            print("➕ Adding column 'puntos_actuales'...")
-            cur.execute("ALTER TABLE usuarios ADD COLUMN puntos_actuales INTEGER DEFAULT 0;")
-        
-        # puntos_historicos
-        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='usuarios' AND column_name='puntos_historicos';")
-        if not cur.fetchone():
-            print("➕ Adding column 'puntos_historicos'...")
-            cur.execute("ALTER TABLE usuarios ADD COLUMN puntos_historicos INTEGER DEFAULT 0;")
-
-        # mejor_puntaje
-        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='usuarios' AND column_name='mejor_puntaje';")
-        if not cur.fetchone():
-            print("➕ Adding column 'mejor_puntaje'...")
-            cur.execute("ALTER TABLE usuarios ADD COLUMN mejor_puntaje INTEGER DEFAULT 0;")
-
-        # avatar (por si acaso)
-        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='usuarios' AND column_name='avatar';")
-        if not cur.fetchone():
-            print("➕ Adding column 'avatar'...")
-            cur.execute("ALTER TABLE usuarios ADD COLUMN avatar TEXT DEFAULT '';")
-
-
-        # 2. Crear tabla de Transacciones (si no existe)
-        print("🔨 Checking table 'transacciones_puntos'...")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS transacciones_puntos (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER REFERENCES usuarios(id_usuario),
-                puntos INTEGER,
-                tipo VARCHAR(50),
-                descripcion TEXT, 
-                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-
-        # 🔄 MIGRA DATA LEGACY (CRÍTICO)
-        # Si puntos_actuales es 0 pero saldo_puntos (legacy) tiene valor, lo copiamos.
-        print("🔄 Syncing legacy points...")
-        cur.execute("""
-            UPDATE usuarios 
-            SET puntos_actuales = saldo_puntos 
-            WHERE puntos_actuales = 0 AND saldo_puntos > 0;
-        """)
-
-        # 3. Crear indices básicos (Optimización solicitada)
-        print("🚀 Optimizing indexes...")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_usuarios_puntos ON usuarios(puntos_actuales DESC);")
-
-        conn.commit()
-        conn.close()
-        print("✅ Migrations Complete!")
-        
+        with db_connection() as conn:
+            cur = conn.cursor()
+
+            # Arranque en caliente: una sola query y listo
+            if current_version(cur) >= LATEST_VERSION:
+                print(f"✅ Schema al día (v{LATEST_VERSION})")
+                return
+
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+            try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version int4 PRIMARY KEY,
+                        nombre text NOT NULL,
+                        aplicada_en timestamp DEFAULT NOW()
+                    );
+                """)
+                # Releer con el lock tomado: otro worker pudo haber migrado mientras esperábamos
+                version = current_version(cur)
+
+                for numero, nombre, sql in MIGRATIONS:
+                    if numero <= version:
+                        continue
+                    print(f"➕ Migración {numero}: {nombre}...")
+                    cur.execute("BEGIN")
+                    try:
+                        cur.execute(sql)
+                        cur.execute(
+                            "INSERT INTO schema_migrations (version, nombre) VALUES (%s, %s)",
+                            (numero, nombre),
+                        )
+                        cur.execute("COMMIT")
+                    except Exception:
+                        cur.execute("ROLLBACK")
+                        raise
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+
+        print(f"✅ Migrations Complete! (v{LATEST_VERSION})")
+
     except Exception as e:
         print(f"❌ Migration Failed: {e}")
+
+
+if __name__ == "__main__":
+    run_migrations()
@@ -1,5 +1,12 @@
-from fastapi import APIRouter, HTTPException
-from database import get_db, RealDictCursor, PostNuevo, PostLike, PostComment
+from fastapi import APIRouter, HTTPException, Depends, Response
+from datetime import datetime
+import base64
+
+from database import get_conn, RealDictCursor, PostNuevo, PostLike, PostComment
+from geo import parse_latlon
+from feed_ranking import HOT_DECAY_SECONDS
+from feed_cache import FeedPage, dump_json, feed_cache, notify_feed
+from like_counters import like_counter_buffer
 
 router = APIRouter()
 
@@ -7,53 +14,222 @@ router = APIRouter()
 # 📸 SOCIAL FEED - POSTS API
 # ==========================================
 
+# Feed por keyset (cursor opaco para la app): cualquier página cuesta lo mismo
+# que la primera y los posts nuevos no corren las páginas. Modos:
+#   recent: (fecha_creacion, id_post), índice idx_posts_fecha_id
+#   hot:    (hot_score, id_post), índice idx_posts_hot (ver feed_ranking.py)
+#   nearby: (distancia del autor, fecha_creacion, id_post) con la última
+#           ubicación conocida de cada autor (usuarios.ubicacion_actual);
+#           autores por KNN (<->) sobre idx_usuarios_ubicacion_geog y sus
+#           posts por idx_posts_usuario_fecha
+FEED_DEFAULT_LIMIT = 20
+FEED_MAX_LIMIT = 100
+NEARBY_RADIUS_M = 50000
+NEARBY_MAX_RADIUS_M = 500000
+NEARBY_WINDOW_DAYS = 30   # el feed cercano muestra solo posts recientes
+
+# Tipos de la clave de orden de cada modo, en el orden en que va en el cursor
+FEED_CURSOR_KEYS = {
+    "recent": (datetime.fromisoformat, int),
+    "hot": (float, int),
+    "nearby": (float, datetime.fromisoformat, int),
+}
+
+FEED_COLUMNS = """
+            p.id_post,
+            p.id_usuario,
+            p.texto,
+            p.imagen,
+            p.tipo,
+            p.likes_count,
+            p.comments_count,
+            p.fecha_creacion,
+            u.nickname as usuario_nombre,
+            u.avatar as usuario_avatar"""
+
+def encode_feed_cursor(mode, *key):
+    raw = "|".join([mode, *map(str, key)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_feed_cursor(cursor, mode):
+    """Clave de orden del último post de la página anterior (según el modo)."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        cursor_mode, *values = raw.split("|")
+        parsers = FEED_CURSOR_KEYS[mode]
+        if cursor_mode != mode or len(values) != len(parsers):
+            raise ValueError(raw)
+        return tuple(parse(value) for parse, value in zip(parsers, values))
+    except ValueError:
+        raise HTTPException(400, "cursor inválido")
+
+def _feed_page(posts, limit, mode, key):
+    """Recorta las limit+1 filas a la página y arma el cursor siguiente con key(último)."""
+    if len(posts) <= limit:
+        return posts, None
+    posts = posts[:limit]
+    return posts, encode_feed_cursor(mode, *key(posts[-1]))
+
+def recent_feed_sql(after, offset=0):
+    return f"""
+        SELECT {FEED_COLUMNS}
+        FROM posts p
+        JOIN usuarios u ON p.id_usuario = u.id_usuario
+        {"WHERE (p.fecha_creacion, p.id_post) < (%(fecha)s, %(id_post)s)" if after else ""}
+        ORDER BY p.fecha_creacion DESC, p.id_post DESC
+        LIMIT %(limit)s {"OFFSET %(offset)s" if offset and not after else ""}
+    """
+
+def load_feed_page(conn, after, limit, offset=0):
+    """(posts, next_cursor) de la página que sigue a `after` (o la primera)."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(recent_feed_sql(after, offset),
+                {"fecha": after and after[0], "id_post": after and after[1],
+                 "limit": limit + 1, "offset": offset})
+    return _feed_page(cur.fetchall(), limit, "recent", lambda p: (p['fecha_creacion'], p['id_post']))
+
+def hot_feed_sql(after):
+    return f"""
+        SELECT {FEED_COLUMNS},
+            p.hot_score
+        FROM posts p
+        JOIN usuarios u ON p.id_usuario = u.id_usuario
+        {"WHERE (p.hot_score, p.id_post) < (%(score)s, %(id_post)s)" if after else ""}
+        ORDER BY p.hot_score DESC, p.id_post DESC
+        LIMIT %(limit)s
+    """
+
+def load_hot_page(conn, after, limit):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(hot_feed_sql(after),
+                {"score": after and after[0], "id_post": after and after[1], "limit": limit + 1})
+    return _feed_page(cur.fetchall(), limit, "hot", lambda p: (p['hot_score'], p['id_post']))
+
+NEARBY_POINT = "ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)::geography"
+
+def nearby_feed_sql(after):
+    # El punto va en línea (no en un subselect) para que el GiST recorra los
+    # autores por distancia (KNN) y el LIMIT corte ahí, sin ordenar todo el radio.
+    # distance_m es la misma expresión <-> del ORDER BY: el cursor calza exacto.
+    distance = f"(u.ubicacion_actual::geography <-> {NEARBY_POINT})"
+    return f"""
+        SELECT {FEED_COLUMNS},
+            {distance} as distance_m
+        FROM usuarios u
+        JOIN posts p ON p.id_usuario = u.id_usuario
+        WHERE ST_DWithin(u.ubicacion_actual::geography, {NEARBY_POINT}, %(radius)s)
+          AND p.fecha_creacion >= NOW() - make_interval(days => %(days)s)
+          {f"AND {distance} >= %(dist)s AND ({distance} > %(dist)s OR (p.fecha_creacion, p.id_post) < (%(fecha)s, %(id_post)s))" if after else ""}
+        ORDER BY {distance}, p.fecha_creacion DESC, p.id_post DESC
+        LIMIT %(limit)s
+    """
+
+def load_nearby_page(conn, lat, lon, radius_m, after, limit):
+    """Posts recientes de autores dentro del radio, del autor más cercano al más
+    lejano (y por fecha dentro de cada autor), con distance_m."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(nearby_feed_sql(after),
+                {"lat": lat, "lon": lon, "radius": radius_m, "days": NEARBY_WINDOW_DAYS,
+                 "dist": after and after[0], "fecha": after and after[1], "id_post": after and after[2],
+                 "limit": limit + 1})
+    posts, next_cursor = _feed_page(cur.fetchall(), limit, "nearby",
+                                    lambda p: (p['distance_m'], p['fecha_creacion'], p['id_post']))
+    for post in posts:
+        post['distance_m'] = round(post['distance_m'], 1)
+    return posts, next_cursor
+
+VIEWER_LOCATION_SQL = """
+    SELECT ST_Y(ubicacion_actual::geometry), ST_X(ubicacion_actual::geometry)
+    FROM usuarios WHERE id_usuario = %s AND ubicacion_actual IS NOT NULL
+"""
+
+def viewer_location(conn, near, viewer_id):
+    """(lat, lon) para el feed cercano: near=lat,lon o la última ubicación del viewer."""
+    if near is not None:
+        return parse_latlon(near)
+    if viewer_id is not None:
+        cur = conn.cursor()
+        cur.execute(VIEWER_LOCATION_SQL, (viewer_id,))
+        row = cur.fetchone()
+        if row:
+            return row
+    raise HTTPException(400, "mode=nearby necesita near=lat,lon o un viewer_id con ubicación")
+
+LIKED_POST_IDS_SQL = """
+    SELECT id_post FROM post_likes
+    WHERE id_post = ANY(%s) AND id_usuario = %s
+"""
+
+def liked_post_ids(conn, viewer_id, post_ids):
+    """Cuáles de estos posts ya likeó el usuario: una sola query para toda la página."""
+    if not post_ids:
+        return set()
+    cur = conn.cursor()
+    cur.execute(LIKED_POST_IDS_SQL, (post_ids, viewer_id))
+    return {row[0] for row in cur.fetchall()}
+
 @router.get("/api/posts/")
-def get_posts(offset: int = 0, limit: int = 20):
-    """Obtener posts del feed social (cronológico)"""
-    conn = get_db()
+def get_posts(cursor: str = None, limit: int = FEED_DEFAULT_LIMIT, offset: int = None,
+              viewer_id: int = None, mode: str = "recent", near: str = None,
+              radius_m: float = NEARBY_RADIUS_M, conn=Depends(get_conn)):
+    """Obtener posts del feed social, de a `limit`.
+    - mode=recent (por defecto): cronológico
+    - mode=hot: por hot_score (likes y comentarios con decaimiento por tiempo)
+    - mode=nearby: por cercanía del autor a near=lat,lon (o a la ubicación de viewer_id),
+      dentro de radius_m, con distance_m
+    Responde {"posts": [...], "next_cursor": ...}: next_cursor es el `cursor` de
+    la página siguiente o null si no hay más (también va en el header X-Next-Cursor).
+    `offset` queda solo para clientes viejos que todavía no mandan cursor: con
+    él la respuesta sigue siendo la lista sola, como antes.
+    Las primeras páginas del cronológico salen del cache compartido (feed_cache.py),
+    que es igual para todos; con viewer_id se agrega `liked_by_me` encima."""
+    if mode not in FEED_CURSOR_KEYS:
+        raise HTTPException(400, f"mode debe ser uno de: {', '.join(FEED_CURSOR_KEYS)}")
+    if mode == "nearby" and not 0 < radius_m <= NEARBY_MAX_RADIUS_M:
+        raise HTTPException(400, f"radius_m debe estar entre 1 y {NEARBY_MAX_RADIUS_M}")
+    limit = max(1, min(limit, FEED_MAX_LIMIT))
+    legacy = offset is not None
+    offset = offset or 0
+    after = decode_feed_cursor(cursor, mode) if cursor else None
     try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT 
-                p.id_post,
-                p.id_usuario,
-                p.texto,
-                p.imagen,
-                p.tipo,
-                p.likes_count,
-                p.comments_count,
-                p.fecha_creacion,
-                u.nickname as usuario_nombre,
-                u.avatar as usuario_avatar
-            FROM posts p
-            JOIN usuarios u ON p.id_usuario = u.id_usuario
-            ORDER BY p.fecha_creacion DESC
-            LIMIT %s OFFSET %s
-        """, (limit, offset))
-        
-        posts = cur.fetchall()
-        print(f"📸 Obteniendo {len(posts)} posts (offset: {offset}, limit: {limit})")
-        return posts
+        if mode == "hot":
+            page = FeedPage(*load_hot_page(conn, after, limit))
+        elif mode == "nearby":
+            lat, lon = viewer_location(conn, near, viewer_id)
+            page = FeedPage(*load_nearby_page(conn, lat, lon, radius_m, after, limit))
+        elif not offset and feed_cache.cacheable(cursor, limit):
+            page = feed_cache.get_or_load(cursor, limit, lambda: load_feed_page(conn, after, limit))
+        else:
+            page = FeedPage(*load_feed_page(conn, after, limit, offset))
+            print(f"📸 Obteniendo {len(page.ids)} posts (cursor: {after}, offset: {offset}, limit: {limit})")
+        body = page.body
+        if viewer_id is not None:
+            body = page.body_for_viewer(liked_post_ids(conn, viewer_id, page.ids))
+        if not legacy:
+            body = b'{"posts":' + body + b',"next_cursor":' + dump_json(page.next_cursor) + b'}'
+        headers = {"X-Next-Cursor": page.next_cursor} if page.next_cursor else None
+        return Response(content=body, media_type="application/json", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error obteniendo posts: {e}")
-        return []
-    finally:
-        conn.close()
+        return [] if legacy else {"posts": [], "next_cursor": None}
 
 @router.post("/api/posts/")
-def create_post(post: PostNuevo):
+def create_post(post: PostNuevo, conn=Depends(get_conn)):
     """Crear un nuevo post en el feed"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            INSERT INTO posts (id_usuario, texto, imagen, tipo)
-            VALUES (%s, %s, %s, %s)
+        # hot_score sin engagement: solo la parte de tiempo (ln(1) = 0)
+        cur.execute(f"""
+            INSERT INTO posts (id_usuario, texto, imagen, tipo, hot_score)
+            VALUES (%s, %s, %s, %s, EXTRACT(EPOCH FROM LOCALTIMESTAMP) / {HOT_DECAY_SECONDS})
             RETURNING id_post, fecha_creacion
         """, (post.id_usuario, post.texto, post.imagen, post.tipo))
         
         result = cur.fetchone()
         conn.commit()
+        notify_feed(cur)
         
         print(f"📸 Nuevo post creado: ID={result['id_post']} por usuario {post.id_usuario}")
         return {
@@ -64,75 +240,70 @@ def create_post(post: PostNuevo):
     except Exception as e:
         print(f"❌ Error creando post: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
+
+TOGGLE_LIKE_SQL = """
+    WITH post AS (
+        SELECT likes_count FROM posts WHERE id_post = %(post)s
+    ), quitado AS (
+        DELETE FROM post_likes
+        WHERE id_post = %(post)s AND id_usuario = %(user)s
+        RETURNING 1
+    ), agregado AS (
+        INSERT INTO post_likes (id_post, id_usuario)
+        SELECT %(post)s, %(user)s
+        WHERE EXISTS (SELECT 1 FROM post) AND NOT EXISTS (SELECT 1 FROM quitado)
+        ON CONFLICT (id_post, id_usuario) DO NOTHING
+        RETURNING 1
+    )
+    SELECT
+        EXISTS (SELECT 1 FROM post) as existe,
+        EXISTS (SELECT 1 FROM agregado) as agregado,
+        EXISTS (SELECT 1 FROM quitado) as quitado,
+        (SELECT COALESCE(likes_count, 0) FROM post) as likes_count
+"""
 
 @router.post("/api/posts/{id_post}/like")
-def toggle_like(id_post: int, like: PostLike):
-    """Dar o quitar like a un post"""
-    conn = get_db()
+def toggle_like(id_post: int, like: PostLike, conn=Depends(get_conn)):
+    """Dar o quitar like a un post.
+    Una sola sentencia: si el like existe se borra, si no se inserta. El contador
+    de posts lo aplica like_counters.py en lote (y de ahí el aviso al feed)."""
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Verificar si ya existe el like
-        cur.execute("""
-            SELECT id_like FROM post_likes 
-            WHERE id_post = %s AND id_usuario = %s
-        """, (id_post, like.id_usuario))
-        
-        existing_like = cur.fetchone()
-        
-        if existing_like:
-            # Quitar like
-            cur.execute("""
-                DELETE FROM post_likes 
-                WHERE id_post = %s AND id_usuario = %s
-            """, (id_post, like.id_usuario))
-            
-            cur.execute("""
-                UPDATE posts 
-                SET likes_count = likes_count - 1 
-                WHERE id_post = %s
-            """, (id_post,))
-            
-            action = "removido"
-        else:
-            # Agregar like
-            cur.execute("""
-                INSERT INTO post_likes (id_post, id_usuario)
-                VALUES (%s, %s)
-            """, (id_post, like.id_usuario))
-            
-            cur.execute("""
-                UPDATE posts 
-                SET likes_count = likes_count + 1 
-                WHERE id_post = %s
-            """, (id_post,))
-            
-            action = "agregado"
-        
-        conn.commit()
-        print(f"❤️ Like {action}: Post {id_post} por usuario {like.id_usuario}")
-        
-        # Obtener el nuevo conteo
-        cur.execute("SELECT likes_count FROM posts WHERE id_post = %s", (id_post,))
-        new_count = cur.fetchone()['likes_count']
+        cur.execute(TOGGLE_LIKE_SQL, {"post": id_post, "user": like.id_usuario})
+        result = cur.fetchone()
+        if not result['existe']:
+            raise HTTPException(404, "Post no encontrado")
+
+        # Un toque concurrente del mismo usuario pudo ganar el INSERT: entonces no cambia nada
+        delta = int(result['agregado']) - int(result['quitado'])
+        # likes_count de la base + lo que este worker todavía no escribe. Es
+        # aproximado (no ve lo pendiente de otros workers): solo va en la
+        # respuesta; el cache del feed lo parcha el flush con el valor escrito
+        new_count = result['likes_count'] + like_counter_buffer.add(id_post, delta)
+        liked = not result['quitado']
+        print(f"❤️ Like {'agregado' if liked else 'removido'}: Post {id_post} por usuario {like.id_usuario}")
         
         return {
             "success": True,
-            "liked": action == "agregado",
+            "liked": liked,
             "likes_count": new_count
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error con like: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
+
+BUMP_COMMENTS_COUNT_SQL = """
+    UPDATE posts
+    SET comments_count = comments_count + %s
+    WHERE id_post = %s
+    RETURNING comments_count
+"""
 
 @router.post("/api/posts/{id_post}/comment")
-def add_post_comment(id_post: int, comment: PostComment):
+def add_post_comment(id_post: int, comment: PostComment, conn=Depends(get_conn)):
     """Agregar comentario a un post"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -145,13 +316,13 @@ def add_post_comment(id_post: int, comment: PostComment):
         result = cur.fetchone()
         
         # Incrementar contador de comentarios
-        cur.execute("""
-            UPDATE posts 
-            SET comments_count = comments_count + 1 
-            WHERE id_post = %s
-        """, (id_post,))
+        cur.execute(BUMP_COMMENTS_COUNT_SQL, (1, id_post))
+        updated = cur.fetchone()
         
         conn.commit()
+        if updated:
+            notify_feed(cur, {"op": "patch", "id_post": id_post,
+                              "fields": {"comments_count": updated['comments_count']}})
         
         print(f"💬 Comentario agregado: Post {id_post} por usuario {comment.id_usuario}")
         return {
@@ -162,28 +333,27 @@ def add_post_comment(id_post: int, comment: PostComment):
     except Exception as e:
         print(f"❌ Error agregando comentario: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
+
+POST_COMMENTS_SQL = """
+    SELECT
+        c.id_comment,
+        c.id_usuario,
+        c.texto,
+        c.fecha,
+        u.nickname as usuario_nombre,
+        u.avatar as usuario_avatar
+    FROM post_comments c
+    JOIN usuarios u ON c.id_usuario = u.id_usuario
+    WHERE c.id_post = %s
+    ORDER BY c.fecha ASC
+"""
 
 @router.get("/api/posts/{id_post}/comments")
-def get_post_comments(id_post: int):
+def get_post_comments(id_post: int, conn=Depends(get_conn)):
     """Obtener comentarios de un post"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT 
-                c.id_comment,
-                c.id_usuario,
-                c.texto,
-                c.fecha,
-                u.nickname as usuario_nombre,
-                u.avatar as usuario_avatar
-            FROM post_comments c
-            JOIN usuarios u ON c.id_usuario = u.id_usuario
-            WHERE c.id_post = %s
-            ORDER BY c.fecha ASC
-        """, (id_post,))
+        cur.execute(POST_COMMENTS_SQL, (id_post,))
         
         comments = cur.fetchall()
         print(f"💬 Obteniendo {len(comments)} comentarios para post {id_post}")
@@ -191,27 +361,29 @@ def get_post_comments(id_post: int):
     except Exception as e:
         print(f"❌ Error obteniendo comentarios: {e}")
         return []
-    finally:
-        conn.close()
+
+# Permisos para borrar (posts y comentarios de aquí y de main.py)
+IS_ADMIN_SQL = "SELECT es_admin FROM usuarios WHERE id_usuario = %s"
+POST_OWNER_SQL = "SELECT id_usuario FROM posts WHERE id_post = %s"
+DELETE_POST_LIKES_SQL = "DELETE FROM post_likes WHERE id_post = %s"
+DELETE_POST_COMMENTS_SQL = "DELETE FROM post_comments WHERE id_post = %s"
+DELETE_POST_SQL = "DELETE FROM posts WHERE id_post = %s"
 
 @router.delete("/api/posts/{id_post}")
-def delete_post(id_post: int, user_id: int):
+def delete_post(id_post: int, user_id: int, conn=Depends(get_conn)):
     """Eliminar un post (solo dueño o admin)"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Verificar permisos
-        cur.execute("""
-            SELECT id_usuario FROM posts WHERE id_post = %s
-        """, (id_post,))
+        cur.execute(POST_OWNER_SQL, (id_post,))
         post = cur.fetchone()
         
         if not post:
             raise HTTPException(404, "Post no encontrado")
             
         # Verificar si es admin desde la base de datos
-        cur.execute("SELECT es_admin FROM usuarios WHERE id_usuario = %s", (user_id,))
+        cur.execute(IS_ADMIN_SQL, (user_id,))
         user_result = cur.fetchone()
         
         is_admin = False
@@ -222,13 +394,14 @@ def delete_post(id_post: int, user_id: int):
             raise HTTPException(403, "No tienes permiso para eliminar este post")
             
         # Borrar likes y comentarios asociados
-        cur.execute("DELETE FROM post_likes WHERE id_post = %s", (id_post,))
-        cur.execute("DELETE FROM post_comments WHERE id_post = %s", (id_post,))
+        cur.execute(DELETE_POST_LIKES_SQL, (id_post,))
+        cur.execute(DELETE_POST_COMMENTS_SQL, (id_post,))
         
         # Borrar post
-        cur.execute("DELETE FROM posts WHERE id_post = %s", (id_post,))
+        cur.execute(DELETE_POST_SQL, (id_post,))
         
         conn.commit()
+        notify_feed(cur)
         print(f"🗑️ Post {id_post} eliminado por usuario {user_id}")
         return {"success": True, "msg": "Post eliminado"}
         
@@ -237,27 +410,25 @@ def delete_post(id_post: int, user_id: int):
     except Exception as e:
         print(f"❌ Error borrando post: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
+
+POST_COMMENT_OWNER_SQL = "SELECT id_usuario, id_post FROM post_comments WHERE id_comment = %s"
+DELETE_POST_COMMENT_SQL = "DELETE FROM post_comments WHERE id_comment = %s"
 
 @router.delete("/api/posts/comments/{id_comment}")
-def delete_post_comment(id_comment: int, user_id: int):
+def delete_post_comment(id_comment: int, user_id: int, conn=Depends(get_conn)):
     """Eliminar un comentario de post (solo dueño o admin)"""
-    conn = get_db()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Verificar permisos
-        cur.execute("""
-            SELECT id_usuario, id_post FROM post_comments WHERE id_comment = %s
-        """, (id_comment,))
+        cur.execute(POST_COMMENT_OWNER_SQL, (id_comment,))
         comment = cur.fetchone()
         
         if not comment:
             raise HTTPException(404, "Comentario no encontrado")
             
         # Verificar si es admin desde la base de datos
-        cur.execute("SELECT es_admin FROM usuarios WHERE id_usuario = %s", (user_id,))
+        cur.execute(IS_ADMIN_SQL, (user_id,))
         user_result = cur.fetchone()
         
         is_admin = False
@@ -268,16 +439,16 @@ def delete_post_comment(id_comment: int, user_id: int):
             raise HTTPException(403, "No tienes permiso para eliminar este comentario")
             
         # Borrar comentario
-        cur.execute("DELETE FROM post_comments WHERE id_comment = %s", (id_comment,))
+        cur.execute(DELETE_POST_COMMENT_SQL, (id_comment,))
         
         # Actualizar contador en post
-        cur.execute("""
-            UPDATE posts 
-            SET comments_count = comments_count - 1 
-            WHERE id_post = %s
-        """, (comment['id_post'],))
+        cur.execute(BUMP_COMMENTS_COUNT_SQL, (-1, comment['id_post']))
+        updated = cur.fetchone()
         
         conn.commit()
+        if updated:
+            notify_feed(cur, {"op": "patch", "id_post": comment['id_post'],
+                              "fields": {"comments_count": updated['comments_count']}})
         print(f"🗑️ Comentario {id_comment} eliminado por usuario {user_id}")
         return {"success": True, "msg": "Comentario eliminado"}
         
@@ -286,5 +457,3 @@ def delete_post_comment(id_comment: int, user_id: int):
     except Exception as e:
         print(f"❌ Error borrando comentario: {e}")
         raise HTTPException(500, str(e))
-    finally:
-        conn.close()
@@ -0,0 +1,288 @@
+import math
+import os
+
+import numpy as np
+
+from geo import EARTH_RADIUS_M
+
+# ==========================================
+# 🧮 MOTOR DE PROXIMIDAD VECTORIZADO (NUMPY)
+# ==========================================
+# Coordenadas de los usuarios en vivo en arreglos contiguos (ids, lat, lon,
+# last_seen, visible) más el vector unitario (x, y, z) de cada posición.
+# Las consultas por radio y k-vecinos son operaciones sobre arreglos:
+#   1. prefiltro grueso por grilla: celdas de PROXIMITY_CELL_DEG grados,
+#      filas ordenadas por celda y searchsorted por cada franja de celdas
+#   2. distancia exacta por cuerda entre vectores unitarios (sin trigonometría
+#      por fila en la consulta: el vector se calcula al escribir)
+# Ningún loop de Python por usuario. La grilla se rearma perezosamente: las
+# filas que cambiaron de celda desde la última vez se revisan aparte.
+# No es thread-safe: quien lo usa (LivePositionStore) pone el lock.
+
+VISIBLE_UNKNOWN = -1   # aún no informado: se toma de usuarios.visible
+PROXIMITY_CELL_DEG = float(os.environ.get('PROXIMITY_CELL_DEG', 0.1))   # ~11 km de lado
+GRID_REBUILD_MIN = 2048   # filas movidas de celda que se toleran antes de rearmar la grilla
+
+
+def unit_vector(lat, lon):
+    """(x, y, z) del punto sobre la esfera unitaria."""
+    p, l = math.radians(lat), math.radians(lon)
+    return math.cos(p) * math.cos(l), math.cos(p) * math.sin(l), math.sin(p)
+
+
+def chord_sq(center, xs, ys, zs):
+    """Cuadrado de la cuerda (esfera unitaria) entre center y cada punto: crece
+    con la distancia, sirve para filtrar y ordenar sin trigonometría."""
+    x0, y0, z0 = center
+    dx, dy, dz = xs - x0, ys - y0, zs - z0
+    return dx * dx + dy * dy + dz * dz
+
+
+def chord_to_m(c2):
+    """Cuerda al cuadrado -> distancia en metros sobre la esfera (la misma que da haversine)."""
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(np.sqrt(c2) / 2, 1.0))
+
+
+def radius_chord_sq(radius_m):
+    """Umbral de chord_sq para un radio en metros (None si cubre toda la esfera)."""
+    angle = radius_m / EARTH_RADIUS_M
+    if angle >= math.pi:
+        return None
+    return (2 * math.sin(angle / 2)) ** 2
+
+
+def distance_order(ids, dist):
+    """Orden por (distancia, id). argsort y solo si hay empates se desempata por id."""
+    order = np.argsort(dist)
+    ordered = dist[order]
+    if len(ordered) > 1 and (ordered[1:] == ordered[:-1]).any():
+        order = np.lexsort((ids, dist))
+    return order
+
+
+def visible_flag(visible):
+    return VISIBLE_UNKNOWN if visible is None else int(bool(visible))
+
+
+def visible_value(flag):
+    return None if flag == VISIBLE_UNKNOWN else bool(flag)
+
+
+class CellGrid:
+    """Filas agrupadas por celda (ordenadas por clave de celda) para sacar con
+    searchsorted las que caen en la caja de una consulta."""
+
+    def __init__(self, cell_deg=PROXIMITY_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.n_cols = int(math.ceil(360.0 / cell_deg))
+        self.n_rows = int(math.ceil(180.0 / cell_deg))
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int64)
+
+    def cell_keys(self, lats, lons):
+        r = np.clip(np.floor((np.asarray(lats) + 90.0) / self.cell_deg), 0, self.n_rows - 1).astype(np.int64)
+        c = np.floor((np.asarray(lons) + 180.0) / self.cell_deg).astype(np.int64) % self.n_cols
+        return r * self.n_cols + c
+
+    def cell_key(self, lat, lon):
+        r = min(max(int(math.floor((lat + 90.0) / self.cell_deg)), 0), self.n_rows - 1)
+        c = int(math.floor((lon + 180.0) / self.cell_deg)) % self.n_cols
+        return r * self.n_cols + c
+
+    def build(self, keys, rows):
+        """keys[i] = celda de rows[i] (índices en los arreglos del dueño)."""
+        order = np.argsort(keys, kind="stable")
+        self.keys, self.rows = keys[order], rows[order]
+
+    def covers_all(self, lat, radius_m):
+        return self._box(lat, radius_m) is None
+
+    def _box(self, lat, radius_m):
+        """(lat_min, lat_max, dlon) que encierra el círculo; None si es casi todo el globo."""
+        angle = radius_m / EARTH_RADIUS_M
+        dlat = math.degrees(angle)
+        lat_min, lat_max = lat - dlat, lat + dlat
+        if lat_min <= -90 or lat_max >= 90:
+            return None   # toca un polo: todas las longitudes (y casi toda la grilla)
+        ratio = math.sin(angle) / math.cos(math.radians(lat))
+        dlon = 180.0 if ratio >= 1 else math.degrees(math.asin(ratio))
+        return lat_min, lat_max, dlon
+
+    def query(self, lat, lon, radius_m):
+        """Filas cuyas celdas tocan la caja del círculo, o None si conviene recorrer todo."""
+        box = self._box(lat, radius_m)
+        if box is None:
+            return None
+        lat_min, lat_max, dlon = box
+        r0 = int(math.floor((lat_min + 90.0) / self.cell_deg))
+        r1 = int(math.floor((lat_max + 90.0) / self.cell_deg))
+        c0 = int(math.floor((lon - dlon + 180.0) / self.cell_deg))
+        c1 = int(math.floor((lon + dlon + 180.0) / self.cell_deg))
+        if c1 - c0 + 1 >= self.n_cols:
+            spans = [(0, self.n_cols - 1)]
+        elif c0 % self.n_cols <= c1 % self.n_cols:
+            spans = [(c0 % self.n_cols, c1 % self.n_cols)]
+        else:
+            # cruza el antimeridiano: dos tramos de columnas
+            spans = [(c0 % self.n_cols, self.n_cols - 1), (0, c1 % self.n_cols)]
+
+        base = np.arange(r0, r1 + 1, dtype=np.int64) * self.n_cols
+        starts = np.concatenate([base + a for a, _ in spans])
+        ends = np.concatenate([base + b + 1 for _, b in spans])
+        lo = np.searchsorted(self.keys, starts)
+        hi = np.searchsorted(self.keys, ends)
+        lengths = hi - lo
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        # Concatenar los tramos rows[lo:hi] sin loop: posición de salida + corrimiento del tramo
+        shift = np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)
+        return self.rows[np.arange(total) + shift]
+
+
+class ProximityIndex:
+    def __init__(self, capacity=1024, cell_deg=PROXIMITY_CELL_DEG):
+        self.size = 0
+        self._slot = {}   # id_usuario -> posición en los arreglos
+        self._grid = CellGrid(cell_deg)
+        self._grid_ready = False
+        self._moved_count = 0
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        old = getattr(self, "ids", None)
+        new = {
+            "ids": np.zeros(capacity, dtype=np.int64),
+            "lat": np.zeros(capacity, dtype=np.float64),
+            "lon": np.zeros(capacity, dtype=np.float64),
+            "x": np.zeros(capacity, dtype=np.float64),
+            "y": np.zeros(capacity, dtype=np.float64),
+            "z": np.zeros(capacity, dtype=np.float64),
+            "last_seen": np.zeros(capacity, dtype=np.float64),
+            "visible": np.full(capacity, VISIBLE_UNKNOWN, dtype=np.int8),
+            "cell": np.zeros(capacity, dtype=np.int64),     # celda actual de cada fila
+            "moved": np.zeros(capacity, dtype=bool),        # cambió de celda desde que se armó la grilla
+        }
+        for name, arr in new.items():
+            if old is not None:
+                arr[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, arr)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, user_id):
+        return user_id in self._slot
+
+    def upsert(self, user_id, lat, lon, last_seen, visible=None, only_if_newer=False):
+        """Posición nueva del usuario. visible=None conserva el valor anterior.
+        only_if_newer: no pisar una posición más reciente (cargas desde la base)."""
+        i = self._slot.get(user_id)
+        if i is not None and only_if_newer and self.last_seen[i] >= last_seen:
+            return visible_value(self.visible[i])
+        cell = self._grid.cell_key(lat, lon)
+        if i is None:
+            if self.size == len(self.ids):
+                self._alloc(len(self.ids) * 2)
+            i = self.size
+            self.size += 1
+            self._slot[user_id] = i
+            self.ids[i] = user_id
+            self.visible[i] = VISIBLE_UNKNOWN
+            self._mark_moved(i)
+        elif self.cell[i] != cell:
+            self._mark_moved(i)
+        self.cell[i] = cell
+        self.lat[i] = lat
+        self.lon[i] = lon
+        self.x[i], self.y[i], self.z[i] = unit_vector(lat, lon)
+        self.last_seen[i] = last_seen
+        if visible is not None:
+            self.visible[i] = visible_flag(visible)
+        return visible_value(self.visible[i])
+
+    def _mark_moved(self, i):
+        if not self.moved[i]:
+            self.moved[i] = True
+            self._moved_count += 1
+
+    def set_visible(self, user_id, visible):
+        """Devuelve (lat, lon) si el usuario está en el índice, si no None."""
+        i = self._slot.get(user_id)
+        if i is None:
+            return None
+        self.visible[i] = visible_flag(visible)
+        return float(self.lat[i]), float(self.lon[i])
+
+    def remove_older_than(self, cutoff):
+        """Compacta los arreglos sacando a quien no late desde cutoff. Devuelve los ids sacados."""
+        n = self.size
+        keep = self.last_seen[:n] >= cutoff
+        if keep.all():
+            return []
+        removed = self.ids[:n][~keep].tolist()
+        for arr in (self.ids, self.lat, self.lon, self.x, self.y, self.z,
+                    self.last_seen, self.visible, self.cell):
+            kept = arr[:n][keep]
+            arr[:len(kept)] = kept
+        self.size = int(keep.sum())
+        self._slot = dict(zip(self.ids[:self.size].tolist(), range(self.size)))
+        self._grid_ready = False   # las filas cambiaron de posición
+        return removed
+
+    def _rebuild_grid(self):
+        n = self.size
+        self._grid.build(self.cell[:n].copy(), np.arange(n, dtype=np.int64))
+        self.moved[:n] = False
+        self._moved_count = 0
+        self._grid_ready = True
+
+    def _candidates(self, lat, lon, radius_m, cutoff, exclude_id):
+        """Índices que pasan el prefiltro por grilla (y los filtros de actividad)."""
+        n = self.size
+        idx = None
+        if radius_m is not None and not self._grid.covers_all(lat, radius_m):
+            if not self._grid_ready or self._moved_count > max(GRID_REBUILD_MIN, n // 8):
+                self._rebuild_grid()
+            idx = self._grid.query(lat, lon, radius_m)
+            if self._moved_count:
+                # Las que cambiaron de celda están en la grilla con su celda vieja: se revisan aparte
+                idx = np.concatenate([idx[~self.moved[idx]], np.flatnonzero(self.moved[:n])])
+        if idx is None:
+            idx = np.arange(n)
+        mask = self.last_seen[idx] >= cutoff
+        if exclude_id is not None:
+            mask &= self.ids[idx] != exclude_id
+        return idx[mask]
+
+    def _chord_sq(self, lat, lon, idx):
+        return chord_sq(unit_vector(lat, lon), self.x[idx], self.y[idx], self.z[idx])
+
+    def within(self, lat, lon, radius_m, cutoff=0.0, exclude_id=None):
+        """(ids, lats, lons, visible, dist) dentro del radio, ordenados por (dist, id)."""
+        idx = self._candidates(lat, lon, radius_m, cutoff, exclude_id)
+        c2 = self._chord_sq(lat, lon, idx)
+        limit = radius_chord_sq(radius_m)
+        if limit is not None:
+            inside = c2 <= limit
+            idx, c2 = idx[inside], c2[inside]
+        dist = chord_to_m(c2)
+        order = distance_order(self.ids[idx], dist)
+        idx, dist = idx[order], dist[order]
+        return self.ids[idx], self.lat[idx], self.lon[idx], self.visible[idx], dist
+
+    def nearest(self, lat, lon, k, cutoff=0.0, exclude_id=None, radius_m=None):
+        """Los k más cercanos (opcionalmente dentro de radius_m), mismo formato que within."""
+        idx = self._candidates(lat, lon, radius_m, cutoff, exclude_id)
+        c2 = self._chord_sq(lat, lon, idx)
+        limit = None if radius_m is None else radius_chord_sq(radius_m)
+        if limit is not None:
+            inside = c2 <= limit
+            idx, c2 = idx[inside], c2[inside]
+        if k < len(idx):
+            top = np.argpartition(c2, k - 1)[:k]
+            idx, c2 = idx[top], c2[top]
+        dist = chord_to_m(c2)
+        order = distance_order(self.ids[idx], dist)
+        idx, dist = idx[order], dist[order]
+        return self.ids[idx], self.lat[idx], self.lon[idx], self.visible[idx], dist
@@ -0,0 +1,490 @@
+import os
+
+# ==========================================
+# 🗃️ SQL DE LOS ENDPOINTS DE main.py Y DEL RADAR
+# ==========================================
+# Solo constantes y armadores de queries, sin efectos al importar: main.py y
+# live_positions.py las usan, y check_query_plans.py las revisa sin levantar
+# la app (rutas, tareas, la tabla compartida del radar).
+
+# --- 👤 USUARIOS Y RADAR ---
+
+DEBUG_ADMINS_SQL = "SELECT id_usuario, nickname, es_admin FROM usuarios WHERE es_admin = true OR LOWER(nickname) IN ('alvaro', 'vbvsone')"
+
+SET_VISIBLE_SQL = "UPDATE usuarios SET visible = %s WHERE id_usuario = %s"
+
+PROFILES_SQL = """
+    SELECT id_usuario, nickname, avatar, crew, stance, visible
+    FROM usuarios WHERE id_usuario = ANY(%s)
+"""
+
+# ultima_conexion se guarda con NOW() de la sesión: la edad se calcula en la base
+WARM_LIVE_SQL = """
+    SELECT id_usuario,
+           ST_Y(ubicacion_actual::geometry), ST_X(ubicacion_actual::geometry),
+           visible,
+           EXTRACT(EPOCH FROM (NOW()::timestamp - ultima_conexion))
+    FROM usuarios
+    WHERE ubicacion_actual IS NOT NULL
+      AND ultima_conexion >= NOW() - make_interval(secs => %s)
+"""
+
+# --- 💬 MENSAJERÍA ---
+
+# Largo del texto guardado como vista previa en `conversaciones`
+MESSAGE_PREVIEW_CHARS = 200
+
+# Resumen del par para la bandeja: último mensaje + no leídos del destinatario
+# y la fecha de su último no leído. Si otro envío del mismo par terminó antes
+# con un id mayor, se respeta ese.
+# ($1 remitente, $2 destinatario, $3 id_mensaje, $4 texto, $5 fecha_envio, $6 largo de la vista previa)
+CONVERSATION_SUMMARY_UPSERT_SQL = """
+    INSERT INTO conversaciones (usuario_a, usuario_b, id_ultimo_mensaje, ultimo_texto,
+                                fecha_ultimo_mensaje, no_leidos_a, no_leidos_b, fecha_primer_mensaje,
+                                fecha_ultimo_no_leido_a, fecha_ultimo_no_leido_b)
+    VALUES (LEAST($1::int4, $2::int4), GREATEST($1::int4, $2::int4), $3, left($4, $6), $5,
+            ($2 <= $1)::int, ($2 > $1)::int, $5,
+            CASE WHEN $2 <= $1 THEN $5::timestamp END, CASE WHEN $2 > $1 THEN $5::timestamp END)
+    ON CONFLICT (usuario_a, usuario_b) DO UPDATE SET
+        fecha_ultimo_no_leido_a = GREATEST(conversaciones.fecha_ultimo_no_leido_a, EXCLUDED.fecha_ultimo_no_leido_a),
+        fecha_ultimo_no_leido_b = GREATEST(conversaciones.fecha_ultimo_no_leido_b, EXCLUDED.fecha_ultimo_no_leido_b),
+        fecha_primer_mensaje = LEAST(conversaciones.fecha_primer_mensaje, EXCLUDED.fecha_primer_mensaje),
+        id_ultimo_mensaje = GREATEST(conversaciones.id_ultimo_mensaje, EXCLUDED.id_ultimo_mensaje),
+        ultimo_texto = CASE WHEN EXCLUDED.id_ultimo_mensaje > conversaciones.id_ultimo_mensaje
+                            THEN EXCLUDED.ultimo_texto ELSE conversaciones.ultimo_texto END,
+        fecha_ultimo_mensaje = CASE WHEN EXCLUDED.id_ultimo_mensaje > conversaciones.id_ultimo_mensaje
+                                    THEN EXCLUDED.fecha_ultimo_mensaje ELSE conversaciones.fecha_ultimo_mensaje END,
+        no_leidos_a = conversaciones.no_leidos_a + EXCLUDED.no_leidos_a,
+        no_leidos_b = conversaciones.no_leidos_b + EXCLUDED.no_leidos_b
+    RETURNING usuario_a, no_leidos_a, no_leidos_b
+"""
+
+UNREAD_INCREMENT_SQL = """
+    INSERT INTO contadores_no_leidos (id_usuario, total) VALUES ($1, 1)
+    ON CONFLICT (id_usuario) DO UPDATE SET total = contadores_no_leidos.total + 1
+    RETURNING total
+"""
+
+# mensajes está particionada por mes: el historial se pide primero solo a las
+# particiones de los últimos MESSAGES_HOT_DAYS días y, si la página no se llena,
+# desde el primer mensaje del par (conversaciones.fecha_primer_mensaje)
+MESSAGES_HOT_DAYS = int(os.environ.get('MESSAGES_HOT_DAYS', 31))
+
+def conversation_history_sql(forward, with_cursor):
+    """Página del historial en orden del índice (DESC hacia atrás, ASC hacia adelante)."""
+    cursor_sql = ""
+    if with_cursor:
+        cursor_sql = "AND m.id_mensaje > %(cursor)s" if forward else "AND m.id_mensaje < %(cursor)s"
+    return f"""
+        SELECT 
+            m.id_mensaje,
+            m.id_remitente,
+            m.id_destinatario,
+            m.texto,
+            m.leido,
+            to_char(m.fecha_envio AT TIME ZONE 'UTC' AT TIME ZONE 'America/Santiago', 'YYYY-MM-DD\"T\"HH24:MI:SS\"−03:00\"') as fecha_envio
+        FROM mensajes m
+        WHERE LEAST(m.id_remitente, m.id_destinatario) = LEAST(%(u1)s, %(u2)s)
+          AND GREATEST(m.id_remitente, m.id_destinatario) = GREATEST(%(u1)s, %(u2)s)
+          AND m.fecha_envio >= %(desde)s
+          {cursor_sql}
+        ORDER BY m.id_mensaje {"ASC" if forward else "DESC"}
+        LIMIT %(limit)s
+    """
+
+FIRST_MESSAGE_SQL = """
+    SELECT fecha_primer_mensaje FROM conversaciones
+    WHERE usuario_a = LEAST(%(u1)s, %(u2)s) AND usuario_b = GREATEST(%(u1)s, %(u2)s)
+"""
+
+CURSOR_IN_WINDOW_SQL = "SELECT 1 FROM mensajes WHERE id_mensaje = %s AND fecha_envio >= %s"
+
+PARTICIPANTS_SQL = "SELECT id_usuario, nickname, avatar FROM usuarios WHERE id_usuario IN (%s, %s)"
+
+def conversation_history_async_sql(forward, with_cursor, limit):
+    """Lo mismo que conversation_history_sql para asyncpg ($1, $2 el par, $3 desde, $4 cursor)."""
+    cursor_sql = ""
+    if with_cursor:
+        cursor_sql = "AND id_mensaje > $4" if forward else "AND id_mensaje < $4"
+    return f"""
+        SELECT id_mensaje, id_remitente, id_destinatario, texto, fecha_envio, leido
+        FROM mensajes
+        WHERE LEAST(id_remitente, id_destinatario) = LEAST($1::int4, $2::int4)
+          AND GREATEST(id_remitente, id_destinatario) = GREATEST($1::int4, $2::int4)
+          AND fecha_envio >= $3
+          {cursor_sql}
+        ORDER BY id_mensaje {"ASC" if forward else "DESC"}
+        LIMIT {limit + 1}
+    """
+
+FIRST_MESSAGE_ASYNC_SQL = """
+    SELECT fecha_primer_mensaje FROM conversaciones
+    WHERE usuario_a = LEAST($1::int4, $2::int4) AND usuario_b = GREATEST($1::int4, $2::int4)
+"""
+
+CURSOR_IN_WINDOW_ASYNC_SQL = "SELECT 1 FROM mensajes WHERE id_mensaje = $1 AND fecha_envio >= $2"
+
+PARTICIPANTS_ASYNC_SQL = "SELECT id_usuario, nickname, avatar FROM usuarios WHERE id_usuario IN ($1, $2)"
+
+# ultimo_mensaje = fecha del último mensaje sin leer de ese remitente (filas
+# anteriores a la migración 12 sin ese dato caen al último mensaje del par)
+UNREAD_BY_SENDER_SQL = """
+    SELECT 
+        c.id_remitente,
+        u.nickname,
+        u.avatar,
+        c.cantidad,
+        c.ultimo_mensaje
+    FROM (
+        SELECT usuario_b as id_remitente, no_leidos_a as cantidad,
+               COALESCE(fecha_ultimo_no_leido_a, fecha_ultimo_mensaje) as ultimo_mensaje
+        FROM conversaciones WHERE usuario_a = %s AND no_leidos_a > 0
+        UNION ALL
+        SELECT usuario_a, no_leidos_b, COALESCE(fecha_ultimo_no_leido_b, fecha_ultimo_mensaje)
+        FROM conversaciones WHERE usuario_b = %s AND no_leidos_b > 0 AND usuario_a <> usuario_b
+    ) c
+    JOIN usuarios u ON c.id_remitente = u.id_usuario
+    ORDER BY c.ultimo_mensaje DESC
+"""
+
+# Primero el lock del resumen: un send_message concurrente del mismo par
+# espera y su +1 queda después de este descuento
+MARK_READ_LOCK_SQL = """
+    SELECT fecha_primer_mensaje FROM conversaciones
+    WHERE usuario_a = LEAST(%(lector)s, %(remitente)s) AND usuario_b = GREATEST(%(lector)s, %(remitente)s)
+    FOR UPDATE
+"""
+
+# Solo las particiones desde el primer mensaje del par
+MARK_READ_SQL = """
+    UPDATE mensajes 
+    SET leido = TRUE
+    WHERE id_destinatario = %(lector)s 
+      AND id_remitente = %(remitente)s
+      AND leido = FALSE
+      AND fecha_envio >= %(desde)s
+"""
+
+# Se leyó todo lo de ese remitente: también se borra la fecha del último no leído
+MARK_READ_SUMMARY_SQL = """
+    UPDATE conversaciones
+    SET no_leidos_a = CASE WHEN usuario_a = %(lector)s THEN GREATEST(no_leidos_a - %(n)s, 0) ELSE no_leidos_a END,
+        no_leidos_b = CASE WHEN usuario_a = %(lector)s THEN no_leidos_b ELSE GREATEST(no_leidos_b - %(n)s, 0) END,
+        fecha_ultimo_no_leido_a = CASE WHEN usuario_a = %(lector)s THEN NULL ELSE fecha_ultimo_no_leido_a END,
+        fecha_ultimo_no_leido_b = CASE WHEN usuario_a = %(lector)s THEN fecha_ultimo_no_leido_b ELSE NULL END
+    WHERE usuario_a = LEAST(%(lector)s, %(remitente)s) AND usuario_b = GREATEST(%(lector)s, %(remitente)s)
+"""
+
+UNREAD_DECREMENT_SQL = """
+    UPDATE contadores_no_leidos SET total = GREATEST(total - %s, 0)
+    WHERE id_usuario = %s
+    RETURNING total
+"""
+
+# El usuario puede estar en cualquiera de los dos lados del par: dos rangos por índice
+USER_CONVERSATIONS_SQL = """
+    SELECT 
+        c.otro_usuario_id,
+        u.nickname,
+        u.avatar,
+        c.ultimo_texto as ultimo_mensaje,
+        to_char(c.fecha_ultimo_mensaje AT TIME ZONE 'UTC' AT TIME ZONE 'America/Santiago', 'YYYY-MM-DD\"T\"HH24:MI:SS\"−03:00\"') as fecha_ultimo_mensaje,
+        c.mensajes_no_leidos
+    FROM (
+        SELECT usuario_b as otro_usuario_id, ultimo_texto, fecha_ultimo_mensaje, no_leidos_a as mensajes_no_leidos
+        FROM conversaciones WHERE usuario_a = %s
+        UNION ALL
+        SELECT usuario_a, ultimo_texto, fecha_ultimo_mensaje, no_leidos_b
+        FROM conversaciones WHERE usuario_b = %s AND usuario_a <> usuario_b
+    ) c
+    JOIN usuarios u ON c.otro_usuario_id = u.id_usuario
+    ORDER BY c.fecha_ultimo_mensaje DESC
+"""
+
+# --- 🔐 LOGIN Y PERFIL ---
+
+LOGIN_SQL = "SELECT * FROM usuarios WHERE nickname = %s AND password = %s"
+
+UPDATE_PROFILE_SQL = """
+    UPDATE usuarios 
+    SET avatar=%s, edad=%s, comuna=%s, crew=%s, stance=%s, trayectoria=%s
+    WHERE id_usuario=%s
+"""
+
+USERS_LIST_SQL = "SELECT id_usuario, nickname, avatar, saldo_puntos FROM usuarios WHERE id_usuario != %s"
+
+# --- 🛹 SPOTS Y COMENTARIOS ---
+
+# Comentarios embebidos por spot en /api/spots; el hilo completo va paginado aparte
+SPOT_COMMENTS_PREVIEW = 3
+
+DEFAULT_COMMENT_AVATAR = "https://images.unsplash.com/photo-1544005313-94ddf0286df2"
+
+def spots_sql(bbox=False, near=False):
+    """Query de /api/spots. Parámetros en orden: [lon, lat si near], avatar por defecto,
+    comentarios embebidos, [bbox], [lon, lat si near], [limit si bbox o near].
+    Una sola query: promedio guardado (lo mantiene /api/rate/) + los últimos
+    comentarios de cada spot armados en Postgres (json_agg sobre un LATERAL
+    con LIMIT), sin N+1. El LATERAL se evalúa solo para los spots filtrados."""
+    distance_sql = "NULL"
+    order_sql = "s.id_spot DESC"
+    if near:
+        distance_sql = "ST_Distance(s.coordenadas::geography, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography)"
+        order_sql = "s.coordenadas <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)"
+    return f"""
+        SELECT 
+            s.id_spot, 
+            s.nombre, 
+            s.descripcion, 
+            s.tipo,
+            s.ubicacion,
+            s.image,
+            ST_X(s.coordenadas::geometry), 
+            ST_Y(s.coordenadas::geometry),
+            COALESCE(s.promedio, 0) as promedio,
+            COALESCE(cm.comments, '[]'::json) as comments,
+            {distance_sql} as distance_m
+        FROM spots s
+        LEFT JOIN LATERAL (
+            SELECT json_agg(json_build_object(
+                       'texto', c.texto,
+                       'user', u.nickname,
+                       'avatar', COALESCE(NULLIF(u.avatar, ''), %s),
+                       'id', c.id_comentario  -- ID de comentario para borrar
+                   ) ORDER BY c.fecha DESC) as comments
+            FROM (
+                SELECT id_comentario, id_usuario, texto, fecha
+                FROM comentarios
+                WHERE id_spot = s.id_spot
+                ORDER BY fecha DESC
+                LIMIT %s
+            ) c
+            JOIN usuarios u ON c.id_usuario = u.id_usuario
+        ) cm ON true
+        {"WHERE s.coordenadas && ST_MakeEnvelope(%s, %s, %s, %s, 4326)" if bbox else ""}
+        ORDER BY {order_sql}
+        {"LIMIT %s" if bbox or near else ""}
+    """
+
+# Clave de orden del cursor, solo si el comentario es de este spot
+SPOT_COMMENT_CURSOR_SQL = "SELECT fecha, id_comentario FROM comentarios WHERE id_comentario = %s AND id_spot = %s"
+
+def spot_comments_sql(with_cursor):
+    """Página del hilo: avatar por defecto, id_spot, [fecha e id del cursor], limit."""
+    return f"""
+        SELECT c.texto, u.nickname as user, 
+               COALESCE(NULLIF(u.avatar, ''), %s) as avatar,
+               c.id_comentario as id
+        FROM comentarios c
+        JOIN usuarios u ON c.id_usuario = u.id_usuario
+        WHERE c.id_spot = %s
+          {"AND (c.fecha, c.id_comentario) < (%s, %s)" if with_cursor else ""}
+        ORDER BY c.fecha DESC, c.id_comentario DESC
+        LIMIT %s
+    """
+
+DELETE_SPOT_COMMENTS_SQL = "DELETE FROM comentarios WHERE id_spot = %s"
+
+DELETE_SPOT_SQL = """
+    DELETE FROM spots WHERE id_spot = %s
+    RETURNING ST_Y(coordenadas) as lat, ST_X(coordenadas) as lon
+"""
+
+COMMENT_OWNER_SQL = "SELECT id_usuario FROM comentarios WHERE id_comentario = %s"
+
+DELETE_COMMENT_SQL = "DELETE FROM comentarios WHERE id_comentario = %s"
+
+SPOT_IMAGE_SQL = """
+    UPDATE spots SET image = %s WHERE id_spot = %s
+    RETURNING ST_Y(coordenadas), ST_X(coordenadas)
+"""
+
+# Lock de la fila del spot: serializa votos simultáneos sobre el mismo spot
+# para que el delta se calcule contra el voto previo ya confirmado
+LOCK_SPOT_ASYNC_SQL = """
+    SELECT ST_Y(coordenadas) as lat, ST_X(coordenadas) as lon
+    FROM spots WHERE id_spot = $1 FOR UPDATE
+"""
+
+# Upsert del voto + ajuste incremental de suma/conteo/promedio en un solo statement
+# ($1 spot, $2 usuario, $3 estrellas)
+RATE_SPOT_ASYNC_SQL = """
+    WITH previo AS (
+        SELECT estrellas FROM calificaciones
+        WHERE id_spot = $1 AND id_usuario = $2
+    ),
+    voto AS (
+        INSERT INTO calificaciones (id_spot, id_usuario, estrellas)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (id_spot, id_usuario) 
+        DO UPDATE SET estrellas = EXCLUDED.estrellas
+    ),
+    delta AS (
+        SELECT $3 - COALESCE((SELECT estrellas FROM previo), 0) as suma,
+               CASE WHEN EXISTS (SELECT 1 FROM previo) THEN 0 ELSE 1 END as total
+    )
+    UPDATE spots s
+    SET suma_estrellas = s.suma_estrellas + d.suma,
+        total_calificaciones = s.total_calificaciones + d.total,
+        promedio = ROUND((s.suma_estrellas + d.suma)::numeric
+                         / NULLIF(s.total_calificaciones + d.total, 0), 2)
+    FROM delta d
+    WHERE s.id_spot = $1
+    RETURNING s.promedio, s.total_calificaciones
+"""
+
+# --- ⚔️ RETOS S.K.A.T.E ---
+
+PENDING_CHALLENGES_SQL = """
+    SELECT 
+        d.id_duelo,
+        d.challenger_id,
+        d.fecha_creacion,
+        u.nickname as challenger_name,
+        u.avatar as challenger_avatar
+    FROM duelos d
+    JOIN usuarios u ON d.challenger_id = u.id_usuario
+    WHERE d.opponent_id = %s 
+      AND d.estado = 'pendiente'
+    ORDER BY d.fecha_creacion DESC
+"""
+
+# Aceptar y rechazar: el duelo tiene que seguir pendiente
+PENDING_DUEL_SQL = """
+    SELECT challenger_id, opponent_id 
+    FROM duelos 
+    WHERE id_duelo = %s AND estado = 'pendiente'
+"""
+
+SET_DUEL_STATE_SQL = "UPDATE duelos SET estado = %s WHERE id_duelo = %s"
+
+USER_STATS_SQL = """
+    SELECT 
+        total_retos,
+        retos_ganados,
+        retos_perdidos,
+        CASE 
+            WHEN total_retos > 0 THEN ROUND((retos_ganados::numeric / total_retos::numeric) * 100, 1)
+            ELSE 0 
+        END as win_rate
+    FROM usuarios
+    WHERE id_usuario = %s
+"""
+
+CHALLENGE_STATUS_SQL = """
+    SELECT 
+        d.id_duelo,
+        d.estado,
+        d.challenger_id,
+        d.opponent_id,
+        u.nickname as opponent_name
+    FROM duelos d
+    JOIN usuarios u ON d.opponent_id = u.id_usuario
+    WHERE d.id_duelo = %s
+"""
+
+DUEL_LETTERS_SQL = "SELECT letras_actuales, challenger_id, opponent_id, ganador FROM duelos WHERE id_duelo = %s"
+
+SET_DUEL_LETTERS_SQL = "UPDATE duelos SET letras_actuales = %s WHERE id_duelo = %s"
+
+NICKNAME_SQL = "SELECT nickname FROM usuarios WHERE id_usuario = %s"
+
+FINISH_DUEL_SQL = """
+    UPDATE duelos 
+    SET estado = 'finalizado', ganador = %s, ganador_id = %s 
+    WHERE id_duelo = %s
+"""
+
+WINNER_STATS_SQL = """
+    UPDATE usuarios 
+    SET total_retos = total_retos + 1,
+        retos_ganados = retos_ganados + 1
+    WHERE id_usuario = %s
+"""
+
+LOSER_STATS_SQL = """
+    UPDATE usuarios 
+    SET total_retos = total_retos + 1,
+        retos_perdidos = retos_perdidos + 1
+    WHERE id_usuario = %s
+"""
+
+# --- 🎮 JUEGO, PUNTOS Y PREMIOS ---
+
+CLAIM_DAILY_USER_SQL = "SELECT id_usuario, ultima_fecha_juego FROM usuarios WHERE id_usuario = %s"
+
+CLAIM_DAILY_SQL = """
+    UPDATE usuarios 
+    SET puntos_actuales = puntos_actuales + 10,
+        puntos_historicos = puntos_historicos + 10,
+        ultima_fecha_juego = %s
+    WHERE id_usuario = %s
+"""
+
+# Rango (no DATE()) para usar idx_game_sessions_usuario_fecha
+SESSIONS_TODAY_SQL = """
+    SELECT COUNT(*) as count FROM game_sessions 
+    WHERE id_usuario = %s 
+    AND fecha_inicio >= CURRENT_DATE
+"""
+
+SESSION_BY_TOKEN_SQL = """
+    SELECT id_session, id_usuario, fecha_expiracion, estado
+    FROM game_sessions
+    WHERE session_token = %s
+"""
+
+COMPLETE_SESSION_SQL = """
+    UPDATE game_sessions 
+    SET score_final = %s, estado = 'completed'
+    WHERE id_session = %s
+"""
+
+GAME_POINTS_TODAY_SQL = """
+    SELECT COALESCE(SUM(cantidad), 0) as total
+    FROM transacciones_puntos 
+    WHERE id_usuario = %s 
+      AND tipo_transaccion = 'game_score' 
+      AND fecha_creacion >= CURRENT_DATE
+"""
+
+GAME_STREAK_SQL = "SELECT ultimo_juego_fecha, racha_actual, mejor_puntaje FROM usuarios WHERE id_usuario = %s"
+
+AWARD_SCORE_SQL = """
+    UPDATE usuarios 
+    SET puntos_actuales = puntos_actuales + %s,
+        saldo_puntos = saldo_puntos + %s,  -- KEEP LEGACY IN SYNC
+        puntos_historicos = puntos_historicos + %s,
+        ultimo_juego_fecha = %s,
+        racha_actual = %s,
+        mejor_racha = GREATEST(mejor_racha, %s),
+        mejor_puntaje = GREATEST(COALESCE(mejor_puntaje, 0), %s) 
+    WHERE id_usuario = %s
+"""
+
+REWARDS_CATALOG_SQL = """
+    SELECT id_reward, nombre, descripcion, imagen, 
+           costo_puntos, marca, stock
+    FROM rewards
+    WHERE activo = true AND stock > 0
+    ORDER BY costo_puntos ASC
+"""
+
+REWARD_SQL = "SELECT costo_puntos, stock, nombre FROM rewards WHERE id_reward = %s"
+
+USER_POINTS_SQL = "SELECT puntos_actuales FROM usuarios WHERE id_usuario = %s"
+
+SPEND_POINTS_SQL = """
+    UPDATE usuarios 
+    SET puntos_actuales = puntos_actuales - %s
+    WHERE id_usuario = %s
+"""
+
+REWARD_STOCK_SQL = "UPDATE rewards SET stock = stock - 1 WHERE id_reward = %s"
+
+LEADERBOARD_SQL = """
+    SELECT id_usuario, nickname, avatar, comuna, puntos_historicos, mejor_racha, mejor_puntaje
+    FROM usuarios
+    ORDER BY mejor_puntaje DESC NULLS LAST
+    LIMIT 10
+"""
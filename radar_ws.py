@@ -0,0 +1,155 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import os
+import threading
+
+from geo import haversine_m
+from live_positions import live_store, profile_cache, skaters_nearby, skater_payload
+
+router = APIRouter()
+
+# ==========================================
+# 📡 RADAR EN VIVO POR WEBSOCKET
+# ==========================================
+# Protocolo (JSON):
+#   cliente -> {"type": "subscribe", "user_id": 7, "lat": -33.4, "lon": -70.6, "radius_m": 5000}
+#              (se puede volver a mandar para mover el área)
+#   servidor -> {"type": "snapshot", "skaters": [...]}   al suscribirse (reemplaza la lista)
+#               {"type": "enter", "skater": {...}}        entra al área (mismos campos que /api/radar)
+#               {"type": "move", "id_usuario", "latitude", "longitude"}
+#               {"type": "leave", "id_usuario"}           sale del área, se ocultó o expiró
+# Los eventos salen de los mismos latidos de update_gps / update_status,
+# vía los listeners del store en memoria. Con la tabla compartida los avisa
+# live_store.poll() (cada LIVE_POLL_INTERVAL), así que llegan también los
+# latidos que recibió otro worker.
+
+RADAR_WS_MAX_RADIUS_M = float(os.environ.get('RADAR_WS_MAX_RADIUS_M', 12000000))
+RADAR_WS_QUEUE_MAX = int(os.environ.get('RADAR_WS_QUEUE_MAX', 500))
+
+
+class RadarSubscription:
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(RADAR_WS_QUEUE_MAX)
+        self.user_id = None
+        self.lat = self.lon = self.radius_m = None
+        self.members = set()    # ids dentro del área según el hub (visibles o no)
+        self.overflow = False
+
+    def push(self, event):
+        """Solo desde el loop del WebSocket (vía call_soon_threadsafe)."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Cliente lento: se descartan deltas y se le manda un snapshot nuevo
+            self.overflow = True
+
+
+class RadarHub:
+    """Reparte los cambios del store a las suscripciones cuyo área tocan."""
+
+    def __init__(self):
+        self._subs = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, sub, user_id, lat, lon, radius_m):
+        members = set(live_store.nearby(lat, lon, radius_m, exclude_id=user_id)[0].tolist())
+        with self._lock:
+            sub.user_id, sub.lat, sub.lon, sub.radius_m = user_id, lat, lon, radius_m
+            sub.members = members
+            self._subs.add(sub)
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def on_change(self, event, user_id, lat, lon, visible):
+        """Listener del store: corre en el hilo del latido o del poll."""
+        deliveries = []
+        with self._lock:
+            for sub in self._subs:
+                if user_id == sub.user_id:
+                    continue
+                inside = (event == "update" and visible is not False
+                          and haversine_m(sub.lat, sub.lon, lat, lon) <= sub.radius_m)
+                if inside:
+                    sub.members.add(user_id)
+                    deliveries.append((sub, ("upsert", user_id, lat, lon, visible)))
+                elif user_id in sub.members:
+                    sub.members.discard(user_id)
+                    deliveries.append((sub, ("leave", user_id)))
+        for sub, ev in deliveries:
+            try:
+                sub.loop.call_soon_threadsafe(sub.push, ev)
+            except RuntimeError:
+                pass  # loop cerrado: la conexión ya se fue
+
+
+radar_hub = RadarHub()
+live_store.add_listener(radar_hub.on_change)
+
+
+async def _send_snapshot(websocket, sub, shown):
+    skaters, _ = await run_in_threadpool(skaters_nearby, sub.lat, sub.lon, sub.radius_m, sub.user_id)
+    shown.clear()
+    shown.update(s["id_usuario"] for s in skaters)
+    await websocket.send_json({"type": "snapshot", "skaters": skaters})
+
+
+async def _sender(websocket, sub):
+    shown = set()   # ids que el cliente tiene en pantalla
+    while True:
+        event = await sub.queue.get()
+        if sub.overflow:
+            while not sub.queue.empty():
+                sub.queue.get_nowait()
+            sub.overflow = False
+            event = ("snapshot",)
+
+        kind = event[0]
+        if kind == "snapshot":
+            await _send_snapshot(websocket, sub, shown)
+        elif kind == "leave":
+            if event[1] in shown:
+                shown.discard(event[1])
+                await websocket.send_json({"type": "leave", "id_usuario": event[1]})
+        elif kind == "upsert":
+            _, user_id, lat, lon, visible = event
+            if user_id in shown:
+                await websocket.send_json({"type": "move", "id_usuario": user_id,
+                                           "latitude": lat, "longitude": lon})
+                continue
+            profiles = await run_in_threadpool(profile_cache.get_many, [user_id])
+            skater = skater_payload(user_id, lat, lon, visible, profiles.get(user_id))
+            if skater is not None:
+                shown.add(user_id)
+                await websocket.send_json({"type": "enter", "skater": skater})
+
+
+@router.websocket("/ws/radar")
+async def radar_stream(websocket: WebSocket):
+    await websocket.accept()
+    sub = RadarSubscription(asyncio.get_running_loop())
+    sender = asyncio.create_task(_sender(websocket, sub))
+    try:
+        while True:
+            msg = await websocket.receive_json()
+            if msg.get("type") != "subscribe":
+                continue
+            try:
+                user_id = int(msg["user_id"])
+                lat, lon = float(msg["lat"]), float(msg["lon"])
+                radius_m = min(float(msg.get("radius_m", RADAR_WS_MAX_RADIUS_M)), RADAR_WS_MAX_RADIUS_M)
+            except (KeyError, TypeError, ValueError):
+                await websocket.send_json({"type": "error", "detail": "subscribe inválido"})
+                continue
+            await run_in_threadpool(radar_hub.subscribe, sub, user_id, lat, lon, radius_m)
+            sub.push(("snapshot",))
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"❌ Error en /ws/radar: {e}")
+    finally:
+        radar_hub.unsubscribe(sub)
+        sender.cancel()
@@ -0,0 +1,295 @@
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from proximity import (CellGrid, GRID_REBUILD_MIN, VISIBLE_UNKNOWN, chord_sq, chord_to_m,
+                       distance_order, radius_chord_sq, unit_vector, visible_flag, visible_value)
+
+# ==========================================
+# 🧠 TABLA DE POSICIONES EN MEMORIA COMPARTIDA
+# ==========================================
+# Con varios workers cada proceso solo ve los latidos que recibió él. Esta
+# tabla vive en un segmento de multiprocessing.shared_memory del host: todos
+# los workers escriben ahí y el radar lee la misma foto.
+#
+# Layout (columnas contiguas de LIVE_SHM_CAPACITY filas, 0 = slot libre):
+#   ids int64 | lat float64 | lon float64 | x, y, z float64 | last_seen float64 | seq uint64 | visible int8
+# (x, y, z: vector unitario de la posición, para la distancia sin trigonometría)
+# Cada fila se ubica por hash del id con sondeo lineal (máx. PROBE_LIMIT);
+# las filas vencidas hace más de reuse_after segundos se reutilizan.
+# Escrituras: un solo escritor a la vez (lock del proceso + flock entre
+# procesos) y seqlock por fila: seq impar mientras se escribe. Lecturas sin lock: se filtran y copian las filas
+# candidatas y se releen las que cambiaron de seq a mitad de la lectura.
+# Prefiltro: cada worker arma su propia CellGrid (proximity.py) sobre las
+# filas de la tabla. Las que cambiaron de seq desde entonces se revisan: si
+# siguen en la misma celda se dan por vistas, si no se consultan aparte hasta
+# el próximo rearmado.
+# Cambios para el radar en vivo: cada worker guarda su copia de seq/ids y
+# changes() compara contra la tabla; así ve también los latidos que
+# recibieron los otros workers.
+
+LIVE_SHM_NAME = os.environ.get('LIVE_SHM_NAME', 'skate_live_v2')
+LIVE_SHM_CAPACITY = int(os.environ.get('LIVE_SHM_CAPACITY', 262144))
+LIVE_SHM_LOCK = os.environ.get('LIVE_SHM_LOCK', f'/tmp/{LIVE_SHM_NAME}.lock')
+PROBE_LIMIT = 64
+READ_RETRIES = 5
+
+_COLUMNS = (("ids", np.int64), ("lat", np.float64), ("lon", np.float64),
+            ("x", np.float64), ("y", np.float64), ("z", np.float64),
+            ("last_seen", np.float64), ("seq", np.uint64), ("visible", np.int8))
+
+
+def _attach(name, size):
+    """Crea el segmento o se engancha al que ya creó otro worker."""
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        created = True
+    except FileExistsError:
+        shm = shared_memory.SharedMemory(name=name)
+        created = False
+    # En Python < 3.13 el resource_tracker borra el segmento cuando sale el
+    # proceso que lo abrió, aunque otros workers lo sigan usando.
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm, created
+
+
+class SharedLiveTable:
+    """Misma interfaz que ProximityIndex (upsert, set_visible, within, nearest,
+    remove_older_than) sobre la tabla compartida. Lecturas sin lock de escritura."""
+
+    lock_free_reads = True
+
+    def __init__(self, reuse_after, name=LIVE_SHM_NAME, capacity=LIVE_SHM_CAPACITY, lock_path=LIVE_SHM_LOCK):
+        self.capacity = capacity
+        self.reuse_after = reuse_after
+        self._thread_lock = threading.Lock()
+        self._lock_file = open(lock_path, "a+")
+        size = sum(np.dtype(dtype).itemsize * capacity for _, dtype in _COLUMNS)
+        with self._write_lock():
+            self._shm, created = _attach(name, size)
+        if self._shm.size < size:
+            raise RuntimeError(f"Segmento {name} con layout distinto ({self._shm.size} < {size} bytes)")
+
+        offset = 0
+        for column, dtype in _COLUMNS:
+            arr = np.ndarray((capacity,), dtype=dtype, buffer=self._shm.buf, offset=offset)
+            setattr(self, column, arr)
+            offset += arr.nbytes
+        self._slots = {}             # cache local id -> fila (se verifica contra ids)
+        self._expired_until = time.time()
+        self._seen_seq = self.seq.copy()   # última versión de cada fila que vio changes()
+        self._seen_ids = self.ids.copy()
+        self._grid = CellGrid()
+        self._grid_ready = False
+        self._grid_seq = np.zeros(capacity, dtype=np.uint64)    # versión de cada fila al ubicarla en la grilla
+        self._grid_cell = np.full(capacity, -1, dtype=np.int64)  # celda con que quedó en la grilla
+        self._grid_lock = threading.Lock()
+        if created:
+            print(f"🧠 Tabla compartida de posiciones creada ({capacity} filas, {size // 1024} KB)")
+
+    @contextmanager
+    def _write_lock(self):
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _find(self, user_id, stale_before=None):
+        """Fila del usuario; si no está y stale_before viene, una libre o vencida para ocuparla."""
+        i = self._slots.get(user_id)
+        if i is not None and self.ids[i] == user_id:
+            return i
+        start = (user_id * 2654435761) % self.capacity
+        reusable = None
+        for k in range(PROBE_LIMIT):
+            i = (start + k) % self.capacity
+            current = int(self.ids[i])
+            if current == user_id:
+                self._slots[user_id] = i
+                return i
+            if stale_before is not None and reusable is None and (
+                    current == 0 or self.last_seen[i] < stale_before):
+                reusable = i
+            if current == 0:
+                break  # nunca se escribió más allá: el id no está
+        return reusable
+
+    def _write(self, i, user_id, lat, lon, last_seen, visible):
+        self.seq[i] += 1          # impar: fila en escritura
+        self.ids[i] = user_id
+        self.lat[i] = lat
+        self.lon[i] = lon
+        self.x[i], self.y[i], self.z[i] = unit_vector(lat, lon)
+        self.last_seen[i] = last_seen
+        self.visible[i] = visible
+        self.seq[i] += 1          # par: fila consistente
+
+    def upsert(self, user_id, lat, lon, last_seen, visible=None, only_if_newer=False):
+        with self._write_lock():
+            i = self._find(user_id, stale_before=time.time() - self.reuse_after)
+            if i is None:
+                print(f"⚠️ Tabla compartida llena cerca del id {user_id}: latido no guardado")
+                return visible
+            if self.ids[i] != user_id:
+                flag = VISIBLE_UNKNOWN
+                self._slots[user_id] = i
+            else:
+                if only_if_newer and self.last_seen[i] >= last_seen:
+                    return visible_value(self.visible[i])
+                flag = int(self.visible[i])
+            if visible is not None:
+                flag = visible_flag(visible)
+            self._write(i, user_id, lat, lon, last_seen, flag)
+        return visible_value(flag)
+
+    def set_visible(self, user_id, visible):
+        with self._write_lock():
+            i = self._find(user_id)
+            if i is None:
+                return None
+            lat, lon, last_seen = float(self.lat[i]), float(self.lon[i]), float(self.last_seen[i])
+            self._write(i, user_id, lat, lon, last_seen, visible_flag(visible))
+        return lat, lon
+
+    def _rebuild_grid(self):
+        seq = self.seq.copy()   # antes de leer posiciones: lo que se escriba después se revisa
+        rows = np.flatnonzero(self.ids != 0)
+        cells = self._grid.cell_keys(self.lat[rows], self.lon[rows])
+        self._grid.build(cells, rows)
+        self._grid_cell[:] = -1
+        self._grid_cell[rows] = cells
+        self._grid_seq = seq
+        self._grid_ready = True
+
+    def _moved_rows(self):
+        """Filas que cambiaron de celda desde que se armó la grilla (la rearma si son muchas)."""
+        changed = np.flatnonzero(self.seq != self._grid_seq)
+        seq = self.seq[changed]
+        cells = self._grid.cell_keys(self.lat[changed], self.lon[changed])
+        settled = ((seq & 1) == 0) & (self.seq[changed] == seq)
+        same = settled & (cells == self._grid_cell[changed])
+        self._grid_seq[changed[same]] = seq[same]
+        moved = changed[~same]
+        if not self._grid_ready or len(moved) > max(GRID_REBUILD_MIN, len(self._grid.rows) // 8):
+            self._rebuild_grid()
+            return changed[:0]
+        return moved
+
+    def _candidate_rows(self, lat, lon, radius_m, cutoff):
+        if radius_m is None or self._grid.covers_all(lat, radius_m):
+            # Las filas libres (id 0) tienen last_seen = 0: pasarían un cutoff de 0
+            return np.flatnonzero((self.ids != 0) & (self.last_seen >= cutoff))
+        with self._grid_lock:
+            moved = self._moved_rows()
+            rows = self._grid.query(lat, lon, radius_m)
+        if len(moved):
+            flag = np.zeros(self.capacity, dtype=bool)
+            flag[moved] = True
+            rows = np.concatenate([rows[~flag[rows]], moved])
+        return rows
+
+    def _read(self, rows, center, limit, cutoff, exclude_id, k):
+        """Filtra las filas directo sobre la tabla (actividad, radio, k-vecinos)
+        y copia solo las que quedan. Devuelve (columnas de las que responden,
+        filas que un escritor tocó durante la lectura y hay que releer)."""
+        seq = self.seq[rows]
+        keep = (self.ids[rows] != 0) & (self.last_seen[rows] >= cutoff)
+        if exclude_id is not None:
+            keep &= self.ids[rows] != exclude_id
+        hit = rows[keep]
+        c2 = chord_sq(center, self.x[hit], self.y[hit], self.z[hit])
+        if limit is not None:
+            inside = c2 <= limit
+            hit, c2 = hit[inside], c2[inside]
+        if k is not None and k < len(hit):
+            top = np.argpartition(c2, k - 1)[:k]
+            hit, c2 = hit[top], c2[top]
+        found = {"ids": self.ids[hit], "lat": self.lat[hit], "lon": self.lon[hit],
+                 "visible": self.visible[hit], "c2": c2}
+        torn = rows[((seq & 1) == 1) | (self.seq[rows] != seq)]
+        if len(torn):
+            clean = ~np.isin(hit, torn)
+            found = {name: arr[clean] for name, arr in found.items()}
+        return found, torn
+
+    def _query(self, lat, lon, radius_m, cutoff, exclude_id, k=None):
+        """(ids, lats, lons, visible, dist) ordenados por (dist, id), consistentes por fila."""
+        rows = self._candidate_rows(lat, lon, radius_m, cutoff)
+        center = unit_vector(lat, lon)
+        limit = None if radius_m is None else radius_chord_sq(radius_m)
+        parts = []
+        for _ in range(READ_RETRIES + 1):
+            found, rows = self._read(rows, center, limit, cutoff, exclude_id, k)
+            parts.append(found)
+            if len(rows) == 0:
+                break
+        # Filas que siguen cambiando tras los reintentos: se omiten en esta consulta
+        found = {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+        c2 = found["c2"]
+        if k is not None and k < len(c2):
+            top = np.argpartition(c2, k - 1)[:k]
+            found = {name: arr[top] for name, arr in found.items()}
+        dist = chord_to_m(found["c2"])
+        order = distance_order(found["ids"], dist)
+        return found["ids"][order], found["lat"][order], found["lon"][order], found["visible"][order], dist[order]
+
+    def within(self, lat, lon, radius_m, cutoff=0.0, exclude_id=None):
+        return self._query(lat, lon, radius_m, cutoff, exclude_id)
+
+    def nearest(self, lat, lon, k, cutoff=0.0, exclude_id=None, radius_m=None):
+        return self._query(lat, lon, radius_m, cutoff, exclude_id, k)
+
+    def changes(self):
+        """Filas escritas (por cualquier worker) desde la llamada anterior.
+        Devuelve (actualizados [(id, lat, lon, visible)], desplazados [ids]):
+        desplazados son usuarios cuya fila vencida ocupó otro id."""
+        rows = np.flatnonzero(self.seq != self._seen_seq)
+        if len(rows) == 0:
+            return [], []
+        seq = self.seq[rows]
+        ids, lat, lon, visible = self.ids[rows], self.lat[rows], self.lon[rows], self.visible[rows]
+        # Filas a medio escribir o que cambiaron durante la copia: quedan para la próxima pasada
+        ok = ((seq & 1) == 0) & (self.seq[rows] == seq)
+        rows, seq, ids, lat, lon, visible = rows[ok], seq[ok], ids[ok], lat[ok], lon[ok], visible[ok]
+        previous = self._seen_ids[rows]
+        displaced = previous[(previous != 0) & (previous != ids)].tolist()
+        self._seen_seq[rows] = seq
+        self._seen_ids[rows] = ids
+        updated = [(uid, la, lo, visible_value(flag)) for uid, la, lo, flag
+                   in zip(ids.tolist(), lat.tolist(), lon.tolist(), visible.tolist())]
+        return updated, displaced
+
+    def remove_older_than(self, cutoff):
+        """No borra (las filas vencidas se reutilizan): devuelve los ids que
+        vencieron desde la pasada anterior de este proceso, para avisar 'remove'.
+        De paso suelta del cache local de filas a los vencidos y desplazados."""
+        since, self._expired_until = self._expired_until, cutoff
+        expired = (self.ids != 0) & (self.last_seen >= since) & (self.last_seen < cutoff)
+        if self._slots:
+            with self._thread_lock:
+                cached = np.fromiter(self._slots.keys(), dtype=np.int64, count=len(self._slots))
+                rows = np.fromiter(self._slots.values(), dtype=np.int64, count=len(self._slots))
+                gone = (self.ids[rows] != cached) | (self.last_seen[rows] < cutoff)
+                for uid in cached[gone].tolist():
+                    del self._slots[uid]
+        return self.ids[expired].tolist()
+
+    def __len__(self):
+        """Usuarios activos: las filas vencidas no se borran, solo se reutilizan."""
+        live = (self.ids != 0) & (self.last_seen >= time.time() - self.reuse_after)
+        return int(np.count_nonzero(live))
+
+    def close(self):
+        self._shm.close()
+        self._lock_file.close()
@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+
+# ==========================================
+# 🔔 CONTADORES DE NO LEÍDOS (BADGE)
+# ==========================================
+# El total por usuario vive en contadores_no_leidos (lo mantienen
+# send_message y mark_as_read en su transacción) y se sirve desde este cache.
+# Cada worker recibe por LISTEN todos los eventos 'unread' del inbox y con
+# eso mantiene su cache al día; el TTL es solo un respaldo.
+
+UNREAD_CACHE_TTL = float(os.environ.get('UNREAD_CACHE_TTL', 300))
+UNREAD_CACHE_MAX = int(os.environ.get('UNREAD_CACHE_MAX', 50000))
+
+UNREAD_TOTAL_SQL = "SELECT COALESCE((SELECT total FROM contadores_no_leidos WHERE id_usuario = {p}), 0)"
+
+
+class UnreadCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}   # id_usuario -> (guardado_en, total)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def set(self, user_id, total):
+        with self._lock:
+            if len(self._entries) >= self.max_entries and user_id not in self._entries:
+                # Lleno: se botan los vencidos; si no alcanza, se empieza de cero
+                now = time.monotonic()
+                self._entries = {u: e for u, e in self._entries.items() if now - e[0] <= self.ttl}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[user_id] = (time.monotonic(), total)
+
+
+unread_cache = UnreadCache(UNREAD_CACHE_TTL, UNREAD_CACHE_MAX)
+
+
+def unread_total(conn, user_id):
+    """Badge del usuario (psycopg2): cache o una lectura por PK, nunca mensajes."""
+    total = unread_cache.get(user_id)
+    if total is None:
+        cur = conn.cursor()
+        cur.execute(UNREAD_TOTAL_SQL.format(p="%s"), (user_id,))
+        total = cur.fetchone()[0]
+        unread_cache.set(user_id, total)
+    return total
+
+
+async def unread_total_async(conn, user_id):
+    total = unread_cache.get(user_id)
+    if total is None:
+        total = await conn.fetchval(UNREAD_TOTAL_SQL.format(p="$1"), user_id)
+        unread_cache.set(user_id, total)
+    return total